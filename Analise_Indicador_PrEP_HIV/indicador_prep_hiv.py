@@ -18,6 +18,9 @@ except ImportError:
     import visualizacao as viz
     import sociodemografico as socio
 
+# Caminho do projeto incluído por visualizacao (módulos de src/)
+from src.chart_cache import report_chart_cache
+
 # =============================================================================
 # CONFIGURAÇÕES E CAMINHOS
 # =============================================================================
@@ -428,6 +431,7 @@ def main():
         print("   Erro: Nenhuma capital ou dados do Brasil para AHA.")
 
     viz.gerar_grafico_brasil(Indicador_mes_BR, args.output_dir)
+    report_chart_cache()
     d = time.time() - start_time; print(f"\n--- CONCLUÍDO EM: {d/60:.2f} min ({d:.1f} s) ---")
 
 if __name__ == "__main__": main()
\ No newline at end of file
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import os
+import sys
 
 try:
     import pymannkendall as mk
@@ -9,6 +10,9 @@ except ImportError:
     mk = None
     print("[AVISO] Biblioteca 'pymannkendall' não encontrada. O teste de Mann-Kendall será pulado.")
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.chart_cache import cached_chart
+
 # =============================================================================
 # CONFIGURAÇÕES
 # =============================================================================
@@ -20,6 +24,9 @@ CORES_RACA = {
     'Ignorada/Não informada': '#7F7F7F' # Cinza
 }
 
+# Versão do desenho dos gráficos (chave do cache): incrementar ao alterar cores, rótulos ou layout
+ESTILO_VERSAO = 1
+
 # =============================================================================
 # FUNÇÕES DE HARMONIZAÇÃO
 # =============================================================================
@@ -92,6 +99,7 @@ def calcular_indicador_raca(df_prep_ativos, df_pvha_novos):
 # VISUALIZAÇÃO
 # =============================================================================
 
+@cached_chart(ESTILO_VERSAO)
 def gerar_grafico_raca(df_ind, output_folder):
     """
     Gera gráfico de barras para o indicador por raça.
@@ -125,10 +133,12 @@ def gerar_grafico_raca(df_ind, output_folder):
         plt.savefig(path_img, dpi=150)
         plt.close()
         print(f"   Gráfico salvo: {path_img}")
+        return path_img
         
     except Exception as e:
         print(f"   Erro ao gerar gráfico de raça: {e}")
 
+@cached_chart(ESTILO_VERSAO)
 def gerar_grafico_serie_raca(df_serie, output_folder, df_mk_resultados=None):
     """
     Gera gráfico de linhas da série histórica por raça com marcadores e títulos dinâmicos.
@@ -251,6 +261,7 @@ def gerar_grafico_serie_raca(df_serie, output_folder, df_mk_resultados=None):
         plt.savefig(path_img, dpi=150)
         plt.close()
         print(f"   Gráfico salvo: {path_img}")
+        return path_img
         
     except Exception as e:
         print(f"   Erro ao gerar gráfico de série raça: {e}")
@@ -307,6 +318,7 @@ def gerar_graficos_regionais_raca(dict_series, output_folder, dict_mk=None):
         
         _plotar_serie_raca_custom(df_serie, output_folder, df_mk, nome_regiao)
 
+@cached_chart(ESTILO_VERSAO)
 def _plotar_serie_raca_custom(df_serie, output_folder, df_mk, nome_regiao, serie_total_regional=None):
     """Versão interna adaptada da plotagem para regionalização com linha de benchmark."""
     output_dir = os.path.join(output_folder, "Graficos_Sociodemograficos")
@@ -406,13 +418,16 @@ def _plotar_serie_raca_custom(df_serie, output_folder, df_mk, nome_regiao, serie
         path_img = os.path.join(output_dir, f"serie_historica_raca_{nome_clean}.png")
         plt.savefig(path_img, dpi=150)
         print(f"      Gráfico salvo: {path_img}")
+        paths = [path_img]
 
         if nome_regiao == 'Brasil':
             path_legacy = os.path.join(output_dir, "serie_historica_raca.png")
             plt.savefig(path_legacy, dpi=150)
             print(f"      Gráfico salvo (legado): {path_legacy}")
+            paths.append(path_legacy)
         
         plt.close()
+        return paths
     except Exception as e:
         print(f"      Erro ao gerar gráfico {nome_regiao}: {e}")
 
@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
 import matplotlib.pyplot as plt
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import r2_score
@@ -11,11 +12,17 @@ except ImportError:
     mk = None
     print("[AVISO] Biblioteca 'pymannkendall' não encontrada. O teste de Mann-Kendall será pulado.")
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.chart_cache import cached_chart
+
 # =============================================================================
 # CORES E ESTILOS
 # =============================================================================
 CORES_BASE = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
 
+# Versão do desenho dos gráficos (chave do cache): incrementar ao alterar cores, rótulos ou layout
+ESTILO_VERSAO = 1
+
 def _configurar_plot():
     """Configuração padrão para gráficos (grid, spines, etc)."""
     plt.grid(True, linestyle='--', axis="y", linewidth=0.1, color="black")
@@ -29,6 +36,7 @@ def _configurar_plot():
 # GRÁFICOS
 # =============================================================================
 
+@cached_chart(ESTILO_VERSAO)
 def gerar_grafico_brasil(indicador_brasil, base_output_dir):
     """
     Gera gráfico de linha do indicador Brasil (Mensal).
@@ -82,6 +90,7 @@ def gerar_grafico_brasil(indicador_brasil, base_output_dir):
         plt.savefig(path_img, dpi=150)
         plt.close()
         print(f"   Gráfico salvo: {path_img}")
+        return path_img
         
     except Exception as e:
         print(f"   Erro ao gerar gráfico Brasil: {e}")
@@ -94,9 +103,16 @@ def gerar_analise_regioes(graf, base_output_dir):
     output_dir = os.path.join(base_output_dir, "Graficos")
     os.makedirs(output_dir, exist_ok=True)
     
+    _grafico_serie_regioes(graf, output_dir)
+    n = 18
+    _grafico_tendencia_regioes(graf, output_dir, n)
+
+    return _calcular_mann_kendall(graf, n)
+
+@cached_chart(ESTILO_VERSAO)
+def _grafico_serie_regioes(graf, output_dir):
+    """Gráfico 1: série histórica das regiões e Brasil."""
     cores = CORES_BASE * 3
-    
-    # --- GRÁFICO 1: SÉRIE HISTÓRICA ---
     try:
         plt.figure(figsize=(12, 6))
         i = len(graf) - 1
@@ -116,11 +132,14 @@ def gerar_analise_regioes(graf, base_output_dir):
         plt.savefig(path_img1)
         plt.close()
         print(f"   Gráfico salvo: {path_img1}")
+        return path_img1
     except Exception as e:
         print(f"   Erro ao gerar Gráfico Histórico Regiões: {e}")
 
-    # --- GRÁFICO 2: TENDÊNCIA 18 MESES ---
-    n = 18
+@cached_chart(ESTILO_VERSAO)
+def _grafico_tendencia_regioes(graf, output_dir, n=18):
+    """Gráfico 2: linhas de tendência (regressão linear) dos últimos n meses."""
+    cores = CORES_BASE * 3
     try:
         plt.figure(figsize=(12, 6))
         i = len(graf) - 1
@@ -159,12 +178,11 @@ def gerar_analise_regioes(graf, base_output_dir):
         plt.savefig(path_img2)
         plt.close()
         print(f"   Gráfico salvo: {path_img2}")
+        return path_img2
 
     except Exception as e:
         print(f"   Erro ao gerar Gráfico Tendência Regiões: {e}")
 
-    return _calcular_mann_kendall(graf, n)
-
 def gerar_analise_uf(graf, base_output_dir, map_siglas=None):
     """
     Gera gráficos e análises para UFs (Série Histórica, Tendência 12m, Mann-Kendall).
@@ -177,11 +195,23 @@ def gerar_analise_uf(graf, base_output_dir, map_siglas=None):
     output_dir = os.path.join(base_output_dir, "Graficos")
     if map_siglas is None: map_siglas = {}
     
+    _grafico_serie_uf(graf, output_dir, map_siglas)
+    n = 12
+    _grafico_tendencia_uf(graf, output_dir, map_siglas, n)
+
+    # Mann Kendall com nome customizado (Code - Sigla)
+    def custom_name_formatter(name):
+        sigla = map_siglas.get(str(name), "")
+        return f"{name} - {sigla}" if sigla else str(name)
+
+    return _calcular_mann_kendall(graf, n, name_formatter=custom_name_formatter)
+
+@cached_chart(ESTILO_VERSAO)
+def _grafico_serie_uf(graf, output_dir, map_siglas):
+    """Gráfico 1: série histórica por UF."""
     cores = CORES_BASE * 4 
     x_numeric = np.arange(len(graf.columns))
     x_labels = [str(c) for c in graf.columns]
-    
-    # --- GRÁFICO 1: SÉRIE HISTÓRICA UF ---
     try:
         plt.figure(figsize=(12, 8)) 
         i = len(graf) - 1
@@ -201,11 +231,15 @@ def gerar_analise_uf(graf, base_output_dir, map_siglas=None):
         plt.savefig(path_img1)
         plt.close()
         print(f"   Gráfico salvo: {path_img1}")
+        return path_img1
     except Exception as e:
         print(f"   Erro ao gerar Gráfico Histórico UF: {e}")
 
-    # --- GRÁFICO 2: TENDÊNCIA 12 MESES ---
-    n = 12
+@cached_chart(ESTILO_VERSAO)
+def _grafico_tendencia_uf(graf, output_dir, map_siglas, n=12):
+    """Gráfico 2: linhas de tendência por UF nos últimos n meses."""
+    cores = CORES_BASE * 4 
+    x_labels = [str(c) for c in graf.columns]
     try:
         plt.figure(figsize=(12, 8))
         i = len(graf) - 1
@@ -238,16 +272,10 @@ def gerar_analise_uf(graf, base_output_dir, map_siglas=None):
         plt.savefig(path_img2)
         plt.close()
         print(f"   Gráfico salvo: {path_img2}")
+        return path_img2
     except Exception as e:
         print(f"   Erro ao gerar Gráfico Tendência UF: {e}")
 
-    # Mann Kendall com nome customizado (Code - Sigla)
-    def custom_name_formatter(name):
-        sigla = map_siglas.get(str(name), "")
-        return f"{name} - {sigla}" if sigla else str(name)
-
-    return _calcular_mann_kendall(graf, n, name_formatter=custom_name_formatter)
-
 def gerar_analise_aha(graf, output_folder):
     """
     Gera gráficos e análises para o grupo AHA (Capitais + Brasil).
@@ -256,11 +284,18 @@ def gerar_analise_aha(graf, output_folder):
     output_dir = os.path.join(output_folder, "Graficos")
     os.makedirs(output_dir, exist_ok=True)
     
+    _grafico_serie_aha(graf, output_dir)
+    n = 12
+    _grafico_tendencia_aha(graf, output_dir, n)
+
+    return _calcular_mann_kendall(graf, n)
+
+@cached_chart(ESTILO_VERSAO)
+def _grafico_serie_aha(graf, output_dir):
+    """Gráfico 1: série histórica AHA (Brasil tracejado, rótulos no início e no fim)."""
     cores = CORES_BASE * 2
     x_numeric = np.arange(len(graf.columns))
     x_labels = [str(c) for c in graf.columns]
-    
-    # --- GRÁFICO 1: SÉRIE HISTÓRICA AHA ---
     try:
         plt.figure(figsize=(12, 8)) 
         i = len(graf) - 1
@@ -321,11 +356,15 @@ def gerar_analise_aha(graf, output_folder):
         plt.savefig(path_img1)
         plt.close()
         print(f"   Gráfico salvo: {path_img1}")
+        return path_img1
     except Exception as e:
         print(f"   Erro ao gerar Gráfico Histórico AHA: {e}")
 
-    # --- GRÁFICO 2: TENDÊNCIA AHA (12 meses) ---
-    n = 12
+@cached_chart(ESTILO_VERSAO)
+def _grafico_tendencia_aha(graf, output_dir, n=12):
+    """Gráfico 2: linhas de tendência AHA nos últimos n meses."""
+    cores = CORES_BASE * 2
+    x_labels = [str(c) for c in graf.columns]
     try:
         plt.figure(figsize=(12, 8))
         i = len(graf) - 1
@@ -356,11 +395,10 @@ def gerar_analise_aha(graf, output_folder):
         plt.savefig(path_img2)
         plt.close()
         print(f"   Gráfico salvo: {path_img2}")
+        return path_img2
     except Exception as e:
         print(f"   Erro ao gerar Gráfico Tendência AHA: {e}")
 
-    return _calcular_mann_kendall(graf, n)
-
 def _calcular_mann_kendall(graf, n, name_formatter=None):
     """Função auxiliar interna para teste Mann-Kendall."""
     df_mk_result = pd.DataFrame()
@@ -36,6 +36,9 @@ import re
 import sys, os
 from contextlib import contextmanager
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.ages import FAIXAS_ETARIAS, completed_years, faixas_idade
+
 
 
 @contextmanager
@@ -120,131 +123,20 @@ def idade_cat(DF:pd.DataFrame, data_ref:str, data_nasc:str = "data_nascimento",
     """
 
     if faixas_etarias is None:
-        faixas_etarias = [
-            (0, 13),
-            (13, 18),
-            (18, 25),
-            (25, 40),
-            (40, 60),
-            (60, 99)
-        ]
-
-    elif faixas_etarias == "MC_antigo":
-        faixas_etarias = [
-            (0, 2),
-            (2, 5),
-            (5, 9),
-            (9, 12),
-            (12, 18),
-            (18, 25),
-            (25, 30),
-            (30, 50),
-            (50, 99)
-        ]
-
-    elif faixas_etarias == "spectrum1":
-        faixas_etarias = [
-            (0, 5),
-            (5, 10),
-            (10, 15),
-            (15, 20),
-            (20, 25),
-            (25, 50),
-            (50, 99)
-        ]
-
-    elif faixas_etarias == "spectrum2":
-        faixas_etarias = [
-            (0, 5),
-            (5, 10),
-            (10, 15),
-            (15, 20),
-            (20, 25),
-            (25, 30),
-            (30, 35),
-            (35, 40),
-            (40, 45),
-            (45, 50),
-            (50, 55),
-            (55, 60),
-            (60, 65),
-            (65, 70),
-            (70, 75),
-            (75, 80),
-            (80, 99)
-        ]
-
-    elif faixas_etarias == "SAGE":
-        faixas_etarias = [
-            (0, 5),
-            (5, 10),
-            (10, 15),
-            (15, 20),
-            (20, 25),
-            (25, 30),
-            (30, 35),
-            (35, 40),
-            (40, 45),
-            (45, 50),
-            (50, 55),
-            (55, 60),
-            (60, 99)
-        ]
-
-    elif faixas_etarias == "spectrum_crianca":
-        faixas_etarias = [
-            (0, 15),
-            (15, 99)
-        ]
-
-    elif faixas_etarias == "Hep1":
-        faixas_etarias = [
-            (0, 3),
-            (3, 6),
-            (6, 12),
-            (12, 20),
-            (20, 30),
-            (30, 40),
-            (40, 50),
-            (50, 60),
-            (60, 70),
-            (70, 99)
-        ]
-
-    elif faixas_etarias == "Hep2":
-        faixas_etarias = [
-            (0, 20),
-            (20, 30),
-            (30, 40),
-            (40, 50),
-            (50, 60),
-            (60, 70),
-            (70, 99)
-        ]
-
-    elif faixas_etarias == "Hep3":
-        faixas_etarias = [
-            (0, 30),
-            (30, 50),
-            (50, 99)
-        ]
+        faixas_etarias = FAIXAS_ETARIAS["padrao"]
+    elif isinstance(faixas_etarias, str):
+        faixas_etarias = FAIXAS_ETARIAS[faixas_etarias]
 
     DF[data_ref] = pd.to_datetime(DF[data_ref],errors='coerce')
     DF[data_nasc] = pd.to_datetime(DF[data_nasc],errors='coerce')
     DF[data_ref] = DF[data_ref].dt.normalize()
     DF[data_nasc] = DF[data_nasc].dt.normalize()
     
-    DF[f"Idade_{data_ref}"] = (DF[data_ref] - DF[data_nasc]).dt.days/365
-
-    Cond_idadecat = []
-    Idade_escolhacat = []
+    # Idade em anos completos e faixas pelo motor comum (src/ages.py)
+    anos, valido = completed_years(DF[data_nasc], DF[data_ref])
+    DF[f"Idade_{data_ref}"] = pd.Series(anos, index=DF.index).where(valido)
 
-    for limite_inferior, limite_superior in faixas_etarias:
-        Cond_idadecat.append((DF[f"Idade_{data_ref}"] >= limite_inferior) & (DF[f"Idade_{data_ref}"] < limite_superior))
-        Idade_escolhacat.append(f"{limite_inferior} a {limite_superior-1} anos")
-    Idade_escolhacat[0] = f"Menos de {faixas_etarias[0][1]} anos"
-    Idade_escolhacat[-1] = f"Mais de {limite_inferior} anos"
-    return np.select(Cond_idadecat, Idade_escolhacat, default = "Não Informado")
+    return faixas_idade(anos, valido, faixas_etarias)
 
 
 
@@ -277,14 +169,19 @@ def tabela_freq(x:pd.DataFrame,y:str, total:str = "Total"):
     total: Nome da coluna que será gerada com a soma total.
     
     """
-    df = pd.DataFrame(x[y].value_counts(dropna = False).sort_index())
-    df["Freq_Val"] = pd.DataFrame(x[y].value_counts(dropna = True).sort_index())
-    df["Freq_Rel"] = pd.DataFrame((x[y].value_counts(normalize = True, dropna = False)*100).round(2).sort_index())
-    df["Freq_Rel_Val"] = pd.DataFrame((x[y].value_counts(normalize = True)*100).round(2).sort_index())
+    # Uma única contagem (com nulos); as demais colunas são derivadas dela
+    contagem = x[y].value_counts(dropna = False).sort_index()
+    validos = contagem[contagem.index.notna()]
+    perc_validos = validos / validos.sum() * 100
+
+    df = pd.DataFrame(contagem)
+    df["Freq_Val"] = validos
+    df["Freq_Rel"] = (contagem / contagem.sum() * 100).round(2)
+    df["Freq_Rel_Val"] = perc_validos.round(2)
     soma = df.sum()
     soma.name = total
     df = pd.concat([df, pd.DataFrame(soma).T], axis=0)  # Substitui a linha df = df.append(soma) 
-    df["Freq_Rel_Acum"] = pd.DataFrame((x[y].value_counts(normalize = True)*100).sort_index().cumsum().round(2))
+    df["Freq_Rel_Acum"] = perc_validos.cumsum().round(2)
     df.rename(columns = {"count":y}, inplace = True)
     return df
 
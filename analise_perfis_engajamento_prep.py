@@ -16,6 +16,8 @@ sys.path.append(os.getcwd())
 
 from src.data_loader import carregar_bases
 from src.cleaning import clean_disp_df, process_cadastro
+from src.episodes import build_episodes, get_episodes
+from src.ages import age_bands
 # Importar função correta para cálculo de populações e enriquecimento
 try:
     from src.preprocessing import calculate_population_groups, enrich_disp_data
@@ -23,13 +25,17 @@ except ImportError:
     print("ERRO CRÍTICO: Não foi possível importar calculate_population_groups ou enrich_disp_data")
     sys.exit(1)
 
-def classificar_comportamento(df_disp, data_fechamento):
+def classificar_comportamento(df_disp, data_fechamento, df_episodios=None):
     """
     Classifica cada paciente em: 'Sustentado', 'Cíclico', 'Drop-out'.
+    Usa os episódios de uso contínuo (src/episodes.py); se não forem informados, são segmentados aqui.
     """
     print("Classificando comportamento longitudinal...")
     hoje_dt = pd.to_datetime(data_fechamento).normalize()
     
+    if df_episodios is None:
+        df_episodios = build_episodes(df_disp, data_fechamento)
+    
     # --- FILTRO 1: Remover quem já fez PrEP Sob Demanda ---
     if 'tp_modalidade' in df_disp.columns:
         modalidades = df_disp['tp_modalidade'].astype(str).str.lower()
@@ -40,39 +46,30 @@ def classificar_comportamento(df_disp, data_fechamento):
 
     # --- FILTRO 2: Remover Iniciantes Recentes (< 6 meses de seguimento) ---
     data_corte_inicio = hoje_dt - pd.to_timedelta(180, unit='D')
-    grp_inicio = df_disp.groupby('codigo_pac_eleito')['dt_disp'].min()
+    grp_inicio = df_episodios[df_episodios['episodio'] == 1].set_index('codigo_pac_eleito')['dt_inicio']
     pacs_recentes = grp_inicio[grp_inicio > data_corte_inicio].index
+    pacs_recentes = pacs_recentes[pacs_recentes.isin(df_disp['codigo_pac_eleito'])]
     print(f"Excluindo {len(pacs_recentes)} usuários iniciantes recentes (início após {data_corte_inicio.date()}).")
     df_disp = df_disp[~df_disp['codigo_pac_eleito'].isin(pacs_recentes)]
     
     # Ordenar
     df_disp = df_disp.sort_values(['codigo_pac_eleito', 'dt_disp'])
     
-    # Calcular validade
-    if 'duracao_sum' not in df_disp.columns:
-        duracao = df_disp['duracao'] if 'duracao' in df_disp.columns else 30
-    else:
-        duracao = df_disp['duracao_sum']
-        
-    df_disp['valid_until'] = df_disp['dt_disp'] + pd.to_timedelta(duracao * 1.4, unit='D')
-    
-    # Gaps > 30 dias
-    df_disp['prev_valid_until'] = df_disp.groupby('codigo_pac_eleito')['valid_until'].shift(1)
-    gap_margin = pd.to_timedelta(30, unit='D')
-    df_disp['has_gap'] = df_disp['dt_disp'] > (df_disp['prev_valid_until'] + gap_margin)
+    # Episódios dos pacientes mantidos
+    all_pacs = df_disp['codigo_pac_eleito'].unique()
+    episodios = df_episodios[df_episodios['codigo_pac_eleito'].isin(all_pacs)]
     
     # Identificar perfis
-    pacientes_ciclicos = df_disp.loc[df_disp['has_gap'], 'codigo_pac_eleito'].unique()
-    
-    last_disp = df_disp.sort_values('dt_disp').drop_duplicates('codigo_pac_eleito', keep='last')
+    # Cíclico: mais de um episódio (dispensa > 30 dias após o fim da cobertura da anterior)
+    pacientes_ciclicos = episodios.loc[episodios['episodio'] > 1, 'codigo_pac_eleito'].unique()
     
-    # Critério de Abandono (180 dias)
+    # Critério de Abandono (180 dias): cobertura do último episódio
     limite_abandono = hoje_dt - pd.to_timedelta(180, unit='D')
-    is_active_retention = last_disp['valid_until'] >= limite_abandono
-    pacientes_ativos_now = last_disp.loc[is_active_retention, 'codigo_pac_eleito'].unique()
+    last_ep = episodios.sort_values(['codigo_pac_eleito', 'episodio']).drop_duplicates('codigo_pac_eleito', keep='last')
+    is_active_retention = last_ep['dt_fim_cobertura'] >= limite_abandono
+    pacientes_ativos_now = last_ep.loc[is_active_retention, 'codigo_pac_eleito'].unique()
     
     # Montar DataFrame
-    all_pacs = df_disp['codigo_pac_eleito'].unique()
     classification = pd.DataFrame({'codigo_pac_eleito': all_pacs})
     
     conditions = [
@@ -89,9 +86,9 @@ def classificar_comportamento(df_disp, data_fechamento):
     classification = classification.merge(regiao_map, on='codigo_pac_eleito', how='left')
     
     # Adicionar Ano de Início
-    first_disp = df_disp.sort_values('dt_disp').drop_duplicates('codigo_pac_eleito', keep='first')[['codigo_pac_eleito', 'dt_disp']]
-    first_disp['ano_inicio'] = first_disp['dt_disp'].dt.year
-    classification = classification.merge(first_disp[['codigo_pac_eleito', 'ano_inicio']], on='codigo_pac_eleito', how='left')
+    first_ep = episodios[episodios['episodio'] == 1][['codigo_pac_eleito', 'dt_inicio']].copy()
+    first_ep['ano_inicio'] = first_ep['dt_inicio'].dt.year
+    classification = classification.merge(first_ep[['codigo_pac_eleito', 'ano_inicio']], on='codigo_pac_eleito', how='left')
 
     return classification
 
@@ -229,8 +226,9 @@ def main():
         df_cad_prep = calculate_population_groups(df_cad_prep)
     except: pass
 
-    # 3. Classificação
-    df_classificacao = classificar_comportamento(df_disp_semdupl, DATA_FECHAMENTO)
+    # 3. Classificação (episódios persistidos pelo pipeline principal, se existirem)
+    df_episodios = get_episodes(df_disp_semdupl, DATA_FECHAMENTO)
+    df_classificacao = classificar_comportamento(df_disp_semdupl, DATA_FECHAMENTO, df_episodios)
     
     # 4. Merge
     df_final = df_classificacao.merge(df_cad_prep, on='codigo_pac_eleito', how='left')
@@ -239,10 +237,9 @@ def main():
     hoje = pd.to_datetime(DATA_FECHAMENTO)
     if 'data_nascimento' in df_final.columns:
         df_final['data_nascimento'] = pd.to_datetime(df_final['data_nascimento'], errors='coerce')
-        df_final['idade'] = (hoje - df_final['data_nascimento']) / pd.to_timedelta(365.25, unit='D')
-        bins = [0, 18, 24, 29, 39, 49, 100]
-        labels = ['<18', '18-24', '25-29', '30-39', '40-49', '50+']
-        df_final['faixa_etaria'] = pd.cut(df_final['idade'], bins=bins, labels=labels)
+        idades = age_bands(df_final['data_nascimento'], hoje, esquemas=['faixa_etaria'])
+        df_final['idade'] = idades['idade']
+        df_final['faixa_etaria'] = idades['faixa_etaria']
     
     # 5. Descritiva Simples
     print("\n>>> PERFIL (%) POR POPULAÇÃO <<<")
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import os
 import sys
+from src.prep_store import read_prep, prep_exists
 
 # Define file paths
 PREP_FILE = 'df_prep_consolidado.csv'
@@ -10,19 +11,19 @@ TARV_FILE = r'//SAP109/Bancos AMA/Arquivos Atuais/Bancos Atuais HIV/Mensais/PVHA
 
 def load_data():
     print(">>> Loading PrEP data...")
-    if not os.path.exists(PREP_FILE):
+    if not prep_exists(PREP_FILE):
         print(f"Error: PrEP file not found at {PREP_FILE}")
         sys.exit(1)
         
     # Load PrEP
     # We need Cod_unificado for merging and dates for analysis
     cols_prep = ['Cod_unificado', 'dt_disp_max', 'dt_disp_min'] 
-    try:
-        df_prep = pd.read_csv(PREP_FILE, sep=';', encoding='latin-1', usecols=lambda c: c in cols_prep)
-    except ValueError:
-        # Fallback if columns missing, read all to debug or try to find equivalents
-        print("Warning: Specific columns not found in PrEP, reading first 5 rows to debug...")
-        df_temp = pd.read_csv(PREP_FILE, sep=';', encoding='latin-1', nrows=5)
+    df_prep = read_prep(PREP_FILE, columns=cols_prep, encoding='latin-1')
+    # read_prep skips missing columns (Parquet and CSV), so check them explicitly
+    missing = [c for c in cols_prep if c not in df_prep.columns]
+    if missing:
+        print(f"Error: Columns not found in PrEP: {missing}. Reading first 5 rows to debug...")
+        df_temp = read_prep(PREP_FILE, nrows=5, encoding='latin-1')
         print(f"Available columns: {list(df_temp.columns)}")
         sys.exit(1)
 
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import os
 import sys
+from src.prep_store import read_prep, prep_exists
 
 try:
     import win32com.client
@@ -22,11 +23,11 @@ def load_and_merge():
         'Pop_genero_pratica', 'fetar', 'raca4_cat', 'escol4', 'uf_residencia'
     ]
     # Check if files exist
-    if not os.path.exists(PREP_FILE):
+    if not prep_exists(PREP_FILE):
         print(f"Erro: Arquivo PrEP não encontrado: {PREP_FILE}")
         sys.exit(1)
         
-    df_prep = pd.read_csv(PREP_FILE, sep=';', encoding='latin-1', usecols=lambda c: c in cols_prep)
+    df_prep = read_prep(PREP_FILE, columns=cols_prep, encoding='latin-1')
     
     # 2. Load TARV
     cols_tarv = ['Cod_unificado', 'data_dispensa_prim']
@@ -1,10 +1,11 @@
 import pandas as pd
 import pickle
 import sys
+from src.prep_store import read_prep
 
 # 1. Load PrEP Data
 try:
-    df_prep = pd.read_csv('df_prep_consolidado.csv', sep=';', encoding='latin1', low_memory=False)
+    df_prep = read_prep('df_prep_consolidado.csv', encoding='latin1', low_memory=False)
     print("PrEP Columns:", df_prep.columns.tolist())
 except Exception as e:
     print(f"Error reading PrEP CSV: {e}")
@@ -2,6 +2,8 @@ import pandas as pd
 import sys
 import os
 import argparse
+from src.prep_store import prep_exists
+from src.query import QueryError, parse_filter, evaluate_filter, read_for_query
 
 def check_frequency(column_name, filter_expr=None, file_path='df_prep_consolidado.csv'):
     """
@@ -20,31 +22,37 @@ def check_frequency(column_name, filter_expr=None, file_path='df_prep_consolidad
     4. Com filtro de valor (ex: ano > 2020):
        python check_data.py mes_disp --filter "ano_disp > 2020"
     """
-    if not os.path.exists(file_path):
+    if not prep_exists(file_path):
         print(f"Erro: O arquivo '{file_path}' não foi encontrado.")
         return
 
     print(f"Lendo base local: {file_path}...")
     
     try:
-        # Se tiver filtro, precisamos carregar as colunas usadas no filtro também
-        # Como é difícil saber quais são sem analisar a string, carregamos tudo (ainda é rápido para 300k linhas)
-        # Se performance for crítica, podemos otimizar depois.
-        df = pd.read_csv(file_path, sep=';', low_memory=False)
+        # Só a coluna pedida e as citadas no filtro; as condições simples do filtro já descartam
+        # linhas (e row groups inteiros do Parquet) na leitura
+        try:
+            node = parse_filter(filter_expr) if filter_expr else None
+        except QueryError as e:
+            print(f"Erro no filtro: {e}")
+            print("Dica: Use sintaxe Pandas, ex: 'coluna == \"Valor\"' ou 'coluna.isna()'")
+            return
+        df, original_len = read_for_query(file_path, [column_name], node)
         
         # Aplicar Filtro se houver
         if filter_expr:
             print(f"Aplicando filtro: {filter_expr}")
-            original_len = len(df)
             try:
-                # pandas query engine usa sintaxe python-like ou sql-like
-                # Para isna() funcionar no query, usamos engine='python'
-                df = df.query(filter_expr, engine='python')
-                print(f"Linhas filtradas: {len(df)} (de {original_len})")
-            except Exception as e:
-                print(f"Erro no filtro: {e}")
-                print("Dica: Use sintaxe Pandas, ex: 'coluna == \"Valor\"' ou 'coluna.isna()'")
-                return
+                df = df[evaluate_filter(node, df)]
+            except QueryError:
+                # Expressões fora do motor de src/query (ex: .dt.year) continuam no df.query do pandas
+                try:
+                    df = df.query(filter_expr, engine='python')
+                except Exception as e:
+                    print(f"Erro no filtro: {e}")
+                    print("Dica: Use sintaxe Pandas, ex: 'coluna == \"Valor\"' ou 'coluna.isna()'")
+                    return
+            print(f"Linhas filtradas: {len(df)} (de {original_len})")
 
         if column_name not in df.columns:
             print(f"Erro: A coluna '{column_name}' não existe.")
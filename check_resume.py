@@ -0,0 +1,69 @@
+import io
+import re
+import sys
+import argparse
+import subprocess
+from contextlib import redirect_stdout
+
+def run_main(arguments, use_service):
+    """Executa src.main (no serviço local ou num processo novo). Retorna (código de saída, saída)."""
+    if use_service:
+        from src.service import send
+        buffer = io.StringIO()
+        with redirect_stdout(buffer):
+            code = send('main', arguments)
+        return code, buffer.getvalue()
+    result = subprocess.run([sys.executable, "-m", "src.main", "--auto"] + arguments, capture_output=True, text=True)
+    return result.returncode, result.stdout + result.stderr
+
+def check_resume(data_fechamento, use_service=False, output_dir=None):
+    """
+    Duas execuções seguidas das etapas de dados (até as métricas do PPT): a primeira grava os
+    checkpoints e a segunda deve retomar todas as etapas com checkpoint, sem recalculá-las.
+
+    Exemplos de uso:
+    1. Sem serviço (dois processos: --checkpoint e depois --resume):
+       python check_resume.py --data_fechamento 2025-09-30
+
+    2. Com o serviço local aberto (main --recalcular e depois main):
+       python check_resume.py --data_fechamento 2025-09-30 --servico
+    """
+    from src.main import STAGES
+    from src.pipeline import select_stages
+    alvos = ['metricas_ppt']
+    esperadas = [s['name'] for s in select_stages(STAGES, alvos, available=['args', 'graficos_ppt']) if s['checkpoint']]
+    base_args = ['--data_fechamento', data_fechamento, '--alvos'] + alvos
+    if output_dir:
+        base_args += ['--output_dir', output_dir]
+
+    print(f"1ª execução (grava checkpoints de: {', '.join(esperadas)})...")
+    code, _ = run_main(base_args + ['--recalcular' if use_service else '--checkpoint'], use_service)
+    if code is None:
+        print("Serviço não está em execução. Inicie com: python -m src.service iniciar")
+        return False
+    if code != 0:
+        print(f"Erro: A 1ª execução terminou com código {code}.")
+        return False
+
+    print("2ª execução (deve retomar dos checkpoints)...")
+    code, saida = run_main(base_args + ([] if use_service else ['--resume']), use_service)
+    if code != 0:
+        print(f"Erro: A 2ª execução terminou com código {code}.")
+        return False
+
+    retomadas = set(re.findall(r"\[Etapa (\w+)\] retomada do checkpoint", saida))
+    executadas = set(re.findall(r"\[Etapa (\w+)\] concluída", saida))
+    for nome in esperadas:
+        print(f"  {nome}: {'retomada' if nome in retomadas else 'RECALCULADA'}")
+    ok = all(nome in retomadas and nome not in executadas for nome in esperadas)
+    print("OK: todas as etapas com checkpoint foram retomadas." if ok else
+          "Falha: etapas com checkpoint recalculadas na 2ª execução (chave mudou entre as execuções).")
+    return ok
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Confere se uma 2ª execução retoma as etapas de dados dos checkpoints")
+    parser.add_argument("--data_fechamento", required=True, help="Data de fechamento no formato YYYY-MM-DD")
+    parser.add_argument("--servico", action="store_true", help="Executa pelo serviço local (python -m src.service iniciar)")
+    parser.add_argument("--output_dir", default=None, help="Diretório de saída repassado a src.main (padrão: o de src.main)")
+    args = parser.parse_args()
+    sys.exit(0 if check_resume(args.data_fechamento, args.servico, args.output_dir) else 1)
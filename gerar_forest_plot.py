@@ -13,6 +13,7 @@ try:
     from analise_perfis_engajamento_prep import classificar_comportamento, executar_regressao_multinomial
     from src.data_loader import carregar_bases
     from src.cleaning import clean_disp_df, process_cadastro
+    from src.ages import age_bands
     from src.preprocessing import calculate_population_groups, enrich_disp_data
 except ImportError as e:
     print(f"Erro ao importar módulos: {e}")
@@ -145,10 +146,9 @@ def main():
     hoje = pd.to_datetime(DATA_FECHAMENTO)
     if 'data_nascimento' in df_final.columns:
         df_final['data_nascimento'] = pd.to_datetime(df_final['data_nascimento'], errors='coerce')
-        df_final['idade'] = (hoje - df_final['data_nascimento']) / pd.to_timedelta(365.25, unit='D')
-        bins = [0, 18, 24, 29, 39, 49, 100]
-        labels = ['<18', '18-24', '25-29', '30-39', '40-49', '50+']
-        df_final['faixa_etaria'] = pd.cut(df_final['idade'], bins=bins, labels=labels)
+        idades = age_bands(df_final['data_nascimento'], hoje, esquemas=['faixa_etaria'])
+        df_final['idade'] = idades['idade']
+        df_final['faixa_etaria'] = idades['faixa_etaria']
 
     # 3. Executar Regressão
     print(">>> 3. Executando Regressão...")
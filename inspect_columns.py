@@ -1,14 +1,15 @@
 import pandas as pd
 import os
+from src.prep_store import read_prep, prep_exists
 
 file_path = 'df_prep_consolidado.csv'
 
-if not os.path.exists(file_path):
+if not prep_exists(file_path):
     print(f"File not found: {file_path}")
 else:
     try:
         # Read only the first few rows to inspect columns
-        df = pd.read_csv(file_path, sep=';', nrows=5, encoding='latin-1') # Try latin-1 first as it's common in these datasets
+        df = read_prep(file_path, nrows=5, encoding='latin-1') # Parquet se existir; senão CSV (latin-1 primeiro, comum nessas bases)
         print("Columns:")
         for col in df.columns:
             print(col)
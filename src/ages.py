@@ -0,0 +1,117 @@
+import pandas as pd
+import numpy as np
+
+# -----------------------------------------------------------------------------
+# IDADE NA DATA DE REFERÊNCIA
+# Idade em anos completos (aniversário já ocorrido) calculada sobre números de dia
+# int32, e todas as faixas etárias usadas no projeto a partir da mesma idade.
+# -----------------------------------------------------------------------------
+
+# Faixas no formato de funcoes_gerais.idade_cat: (limite inferior incluído, limite superior excluído)
+FAIXAS_ETARIAS = {
+    'padrao': [(0, 13), (13, 18), (18, 25), (25, 40), (40, 60), (60, 99)],
+    'MC_antigo': [(0, 2), (2, 5), (5, 9), (9, 12), (12, 18), (18, 25), (25, 30), (30, 50), (50, 99)],
+    'spectrum1': [(0, 5), (5, 10), (10, 15), (15, 20), (20, 25), (25, 50), (50, 99)],
+    'spectrum2': [(0, 5), (5, 10), (10, 15), (15, 20), (20, 25), (25, 30), (30, 35), (35, 40), (40, 45), (45, 50),
+                  (50, 55), (55, 60), (60, 65), (65, 70), (70, 75), (75, 80), (80, 99)],
+    'SAGE': [(0, 5), (5, 10), (10, 15), (15, 20), (20, 25), (25, 30), (30, 35), (35, 40), (40, 45), (45, 50),
+             (50, 55), (55, 60), (60, 99)],
+    'spectrum_crianca': [(0, 15), (15, 99)],
+    'Hep1': [(0, 3), (3, 6), (6, 12), (12, 20), (20, 30), (30, 40), (40, 50), (50, 60), (60, 70), (70, 99)],
+    'Hep2': [(0, 20), (20, 30), (30, 40), (40, 50), (50, 60), (60, 70), (70, 99)],
+    'Hep3': [(0, 30), (30, 50), (50, 99)]
+}
+SEM_FAIXA = "Não Informado"
+
+# Faixas categóricas (ordenadas): limites inferiores de cada rótulo (None = sem limite) e limite superior excluído
+FAIXAS_CATEGORICAS = {
+    # df PrEP / cubo / relatórios
+    'fetar': ([None, 18, 25, 30, 40, 50], ['<18', '18 a 24', '25 a 29', '30 a 39', '40 a 49', '50 e mais'], None),
+    # Análise de perfis de engajamento
+    'faixa_etaria': ([0, 18, 25, 30, 40, 50], ['<18', '18-24', '25-29', '30-39', '40-49', '50+'], 100)
+}
+
+def day_numbers(values):
+    """
+    Datas -> número de dias desde 1970-01-01 (int32) e máscara de datas válidas.
+    Aceita Series, arrays, listas ou uma data única (escalar).
+    """
+    if not pd.api.types.is_datetime64_any_dtype(getattr(values, 'dtype', None)):
+        values = pd.to_datetime(values, errors='coerce')
+    arr = np.atleast_1d(np.asarray(values, dtype='datetime64[ns]'))
+    valid = ~np.isnat(arr)
+    days = (arr.view(np.int64) // 86_400_000_000_000).astype(np.int32)
+    days[~valid] = 0
+    return days, valid
+
+def _civil_from_days(days):
+    """Ano, mês e dia (int32) a partir dos números de dia (calendário gregoriano proléptico)."""
+    z = days + np.int32(719468)
+    era = np.floor_divide(z, 146097)
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    dia = doy - (153 * mp + 2) // 5 + 1
+    mes = np.where(mp < 10, mp + 3, mp - 9)
+    ano = yoe + era * 400 + (mes <= 2)
+    return ano.astype(np.int32), mes.astype(np.int32), dia.astype(np.int32)
+
+def completed_years(data_nasc, data_ref):
+    """
+    Idade em anos completos na data de referência (única ou uma por registro).
+    Retorna (anos int32, máscara de idade válida). Nascidos em 29/02 completam ano em 01/03 nos anos não bissextos.
+    """
+    d_nasc, ok_nasc = day_numbers(data_nasc)
+    d_ref, ok_ref = day_numbers(data_ref)
+    ano_n, mes_n, dia_n = _civil_from_days(d_nasc)
+    ano_r, mes_r, dia_r = _civil_from_days(d_ref)
+
+    antes_aniversario = (mes_r * 32 + dia_r) < (mes_n * 32 + dia_n)
+    anos = (ano_r - ano_n - antes_aniversario).astype(np.int32)
+    return np.broadcast_to(anos, np.broadcast(ok_nasc, ok_ref).shape), ok_nasc & ok_ref
+
+def faixas_idade(anos, valid, faixas):
+    """Rótulos no formato de funcoes_gerais.idade_cat (fora das faixas ou sem idade: 'Não Informado')."""
+    faixas = sorted(faixas)
+    inferiores = np.array([f[0] for f in faixas])
+    superiores = np.array([f[1] for f in faixas])
+    rotulos = [f"{inf} a {sup - 1} anos" for inf, sup in faixas]
+    rotulos[0] = f"Menos de {faixas[0][1]} anos"
+    rotulos[-1] = f"Mais de {faixas[-1][0]} anos"
+
+    idx = np.searchsorted(inferiores, anos, side='right') - 1
+    idx_ok = np.clip(idx, 0, len(faixas) - 1)
+    dentro = valid & (idx >= 0) & (anos < superiores[idx_ok])
+    return np.where(dentro, np.array(rotulos, dtype=object)[idx_ok], SEM_FAIXA)
+
+def faixas_categoricas(anos, valid, esquema):
+    """Faixa categórica ordenada (como pd.cut com rótulos); fora das faixas ou sem idade: NaN."""
+    inferiores, rotulos, superior = FAIXAS_CATEGORICAS[esquema]
+    limites = np.array([x for x in inferiores if x is not None])
+    codes = np.searchsorted(limites, anos, side='right') - (inferiores[0] is not None)
+    fora = ~valid | (codes < 0)
+    if superior is not None:
+        fora |= anos >= superior
+    codes = np.where(fora, -1, codes)
+    return pd.Categorical.from_codes(codes, categories=rotulos, ordered=True)
+
+def age_bands(data_nasc, data_ref, esquemas=('fetar',), coluna_idade='idade'):
+    """
+    Idade em anos completos (Int64) e as faixas pedidas numa única chamada.
+    `esquemas`: nomes de FAIXAS_CATEGORICAS (ex: 'fetar') e/ou de FAIXAS_ETARIAS (ex: 'MC_antigo', 'spectrum1').
+    `data_ref`: data única ou uma por registro. Retorna DataFrame com o índice de `data_nasc` (se Series).
+    """
+    anos, valid = completed_years(data_nasc, data_ref)
+    index = data_nasc.index if isinstance(data_nasc, pd.Series) else None
+
+    out = pd.DataFrame(index=index if index is not None else pd.RangeIndex(len(anos)))
+    out[coluna_idade] = pd.arrays.IntegerArray(np.where(valid, anos, 0).astype(np.int64), ~valid)
+    for esquema in esquemas:
+        if esquema in FAIXAS_CATEGORICAS:
+            out[esquema] = faixas_categoricas(anos, valid, esquema)
+        elif esquema in FAIXAS_ETARIAS:
+            out[esquema] = faixas_idade(anos, valid, FAIXAS_ETARIAS[esquema])
+        else:
+            raise KeyError(f"Esquema de faixa etária desconhecido: {esquema}")
+    return out
@@ -1,6 +1,20 @@
 import pandas as pd
 import numpy as np
 from .config import MONTHS_ORDER
+from .metrics_registry import MetricRegistry
+from .frequency import frequency_counts
+from .tracing import traced
+
+# Variáveis sociodemográficas da aba 'Populações (em PrEP)' (ordem de exibição)
+POPULATION_VARIABLES = [
+    ('Pop_genero_pratica', 'População Chave'),
+    ('fetar', 'Faixa Etária'),
+    ('escol4', 'Escolaridade'),
+    ('raca4_cat', 'Raça/Cor')
+]
+
+# Colunas de agrupamento da aba 'Mun'
+MUN_GROUP_COLS = ['regiao_UDM', 'UF_UDM', 'Cod_UF', 'cod_ibge_udm', 'nome_mun_udm', 'nome_udm', 'endereco_udm', 'bairro_udm', 'cep_udm']
 
 def generate_disp_metrics(df_disp_semdupl):
     """
@@ -108,37 +122,39 @@ def generate_population_metrics(df_prep):
     if df_prep.empty or 'EmPrEP_Atual' not in df_prep.columns:
         return pd.DataFrame()
         
-    # Filtra apenas quem está Em PrEP atualmente
-    df_current = df_prep[df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente'].copy()
+    available = []
+    for col, title in POPULATION_VARIABLES:
+        if col not in df_prep.columns:
+            print(f"Aviso: Coluna '{col}' não encontrada em df_prep para relatório de população.")
+            continue
+        available.append((col, title))
     
-    if df_current.empty:
-        return pd.DataFrame()
+    # Frequência absoluta de todas as variáveis, por status, numa única passada
+    counts = frequency_counts(df_prep, [col for col, _ in available], by='EmPrEP_Atual')
     
-    # Lista de variáveis para analisar
-    # Ordem de exibição desejada
-    variables = [
-        ('Pop_genero_pratica', 'População Chave'),
-        ('fetar', 'Faixa Etária'),
-        ('escol4', 'Escolaridade'),
-        ('raca4_cat', 'Raça/Cor')
-    ]
+    # Apenas quem está Em PrEP atualmente
+    if 'Em PrEP atualmente' not in counts:
+        return pd.DataFrame()
+    current = counts['Em PrEP atualmente']
     
+    counts_by_var = [(col, title, current[col]) for col, title in available]
+
+    return format_population_table(counts_by_var)
+
+def format_population_table(counts_by_var):
+    """
+    Monta a tabela da aba 'Populações (em PrEP)' a partir de frequências já calculadas.
+    counts_by_var: lista de (coluna, título, Series de contagens com NaN incluído).
+    """
     # Ordens Personalizadas
     order_fetar = ['<18', '18 a 24', '25 a 29', '30 a 39', '40 a 49', '50 e mais']
     order_escol = ['Sem educação formal a 3 anos', 'De 4 a 7 anos', 'De 8 a 11 anos', '12 ou mais anos', 'Ignorada/Não informada']
     
     dfs_to_concat = []
     
-    for col, title in variables:
-        if col not in df_current.columns:
-            print(f"Aviso: Coluna '{col}' não encontrada em df_prep para relatório de população.")
-            continue
-            
-        # Calcula frequência absoluta
-        counts = df_current[col].value_counts(dropna=False)
-        
+    for col, title, counts in counts_by_var:
         # Calcula frequência relativa (%)
-        percs = df_current[col].value_counts(normalize=True, dropna=False) * 100
+        percs = counts / counts.sum() * 100
         
         # Montar DataFrame temporário
         temp_df = pd.DataFrame({
@@ -213,9 +229,6 @@ def generate_uf_summary(df_prep, df_disp_semdupl):
     
     UF_tab = pd.concat([dispensation_count, em_prep_count, descontinuados_count], axis=1)
     UF_tab.columns = ['dispensation_count', 'em_prep_count', 'descontinuados_count']
-    
-    # Porcentagem
-    UF_tab['percentage'] = (UF_tab['em_prep_count'] / UF_tab['dispensation_count'] * 100).round(0)
     UF_tab = UF_tab.reset_index()
     
     # 2. Agrupar df_disp_semdupl (Total de Dispensas)
@@ -223,6 +236,16 @@ def generate_uf_summary(df_prep, df_disp_semdupl):
     disp_total = df_disp_semdupl.groupby('UF_UDM').size().reset_index()
     disp_total.columns = ['UF_UDM', 'disp_total']
     
+    return format_uf_summary(UF_tab, disp_total)
+
+def format_uf_summary(UF_tab, disp_total):
+    """
+    Formata a aba 'Dados por UF' a partir das contagens por (regiao_UDM, UF_UDM, Cod_UF)
+    e do total de dispensas por UF_UDM.
+    """
+    # Porcentagem
+    UF_tab['percentage'] = (UF_tab['em_prep_count'] / UF_tab['dispensation_count'] * 100).round(0)
+    
     # 3. Merge e Formatação Final
     UF_tab = pd.merge(UF_tab, disp_total, on='UF_UDM', how='left')
     
@@ -249,11 +272,8 @@ def generate_mun_summary(df_prep, df_disp_semdupl):
     """
     print("Gerando resumo por Município/Serviço (Aba 'Mun')...")
     
-    # Colunas de agrupamento
-    group_cols = ['regiao_UDM', 'UF_UDM', 'Cod_UF', 'cod_ibge_udm', 'nome_mun_udm', 'nome_udm', 'endereco_udm', 'bairro_udm', 'cep_udm']
-    
     # Verificar colunas existentes
-    available_cols = [c for c in group_cols if c in df_prep.columns]
+    available_cols = [c for c in MUN_GROUP_COLS if c in df_prep.columns]
     
     if not available_cols:
         return pd.DataFrame()
@@ -268,16 +288,25 @@ def generate_mun_summary(df_prep, df_disp_semdupl):
     
     UF_mun_tab = pd.concat([dispensation_count, em_prep_count, descontinuados_count], axis=1)
     UF_mun_tab.columns = ['dispensation_count', 'em_prep_count', 'descontinuados_count']
-    
-    # Porcentagem
-    UF_mun_tab['percentage'] = (UF_mun_tab['em_prep_count'] / UF_mun_tab['dispensation_count'] * 100).round(1)
     UF_mun_tab = UF_mun_tab.reset_index()
     
     # 2. Agrupar df_disp_semdupl (Total de Dispensas por Serviço)
     if 'nome_udm' in df_disp_semdupl.columns:
         disp_total = df_disp_semdupl.groupby('nome_udm').size().reset_index()
         disp_total.columns = ['nome_udm', 'disp_total']
-        
+    else:
+        disp_total = None
+    
+    return format_mun_summary(UF_mun_tab, disp_total, available_cols)
+
+def format_mun_summary(UF_mun_tab, disp_total, available_cols):
+    """
+    Formata a aba 'Mun' a partir das contagens por serviço e do total de dispensas por nome_udm.
+    """
+    # Porcentagem
+    UF_mun_tab['percentage'] = (UF_mun_tab['em_prep_count'] / UF_mun_tab['dispensation_count'] * 100).round(1)
+    
+    if disp_total is not None:
         # Merge
         UF_mun_tab = pd.merge(UF_mun_tab, disp_total, on='nome_udm', how='left')
     else:
@@ -314,169 +343,195 @@ def generate_mun_summary(df_prep, df_disp_semdupl):
     
     return UF_mun_tab
 
-def calculate_ppt_metrics(df_prep, df_disp_semdupl, data_fechamento):
-    """
-    Calcula todas as métricas textuais necessárias para o PowerPoint.
-    """
-    print("Calculando métricas para o PPT...")
-    metrics = {}
-    
-    # Datas
-    hoje_dt = pd.to_datetime(data_fechamento)
-    # Formato "set/2025"
-    mes_abbr = MONTHS_ORDER[hoje_dt.month - 1].lower()
-    metrics['hoje2'] = f"{mes_abbr}/{hoje_dt.year}"
-    metrics['ano_atual'] = str(hoje_dt.year)
-    
-    # Slide 2: Novos Usuários (Último Mês)
+# Métricas textuais do PowerPoint (avaliadas sob demanda; ver calculate_ppt_metrics)
+PPT_METRICS = MetricRegistry()
+
+def _fmt_int(value):
+    # Formato brasileiro de milhar: 12.345
+    return "{:,}".format(value).replace(",", ".")
+
+# Datas
+PPT_METRICS.register('hoje_dt', lambda data_fechamento: pd.to_datetime(data_fechamento), ['data_fechamento'], output=False)
+# Formato "set/2025"
+PPT_METRICS.register('hoje2', lambda hoje_dt: f"{MONTHS_ORDER[hoje_dt.month - 1].lower()}/{hoje_dt.year}", ['hoje_dt'])
+PPT_METRICS.register('ano_atual', lambda hoje_dt: str(hoje_dt.year), ['hoje_dt'])
+
+# Slide 2: Novos Usuários (Último Mês)
+@PPT_METRICS.metric('latest_month_year_count', ['hoje_dt', 'df_prep', 'cube'])
+def _latest_month_year_count(hoje_dt, df_prep, cube):
+    if cube is not None:
+        mask_last_month = (cube['ano'] == hoje_dt.year) & (cube['mes'] == hoje_dt.month)
+        return _fmt_int(cube.loc[mask_last_month, 'novos_usuarios'].sum())
     if 'dt_disp_min' in df_prep.columns:
         mask_last_month = (df_prep['dt_disp_min'].dt.year == hoje_dt.year) & \
                           (df_prep['dt_disp_min'].dt.month == hoje_dt.month)
-        metrics['latest_month_year_count'] = "{:,}".format(mask_last_month.sum()).replace(",", ".")
-    else:
-        metrics['latest_month_year_count'] = "0"
+        return _fmt_int(mask_last_month.sum())
+    return "0"
 
-    # Slide 3: Mediana de Uso
+# Slide 3: Mediana de Uso
+@PPT_METRICS.metric('mediana_uso', ['df_prep'])
+def _mediana_uso(df_prep):
     if 'duracao_sum_total' in df_prep.columns:
-        metrics['mediana_uso'] = df_prep['duracao_sum_total'].median()
-    else:
-        # Fallback
-        metrics['mediana_uso'] = 0
-
-    # Slide 4: Cascata
-    count_disp12m = (df_prep['Disp_Ultimos_12m'] == 'Teve dispensação nos últimos 12 meses').sum()
-    count_emprep = (df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente').sum()
-    count_desc = (df_prep['EmPrEP_Atual'] == 'Estão descontinuados').sum()
-    
-    metrics['formatted_em_prep_count'] = "{:,}".format(count_emprep).replace(",", ".")
-    metrics['formatted_discontinued_count'] = "{:,}".format(count_desc).replace(",", ".")
-    
-    metrics['emPrEP_porcent'] = f"{(count_emprep/count_disp12m*100):.0f}" if count_disp12m > 0 else "0"
-    metrics['descontinuados_porcent'] = f"{(count_desc/count_disp12m*100):.0f}" if count_disp12m > 0 else "0"
-
-    # Helper
-    def get_top_category(series):
-        if series.dropna().empty: return "N/A", 0, 0
-        vc = series.value_counts(normalize=True) * 100
-        vc_abs = series.value_counts()
-        top_cat = vc.index[0]
-        return top_cat, vc.iloc[0], vc_abs.iloc[0]
-
-    # Filtrar Ativos
-    df_active = df_prep[df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente']
-    
-    # Slide 5: Populações
-    cat, perc, count = get_top_category(df_active['Pop_genero_pratica'])
-    metrics['highest_category_pop'] = cat
-    metrics['highest_percentage_pop'] = perc
-    metrics['formatted_highest_count_pop'] = "{:,}".format(count).replace(",", ".")
-
-    # Slide 6: Faixa Etária
-    cat, perc, count = get_top_category(df_active['fetar'])
-    metrics['highest_category_fetar'] = cat
-    metrics['highest_percentage_fetar'] = perc
-    metrics['formatted_highest_count_fetar'] = "{:,}".format(count).replace(",", ".")
-    
-    if 'idade_real' in df_active.columns:
-        young_mask = (df_active['idade_real'] >= 18) & (df_active['idade_real'] <= 29)
-        young_count = young_mask.sum()
-        young_perc = (young_count / len(df_active) * 100) if len(df_active) > 0 else 0
-        metrics['formatted_young_percentage'] = f"{young_perc:.0f}"
-        metrics['formatted_young_counts'] = "{:,}".format(young_count).replace(",", ".")
-        metrics['median_age'] = int(df_active['idade_real'].median()) if not df_active['idade_real'].isna().all() else 0
-    else:
-        metrics['formatted_young_percentage'] = "0"
-        metrics['formatted_young_counts'] = "0"
-        metrics['median_age'] = 0
-
-    # Slide 7: Escolaridade
-    cat, perc, count = get_top_category(df_active['escol4'])
-    metrics['highest_category_escol'] = cat
-    metrics['highest_percentage_escol'] = perc
-    metrics['formatted_highest_count_escol'] = "{:,}".format(count).replace(",", ".")
-
-    # Slide 8: Raça
-    cat, perc, count = get_top_category(df_active['raca4_cat'])
-    metrics['highest_category_raca'] = cat
-    metrics['highest_percentage_raca'] = perc
-    metrics['formatted_highest_count_raca'] = "{:,}".format(count).replace(",", ".")
-    
-    negra_mask = df_active['raca4_cat'].isin(['Preta', 'Parda'])
-    negra_count = negra_mask.sum()
-    negra_perc = (negra_count / len(df_active) * 100) if len(df_active) > 0 else 0
-    metrics['formatted_raca_negra_percentage'] = f"{negra_perc:.0f}"
-    metrics['formatted_raca_negra_counts'] = "{:,}".format(negra_count).replace(",", ".")
-
-    # Slide 9: IST
+        return df_prep['duracao_sum_total'].median()
+    # Fallback
+    return 0
+
+# Slide 4: Cascata (Disp 12m, Em PrEP, Descontinuados)
+@PPT_METRICS.metric('cascade_counts', ['df_prep', 'cube'], output=False)
+def _cascade_counts(df_prep, cube):
+    if cube is not None:
+        return cube['disp_12m_atual'].sum(), cube['em_prep_atual'].sum(), cube['descontinuados_atual'].sum()
+    return ((df_prep['Disp_Ultimos_12m'] == 'Teve dispensação nos últimos 12 meses').sum(),
+            (df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente').sum(),
+            (df_prep['EmPrEP_Atual'] == 'Estão descontinuados').sum())
+
+PPT_METRICS.register('formatted_em_prep_count', lambda c: _fmt_int(c[1]), ['cascade_counts'])
+PPT_METRICS.register('formatted_discontinued_count', lambda c: _fmt_int(c[2]), ['cascade_counts'])
+PPT_METRICS.register('emPrEP_porcent', lambda c: f"{(c[1]/c[0]*100):.0f}" if c[0] > 0 else "0", ['cascade_counts'])
+PPT_METRICS.register('descontinuados_porcent', lambda c: f"{(c[2]/c[0]*100):.0f}" if c[0] > 0 else "0", ['cascade_counts'])
+
+# Ativos (Em PrEP atualmente)
+PPT_METRICS.register('active_mask', lambda df_prep: df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente', ['df_prep'], output=False)
+
+# Com o cubo, evita filtrar a base: Em PrEP = contagem da cascata
+PPT_METRICS.register('n_active', lambda cascade_counts: cascade_counts[1], ['cascade_counts'], output=False, requires='cube')
+PPT_METRICS.register('n_active', lambda active_mask: int(active_mask.sum()), ['active_mask'], output=False)
+
+def _register_top_category(col, suffix):
+    # Frequências entre os ativos (value_counts sem nulos) e categoria mais frequente
+    @PPT_METRICS.metric(f'active_counts_{col}', ['df_prep', 'cube'], output=False)
+    def _active_counts(df_prep, cube):
+        if cube is not None:
+            from .cube import active_counts
+            return active_counts(cube, col)
+        return df_prep.loc[df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente', col].value_counts()
+
+    @PPT_METRICS.metric(f'top_{col}', [f'active_counts_{col}'], output=False)
+    def _top_category(vc_abs):
+        if vc_abs.sum() == 0: return "N/A", 0, 0
+        vc = vc_abs / vc_abs.sum() * 100
+        return vc.index[0], vc.iloc[0], vc_abs.iloc[0]
+
+    PPT_METRICS.register(f'highest_category_{suffix}', lambda top: top[0], [f'top_{col}'])
+    PPT_METRICS.register(f'highest_percentage_{suffix}', lambda top: top[1], [f'top_{col}'])
+    PPT_METRICS.register(f'formatted_highest_count_{suffix}', lambda top: _fmt_int(top[2]), [f'top_{col}'])
+
+# Slides 5 e 6: Populações e Faixa Etária
+_register_top_category('Pop_genero_pratica', 'pop')
+_register_top_category('fetar', 'fetar')
+
+# Slide 6: Jovens (18 a 29 anos) e idade mediana
+@PPT_METRICS.metric('young_count', ['df_prep', 'active_counts_fetar'], output=False, requires='cube')
+def _young_count_cube(df_prep, fetar_counts):
+    if 'idade_real' not in df_prep.columns:
+        return None
+    # Faixas '18 a 24' + '25 a 29' (fetar vem de idade_real inteira)
+    return int(fetar_counts.reindex(['18 a 24', '25 a 29']).fillna(0).sum())
+
+@PPT_METRICS.metric('young_count', ['df_prep', 'active_mask'], output=False)
+def _young_count(df_prep, active_mask):
+    if 'idade_real' not in df_prep.columns:
+        return None
+    idade = df_prep.loc[active_mask, 'idade_real']
+    return ((idade >= 18) & (idade <= 29)).sum()
+
+@PPT_METRICS.metric('formatted_young_percentage', ['young_count', 'n_active'])
+def _young_percentage(young_count, n_active):
+    if young_count is None:
+        return "0"
+    young_perc = (young_count / n_active * 100) if n_active > 0 else 0
+    return f"{young_perc:.0f}"
+
+PPT_METRICS.register('formatted_young_counts', lambda young_count: "0" if young_count is None else _fmt_int(young_count), ['young_count'])
+
+@PPT_METRICS.metric('median_age', ['df_prep', 'active_mask'])
+def _median_age(df_prep, active_mask):
+    if 'idade_real' not in df_prep.columns:
+        return 0
+    idade = df_prep.loc[active_mask, 'idade_real']
+    return int(idade.median()) if not idade.isna().all() else 0
+
+# Slides 7 e 8: Escolaridade e Raça
+_register_top_category('escol4', 'escol')
+_register_top_category('raca4_cat', 'raca')
+
+# Raça negra (Preta + Parda)
+PPT_METRICS.register('negra_count', lambda vc: int(vc.reindex(['Preta', 'Parda']).fillna(0).sum()), ['active_counts_raca4_cat'], output=False)
+PPT_METRICS.register('formatted_raca_negra_percentage', lambda negra, n: f"{((negra / n * 100) if n > 0 else 0):.0f}", ['negra_count', 'n_active'])
+PPT_METRICS.register('formatted_raca_negra_counts', lambda negra: _fmt_int(negra), ['negra_count'])
+
+# Slide 9: IST
+@PPT_METRICS.metric('ist_counts', ['df_disp_semdupl'], output=False)
+def _ist_counts(df_disp_semdupl):
     # Procurar a coluna correta (pode ter espaços ou variações)
     col_ist_auto = None
     for c in df_disp_semdupl.columns:
         if str(c).strip() == 'IST_autorrelato':
             col_ist_auto = c
             break
-            
-    if col_ist_auto:
-        # Denominador: Registros não nulos na coluna
-        denominator_val = df_disp_semdupl[col_ist_auto].notna().sum()
-        
-        # Counts e Percs
-        counts = df_disp_semdupl[col_ist_auto].value_counts()
-        percs = df_disp_semdupl[col_ist_auto].value_counts(normalize=True) * 100
-        
-        if not percs.empty:
-            top_cat = percs.idxmax()
-            top_count = counts[top_cat]
-            top_perc = percs[top_cat]
-            
-            metrics['denominator_IST'] = "{:,}".format(denominator_val).replace(",", ".")
-            metrics['highest_percentage_IST'] = top_perc
-            metrics['formatted_highest_count_IST'] = "{:,}".format(top_count).replace(",", ".")
-            metrics['highest_category_IST'] = top_cat
-        else:
-            metrics['denominator_IST'] = "0"
-            metrics['highest_percentage_IST'] = 0
-            metrics['formatted_highest_count_IST'] = "0"
-            metrics['highest_category_IST'] = "informação de IST"
-    else:
+    if not col_ist_auto:
+        return None
+    # Denominador: Registros não nulos na coluna
+    return df_disp_semdupl[col_ist_auto].notna().sum(), df_disp_semdupl[col_ist_auto].value_counts()
+
+@PPT_METRICS.metric('top_ist', ['ist_counts'], output=False)
+def _top_ist(ist_counts):
+    if ist_counts is None or ist_counts[1].empty:
         # Fallback se a coluna não existir no df_disp_semdupl
-        metrics['denominator_IST'] = "0"
-        metrics['highest_percentage_IST'] = 0
-        metrics['formatted_highest_count_IST'] = "0"
-        metrics['highest_category_IST'] = "informação de IST"
+        return "0", 0, "0", "informação de IST"
+    denominator_val, counts = ist_counts
+    percs = counts / counts.sum() * 100
+    top_cat = percs.idxmax()
+    return _fmt_int(denominator_val), percs[top_cat], _fmt_int(counts[top_cat]), top_cat
 
-    # Slide 10: Modalidade (Texto)
+PPT_METRICS.register('denominator_IST', lambda top: top[0], ['top_ist'])
+PPT_METRICS.register('highest_percentage_IST', lambda top: top[1], ['top_ist'])
+PPT_METRICS.register('formatted_highest_count_IST', lambda top: top[2], ['top_ist'])
+PPT_METRICS.register('highest_category_IST', lambda top: top[3], ['top_ist'])
+
+# Slide 10: Modalidade (Texto)
+@PPT_METRICS.metric('modality_counts', ['df_disp_semdupl'], output=False)
+def _modality_counts(df_disp_semdupl):
     col_mod_text = None
     for c in ['tp_modalidade', 'st_esquema_posologia', 'tipo_dispensacao']:
         if c in df_disp_semdupl.columns:
             col_mod_text = c
             break
-            
-    if col_mod_text:
-        # Total de registros válidos na coluna
-        total_mod = df_disp_semdupl[col_mod_text].notna().sum()
-        
-        # Contagem robusta via regex
-        mask_diaria = df_disp_semdupl[col_mod_text].astype(str).str.contains('di.ria', case=False, regex=True, na=False)
-        n_diaria = mask_diaria.sum()
-        
-        mask_demanda = df_disp_semdupl[col_mod_text].astype(str).str.contains('demanda', case=False, regex=True, na=False)
-        n_demanda = mask_demanda.sum()
-        
-        p_diaria = (n_diaria / total_mod * 100) if total_mod > 0 else 0
-        p_demanda = (n_demanda / total_mod * 100) if total_mod > 0 else 0
-        
-        metrics['prep_diaria_percent'] = int(round(p_diaria))
-        metrics['prep_diaria_count_formatted'] = "{:,}".format(n_diaria).replace(",", ".")
-        metrics['prep_demand_percent'] = int(round(p_demanda))
-        metrics['prep_demand_count_formatted'] = "{:,}".format(n_demanda).replace(",", ".")
-    else:
-        metrics['prep_diaria_percent'] = 0
-        metrics['prep_diaria_count_formatted'] = "0"
-        metrics['prep_demand_percent'] = 0
-        metrics['prep_demand_count_formatted'] = "0"
+    if not col_mod_text:
+        return 0, 0, 0
+
+    # Total de registros válidos na coluna
+    total_mod = df_disp_semdupl[col_mod_text].notna().sum()
+
+    # Contagem robusta via regex (sobre as categorias distintas, não sobre cada linha)
+    vc = df_disp_semdupl[col_mod_text].astype(str).value_counts()
+    n_diaria = vc[vc.index.str.contains('di.ria', case=False, regex=True)].sum()
+    n_demanda = vc[vc.index.str.contains('demanda', case=False, regex=True)].sum()
+    return total_mod, n_diaria, n_demanda
+
+PPT_METRICS.register('prep_diaria_percent', lambda m: int(round((m[1] / m[0] * 100) if m[0] > 0 else 0)), ['modality_counts'])
+PPT_METRICS.register('prep_diaria_count_formatted', lambda m: _fmt_int(m[1]), ['modality_counts'])
+PPT_METRICS.register('prep_demand_percent', lambda m: int(round((m[2] / m[0] * 100) if m[0] > 0 else 0)), ['modality_counts'])
+PPT_METRICS.register('prep_demand_count_formatted', lambda m: _fmt_int(m[2]), ['modality_counts'])
+
+@traced()
+def calculate_ppt_metrics(df_prep, df_disp_semdupl, data_fechamento, cube=None, outputs=None):
+    """
+    Calcula as métricas textuais necessárias para o PowerPoint.
+    Só as métricas em `outputs` (padrão: todas) e suas dependências são calculadas.
+    Se o cubo de monitoramento for informado, as contagens saem dele (medianas e
+    métricas de IST/Modalidade continuam vindo das bases).
+    """
+    print("Calculando métricas para o PPT...")
+
+    ctx = PPT_METRICS.context(df_prep=df_prep, df_disp_semdupl=df_disp_semdupl,
+                              data_fechamento=data_fechamento, cube=cube)
+    metrics = ctx.evaluate(outputs if outputs is not None else PPT_METRICS.outputs())
+    ctx.report_costs()
 
     return metrics
 
+@traced()
 def generate_prep_history(df_disp_semdupl, data_fechamento):
     """
     Versão OTIMIZADA de generate_prep_history.
@@ -586,7 +641,8 @@ def generate_prep_history(df_disp_semdupl, data_fechamento):
             if is_current_target:
                 updates.append(("Disp_Ultimos_12m", "EmPrEP_Atual", 'Teve dispensação nos últimos 12 meses', "Em PrEP atualmente"))
             
-            if is_december:
+            # Ano fechado (Dezembro) ou ano corrente no mês do fechamento (igual à versão legacy)
+            if is_december or is_current_target:
                 updates.append((f"Disp_12m_{year}", f"EmPrEP_{year}", f'Teve dispensação em {year}', f"Em PrEP {year}"))
             
             for col_disp, col_emprep, val_disp, val_emprep in updates:
@@ -750,6 +806,7 @@ def generate_prep_history_legacy(df_disp_semdupl, data_fechamento):
 
     return df_disp_semdupl, EmPrEP_monthly_sample
 
+@traced()
 def classify_udm_active(df_disp_semdupl, data_fechamento):
     """
     Classifica se a UDM está ativa nos últimos 12 meses.
@@ -765,9 +822,271 @@ def classify_udm_active(df_disp_semdupl, data_fechamento):
     
     df_disp_semdupl['udm_ativa_12m'] = df_disp_semdupl['codigo_udm'].isin(udms_com_disp_12m)
     df_disp_semdupl['udm_ativa_12m'] = df_disp_semdupl['udm_ativa_12m'].map({True: 'UDM ativa', False: 'UDM não ativa'})
-    
+
     return df_disp_semdupl
 
+def _sorted_disp_work(df_disp_semdupl, extra_cols=()):
+    """
+    Cópia leve das dispensas (paciente, data, valid_until + extra_cols) ordenada por paciente e data,
+    base das funções de histórico por intervalos.
+    """
+    df_work = df_disp_semdupl[['codigo_pac_eleito', 'dt_disp'] + list(extra_cols)].copy()
+    df_work['dt_disp'] = pd.to_datetime(df_work['dt_disp'])
+    if 'valid_until' in df_disp_semdupl.columns:
+        df_work['valid_until'] = pd.to_datetime(df_disp_semdupl['valid_until'])
+    else:
+        duracao = df_disp_semdupl['duracao_sum'] if 'duracao_sum' in df_disp_semdupl.columns else 30
+        df_work['valid_until'] = df_work['dt_disp'] + pd.to_timedelta(duracao * 1.4, unit='D')
+    df_work = df_work.dropna(subset=['dt_disp'])
+
+    # Ordenação por paciente e data: a próxima dispensa do paciente encerra o intervalo da atual
+    return df_work.sort_values(['codigo_pac_eleito', 'dt_disp'], kind='mergesort')
+
+def _latest_disp_spans(df_work, month_ends):
+    """
+    Para cada dispensa (df_work de _sorted_disp_work), os índices de month_ends em que ela é a
+    dispensa mais recente da janela de 12 meses: [j_start, j_stop). Em PrEP enquanto j < j_valid
+    (fim do mês <= valid_until), descontinuado a partir de j_valid.
+    Mesma regra do loop mensal de generate_prep_history.
+    """
+    arr_ids = df_work['codigo_pac_eleito'].values
+    arr_dts = df_work['dt_disp'].values
+    arr_valid = df_work['valid_until'].values
+    n_months = len(month_ends)
+    arr_me = month_ends.values
+    arr_ws = pd.DatetimeIndex([m - pd.DateOffset(years=1) for m in month_ends]).values
+
+    same_pac_next = np.zeros(len(arr_ids), dtype=bool)
+    same_pac_next[:-1] = arr_ids[1:] == arr_ids[:-1]
+    arr_next = np.full(len(arr_dts), np.datetime64('NaT'), dtype=arr_dts.dtype)
+    arr_next[:-1] = arr_dts[1:]
+
+    # fim do mês >= dt_disp, início da janela < dt_disp e próxima dispensa ainda não ocorreu
+    j_start = np.searchsorted(arr_me, arr_dts, side='left')
+    j_stop = np.searchsorted(arr_ws, arr_dts, side='left')
+    j_stop_next = np.where(same_pac_next, np.searchsorted(arr_me, arr_next, side='left'), n_months)
+    j_stop = np.minimum(j_stop, j_stop_next)
+    j_valid = np.searchsorted(arr_me, arr_valid, side='right')
+    return j_start, j_stop, j_valid
+
+@traced()
+def generate_prep_history_multi(df_disp_semdupl, datas_fechamento):
+    """
+    Histórico mensal (Em PrEP x Descontinuados) como seria reportado em cada data de fechamento.
+    Todas as datas são avaliadas numa única passada sobre as dispensas ordenadas.
+    Retorna tabela longa: data_fechamento | Year | Month | Em PrEP | Descontinuados.
+    """
+    cortes = sorted(pd.to_datetime(pd.Series(datas_fechamento)).dt.normalize().unique())
+    print(f"Gerando histórico mensal para {len(cortes)} datas de fechamento...")
+
+    # Mesmos meses do loop de generate_prep_history (fins de mês <= fechamento), até o maior corte.
+    # O mês M só usa dispensas com dt_disp <= fim de M, então o valor não depende do corte.
+    month_ends = pd.date_range(pd.Timestamp(2018, 1, 31), cortes[-1], freq=pd.offsets.MonthEnd())
+    n_months = len(month_ends)
+
+    df_work = _sorted_disp_work(df_disp_semdupl)
+    j_start, j_stop, j_valid = _latest_disp_spans(df_work, month_ends)
+
+    def interval_counts(lo, hi):
+        # Soma de intervalos [lo, hi) via diferenças acumuladas
+        keep = hi > lo
+        diff = np.bincount(lo[keep], minlength=n_months + 1) - np.bincount(hi[keep], minlength=n_months + 1)
+        return np.cumsum(diff)[:n_months]
+
+    em_prep = interval_counts(j_start, np.minimum(j_stop, j_valid))
+    descontinuados = interval_counts(np.maximum(j_start, j_valid), j_stop)
+
+    # Cada corte recebe os meses com fim <= data de fechamento
+    n_por_corte = np.searchsorted(month_ends.values, np.array(cortes, dtype='datetime64[ns]'), side='right')
+    month_idx = np.concatenate([np.arange(n) for n in n_por_corte]).astype(np.int64)
+
+    return pd.DataFrame({
+        'data_fechamento': np.repeat(np.array(cortes, dtype='datetime64[ns]'), n_por_corte),
+        'Year': month_ends.year.values[month_idx],
+        'Month': month_ends.month.values[month_idx],
+        'Em PrEP': em_prep[month_idx],
+        'Descontinuados': descontinuados[month_idx]
+    })
+
+@traced()
+def generate_cohort_retention(df_disp_semdupl, data_fechamento, by=None, df_prep=None):
+    """
+    Retenção por coorte de início (mês da primeira dispensa): quantos usuários de cada coorte
+    estavam Em PrEP k meses depois, pela mesma regra do histórico mensal (fim de cada mês).
+    `by` estratifica por um atributo do paciente (de df_prep, se informado; senão da primeira dispensa).
+    Retorna tabela longa: [by] | Coorte | Meses | Tamanho da coorte | Em PrEP | % Em PrEP.
+    """
+    print(f"Gerando retenção por coorte{f' por {by}' if by else ''}...")
+
+    hoje_dt = pd.to_datetime(data_fechamento).normalize()
+    month_ends = pd.date_range(pd.Timestamp(2018, 1, 31), hoje_dt, freq=pd.offsets.MonthEnd())
+    n_months = len(month_ends)
+
+    by_from_prep = by is not None and df_prep is not None and by in df_prep.columns
+    extra = [by] if by is not None and not by_from_prep else []
+    df_work = _sorted_disp_work(df_disp_semdupl, extra)
+    j_start, j_stop, j_valid = _latest_disp_spans(df_work, month_ends)
+
+    # Coorte = mês (índice em month_ends) da primeira dispensa do paciente
+    arr_ids = df_work['codigo_pac_eleito'].values
+    is_first = np.ones(len(arr_ids), dtype=bool)
+    is_first[1:] = arr_ids[1:] != arr_ids[:-1]
+    pac_idx = np.cumsum(is_first) - 1
+    cohort_pac = j_start[is_first]
+    cohort_row = cohort_pac[pac_idx]
+
+    # Estrato de cada paciente
+    if by is None:
+        strata_pac, labels = np.zeros(len(cohort_pac), dtype=np.int64), [None]
+    else:
+        if by_from_prep:
+            values = df_prep.drop_duplicates('codigo_pac_eleito').set_index('codigo_pac_eleito')[by].reindex(arr_ids[is_first])
+        else:
+            values = df_work[by][is_first]
+        strata_pac, labels = pd.factorize(pd.Series(np.asarray(values, dtype=object)), use_na_sentinel=False)
+        strata_pac = strata_pac.astype(np.int64)
+
+    # Pacientes com primeira dispensa antes de Jan/2018 não têm coorte na grade (ficam de fora)
+    before_grid = df_work['dt_disp'].values[is_first] < np.datetime64('2018-01-01')
+    if before_grid.any():
+        print(f"Aviso: {int(before_grid.sum())} pacientes com primeira dispensa antes de 2018 ficam fora das coortes.")
+    in_grid = (cohort_pac < n_months) & ~before_grid
+
+    # Só os pares (estrato, coorte) com pacientes, cada um com os meses desde o início até o
+    # fechamento (segmentos de tamanho variável num vetor): a memória acompanha os pares ocupados,
+    # não estratos x coortes x meses
+    pair_key = strata_pac * n_months + cohort_pac
+    pairs = np.unique(pair_key[in_grid])
+    pair_pac = np.searchsorted(pairs, pair_key)
+    pair_s, pair_c = pairs // n_months, pairs % n_months
+    seg_len = n_months - pair_c + 1
+    seg_start = np.cumsum(seg_len) - seg_len
+
+    # Meses Em PrEP de cada dispensa, deslocados para "meses desde o início" da coorte
+    lo = j_start
+    hi = np.minimum(j_stop, j_valid)
+    keep = (hi > lo) & in_grid[pac_idx]
+    base = seg_start[pair_pac[pac_idx][keep]] - cohort_row[keep]
+    total = int(seg_len.sum())
+    diff = np.bincount(base + lo[keep], minlength=total) - np.bincount(base + hi[keep], minlength=total)
+    em_prep = np.cumsum(diff)
+    sizes = np.bincount(pair_pac[in_grid], minlength=len(pairs))
+
+    # Apenas células observadas até o fechamento (coorte + k <= último mês)
+    obs_len = seg_len - 1
+    p_idx = np.repeat(np.arange(len(pairs)), obs_len)
+    k_idx = np.arange(int(obs_len.sum())) - np.repeat(np.cumsum(obs_len) - obs_len, obs_len)
+
+    df_ret = pd.DataFrame({
+        'Coorte': month_ends.strftime('%Y-%m').values[pair_c[p_idx]],
+        'Meses': k_idx,
+        'Tamanho da coorte': sizes[p_idx],
+        'Em PrEP': em_prep[seg_start[p_idx] + k_idx]
+    })
+    df_ret['% Em PrEP'] = (df_ret['Em PrEP'] / df_ret['Tamanho da coorte'] * 100).round(1)
+    if by is not None:
+        df_ret.insert(0, by, np.asarray(labels, dtype=object)[pair_s[p_idx]])
+
+    return df_ret
+
+def cohort_retention_matrix(df_ret, meses=(1, 3, 6, 12), value='% Em PrEP'):
+    """
+    Matriz Coorte x Meses desde o início (colunas `meses`; None = todos) a partir de generate_cohort_retention.
+    Estratos (se houver) ficam no índice junto com a coorte.
+    """
+    index = [c for c in df_ret.columns if c not in ['Coorte', 'Meses', 'Tamanho da coorte', 'Em PrEP', '% Em PrEP']] + ['Coorte']
+    if meses is not None:
+        df_ret = df_ret[df_ret['Meses'].isin(meses)]
+    return df_ret.pivot_table(index=index, columns='Meses', values=value, aggfunc='first')
+
+@traced()
+def generate_udm_history(df_disp_semdupl, data_fechamento):
+    """
+    Histórico mensal por serviço (codigo_udm x mês, Jan/2018 -> fechamento):
+    Em PrEP, Descontinuados, Novos usuários, Dispensações e dias desde a última dispensa da UDM.
+    Mesma regra de generate_prep_history (dispensa mais recente dos últimos 12 meses e
+    valid_until >= fim do mês); o paciente é atribuído à UDM dessa dispensa.
+    """
+    print("Gerando histórico mensal por UDM...")
+
+    hoje_dt = pd.to_datetime(data_fechamento).normalize()
+
+    # Fins de mês analisados até o fechamento (os mesmos de generate_prep_history)
+    month_ends = pd.date_range(pd.Timestamp(2018, 1, 31), hoje_dt, freq=pd.offsets.MonthEnd())
+    n_months = len(month_ends)
+    arr_me = month_ends.values
+
+    df_work = _sorted_disp_work(df_disp_semdupl, ['codigo_udm'])
+    j_start, j_stop, j_valid = _latest_disp_spans(df_work, month_ends)
+
+    # Primeira dispensa de cada paciente, marcada antes de descartar as sem UDM (se ela não tem UDM,
+    # o paciente não vira novo usuário numa dispensa posterior)
+    arr_ids = df_work['codigo_pac_eleito'].values
+    is_first = np.ones(len(arr_ids), dtype=bool)
+    is_first[1:] = arr_ids[1:] != arr_ids[:-1]
+
+    # Dispensas sem UDM encerram o intervalo da anterior, mas não são contadas
+    has_udm = df_work['codigo_udm'].notna().values
+    df_work = df_work[has_udm]
+    j_start, j_stop, j_valid = j_start[has_udm], j_stop[has_udm], j_valid[has_udm]
+    is_first = is_first[has_udm]
+    arr_dts = df_work['dt_disp'].values
+    udm_codes, arr_udm = np.unique(df_work['codigo_udm'].values, return_inverse=True)
+    n_udm = len(udm_codes)
+
+    def interval_counts(lo, hi):
+        # Soma de intervalos [lo, hi) por UDM via diferenças acumuladas
+        keep = hi > lo
+        diff = np.zeros((n_udm, n_months + 1), dtype=np.int64)
+        np.add.at(diff, (arr_udm[keep], lo[keep]), 1)
+        np.add.at(diff, (arr_udm[keep], hi[keep]), -1)
+        return np.cumsum(diff, axis=1)[:, :n_months]
+
+    em_prep = interval_counts(j_start, np.minimum(j_stop, j_valid))
+    descontinuados = interval_counts(np.maximum(j_start, j_valid), j_stop)
+
+    # Dispensações e novos usuários no mês calendário (primeira dispensa do paciente)
+    arr_month = (df_work['dt_disp'].dt.year.values - 2018) * 12 + df_work['dt_disp'].dt.month.values - 1
+    in_range = (arr_month >= 0) & (arr_month < n_months)
+    dispensacoes = np.zeros((n_udm, n_months), dtype=np.int64)
+    np.add.at(dispensacoes, (arr_udm[in_range], arr_month[in_range]), 1)
+
+    novos = np.zeros((n_udm, n_months), dtype=np.int64)
+    np.add.at(novos, (arr_udm[is_first & in_range], arr_month[is_first & in_range]), 1)
+
+    # Última dispensa da UDM até o fim de cada mês (NaT é o menor int64, então o acumulado funciona)
+    last_disp = np.full((n_udm, n_months), np.iinfo(np.int64).min, dtype=np.int64)
+    j_disp = np.minimum(j_start, n_months)
+    ok = j_disp < n_months
+    np.maximum.at(last_disp, (arr_udm[ok], j_disp[ok]), arr_dts[ok].astype('datetime64[ns]').astype(np.int64))
+    last_disp = np.maximum.accumulate(last_disp, axis=1)
+    has_disp = last_disp != np.iinfo(np.int64).min
+    # Referência: fim do mês
+    arr_ref = arr_me.astype('datetime64[ns]').astype(np.int64)
+    dias = (arr_ref[None, :] - last_disp) // (86400 * 10**9)
+
+    # Tabela longa: apenas UDM-mês a partir da primeira dispensa da UDM
+    udm_idx, month_idx = np.nonzero(has_disp)
+    df_udm_history = pd.DataFrame({
+        'codigo_udm': udm_codes[udm_idx],
+        'Year': month_ends.year.values[month_idx],
+        'Month': month_ends.month.values[month_idx],
+        'Em PrEP': em_prep[udm_idx, month_idx],
+        'Descontinuados': descontinuados[udm_idx, month_idx],
+        'Novos usuários': novos[udm_idx, month_idx],
+        'Dispensações': dispensacoes[udm_idx, month_idx],
+        'Dias desde última dispensa': dias[udm_idx, month_idx]
+    })
+
+    # Identificação do serviço (primeira ocorrência de cada UDM)
+    id_cols = [c for c in ['nome_udm', 'UF_UDM', 'nome_mun_udm'] if c in df_disp_semdupl.columns]
+    if id_cols:
+        udm_info = df_disp_semdupl.drop_duplicates('codigo_udm')[['codigo_udm'] + id_cols]
+        df_udm_history = df_udm_history.merge(udm_info, on='codigo_udm', how='left')
+        df_udm_history = df_udm_history[['codigo_udm'] + id_cols + [c for c in df_udm_history.columns if c not in id_cols and c != 'codigo_udm']]
+
+    return df_udm_history
+
 def generate_annual_summary(df_prep, data_fechamento):
     """
     Gera tabela resumo anual (2018-Atual):
@@ -0,0 +1,76 @@
+import io
+import os
+
+# -----------------------------------------------------------------------------
+# ARTEFATOS EM MEMÓRIA (IMAGENS DOS GRÁFICOS)
+# Com defer_writes(True), os gráficos publicam os bytes do PNG aqui, pelo caminho
+# de destino, em vez de gravar no output_dir (em geral o compartilhamento V:).
+# O PPT lê as imagens da memória e a gravação em disco é uma etapa final
+# separada (persist_artifacts). Sem adiamento, write_bytes grava direto no disco.
+# -----------------------------------------------------------------------------
+
+_DEFERRED = {'enabled': False}
+# caminho de destino -> bytes ainda não gravados
+_PENDING = {}
+
+def defer_writes(enabled=True):
+    """Liga/desliga o adiamento da gravação das imagens (ver persist_artifacts)."""
+    _DEFERRED['enabled'] = enabled
+
+def _key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+def write_bytes(path, data):
+    """Publica o conteúdo do arquivo `path`: em memória (adiado) ou gravado direto no disco."""
+    if _DEFERRED['enabled']:
+        _PENDING[_key(path)] = (path, data)
+        return
+    _write_file(path, data)
+
+def read_bytes(path):
+    """Conteúdo de `path`: da memória, se publicado e ainda não gravado; senão, do disco."""
+    entry = _PENDING.get(_key(path))
+    if entry is not None:
+        return entry[1]
+    with open(path, 'rb') as f:
+        return f.read()
+
+def open_image(path):
+    """
+    Imagem para add_picture: BytesIO se estiver em memória, o próprio caminho se existir no disco,
+    ou None se não houver imagem.
+    """
+    entry = _PENDING.get(_key(path))
+    if entry is not None:
+        return io.BytesIO(entry[1])
+    return path if os.path.exists(path) else None
+
+def take_pending():
+    """Retira e retorna [(caminho, bytes)] ainda não gravados (usado pelos processos do pool)."""
+    items = list(_PENDING.values())
+    _PENDING.clear()
+    return items
+
+def _write_file(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def persist_artifacts():
+    """Grava no disco todas as imagens pendentes e libera a memória. Retorna os caminhos gravados."""
+    items = take_pending()
+    if not items:
+        return []
+    print(f"\nGravando {len(items)} imagens no diretório de saída...")
+    saved = []
+    for path, data in items:
+        try:
+            _write_file(path, data)
+            saved.append(path)
+        except Exception as e:
+            print(f"Aviso: Não foi possível gravar {path}: {e}")
+    return saved
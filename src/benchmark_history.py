@@ -0,0 +1,112 @@
+import argparse
+import os
+import pickle
+import sys
+import pandas as pd
+import numpy as np
+from .analysis import generate_prep_history, generate_prep_history_legacy
+from .cleaning import clean_disp_df
+from .optimization_tools import compare_dataframes, measure_peak, generate_synthetic_disp
+
+# Colunas escritas por generate_prep_history no df de dispensas
+WRITEBACK_PREFIXES = ('valid_until', 'duracao_sum', 'Disp_Ultimos_12m', 'EmPrEP_Atual', 'Disp_12m_', 'EmPrEP_')
+
+def load_cached_disp(cache_file, data_fechamento):
+    """
+    Lê as dispensas de um cache de bases (.cache/bases_AAAA-MM-DD.pkl) e aplica a limpeza padrão.
+    """
+    print(f"Lendo dispensas do cache: {cache_file}")
+    with open(cache_file, 'rb') as f:
+        bases = pickle.load(f)
+    _, df_disp_semdupl = clean_disp_df(bases['Disp'], data_fechamento)
+    return df_disp_semdupl
+
+def sample_patients(df_disp_semdupl, n_pacientes, seed=0):
+    """Amostra n pacientes (todas as dispensas de cada um)."""
+    ids = df_disp_semdupl['codigo_pac_eleito'].unique()
+    if n_pacientes >= len(ids):
+        return df_disp_semdupl.copy()
+    rng = np.random.default_rng(seed)
+    chosen = rng.choice(ids, n_pacientes, replace=False)
+    return df_disp_semdupl[df_disp_semdupl['codigo_pac_eleito'].isin(chosen)].copy()
+
+def writeback_columns(df):
+    return [c for c in df.columns if str(c).startswith(WRITEBACK_PREFIXES)]
+
+def normalize_nulls(df):
+    # A legacy cria colunas de flag via .loc (NaN) e a otimizada com None: comparar ambos como None
+    df = df.copy()
+    for c in df.columns:
+        if df[c].dtype == object:
+            df[c] = df[c].where(df[c].notna(), None)
+    return df
+
+def run_tier(df_tier, data_fechamento, name):
+    """
+    Roda a versão otimizada e a legacy sobre cópias da mesma base e compara
+    a tabela histórica e as colunas escritas no df de dispensas.
+    """
+    print(f"\n=== Tier {name}: {df_tier['codigo_pac_eleito'].nunique()} pacientes, {len(df_tier)} dispensas ===")
+
+    (df_new, hist_new), t_new, mem_new = measure_peak(generate_prep_history, df_tier.copy(), data_fechamento)
+    (df_old, hist_old), t_old, mem_old = measure_peak(generate_prep_history_legacy, df_tier.copy(), data_fechamento)
+
+    hist_old = hist_old.astype({'Year': 'int64', 'Month': 'int64', 'Em PrEP': 'int64', 'Descontinuados': 'int64'})
+    ok_hist = compare_dataframes(hist_old, hist_new, name=f"{name} - Histórico mensal")
+
+    cols_new = writeback_columns(df_new)
+    cols_old = writeback_columns(df_old)
+    key_cols = ['codigo_pac_eleito', 'dt_disp']
+    ok_flags = compare_dataframes(normalize_nulls(df_old[key_cols + cols_old]), normalize_nulls(df_new[key_cols + cols_new]),
+                                  name=f"{name} - Colunas escritas")
+
+    return {
+        'tier': name,
+        'pacientes': df_tier['codigo_pac_eleito'].nunique(),
+        'dispensas': len(df_tier),
+        'equivalente': ok_hist and ok_flags,
+        'tempo_otimizado_s': round(t_new, 3),
+        'tempo_legacy_s': round(t_old, 3),
+        'speedup': round(t_old / t_new, 1) if t_new > 0 else np.nan,
+        'pico_mem_otimizado_mb': round(mem_new, 1),
+        'pico_mem_legacy_mb': round(mem_old, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Equivalência e desempenho: generate_prep_history (otimizado) x legacy")
+    parser.add_argument("--data_fechamento", default="2025-09-30", help="Data de fechamento no formato YYYY-MM-DD")
+    parser.add_argument("--tiers", nargs="+", type=int, default=[1000, 10000, 50000], help="Número de pacientes por tier")
+    parser.add_argument("--cache", default=None, help="Cache de bases (.cache/bases_AAAA-MM-DD.pkl). Sem ele, usa dados sintéticos.")
+    parser.add_argument("--seed", type=int, default=0, help="Semente dos dados sintéticos / amostragem")
+    parser.add_argument("--output", default=None, help="CSV para salvar os resultados por tier")
+    args = parser.parse_args()
+
+    df_cached = None
+    if args.cache:
+        if not os.path.exists(args.cache):
+            print(f"Erro: Cache não encontrado: {args.cache}")
+            sys.exit(1)
+        df_cached = load_cached_disp(args.cache, args.data_fechamento)
+
+    results = []
+    for n in args.tiers:
+        if df_cached is not None:
+            df_tier = sample_patients(df_cached, n, seed=args.seed)
+        else:
+            df_tier = generate_synthetic_disp(n, args.data_fechamento, seed=args.seed)
+        results.append(run_tier(df_tier, args.data_fechamento, name=f"{n}"))
+
+    df_results = pd.DataFrame(results)
+    print("\n--- Resultado por Tier ---")
+    print(df_results.to_string(index=False))
+
+    if args.output:
+        df_results.to_csv(args.output, sep=';', index=False)
+        print(f"Resultados salvos em: {args.output}")
+
+    if not df_results['equivalente'].all():
+        print("ERRO: Versão otimizada diverge da legacy.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
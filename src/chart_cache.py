@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import inspect
+import functools
+import matplotlib
+from .data_loader import CACHE_DIR
+from .artifacts import write_bytes, read_bytes
+from .utils import feed_hash
+
+# -----------------------------------------------------------------------------
+# CACHE DE GRÁFICOS (ENDEREÇADO POR CONTEÚDO)
+# Chave = hash da função, da versão de estilo, dos dados agregados e dos parâmetros
+# (menos o output_dir: as imagens são guardadas pelo caminho relativo a ele).
+# Com a mesma chave, as imagens da execução anterior são reutilizadas em vez de
+# redesenhadas (publicadas como os gráficos novos, ver artifacts). Mudou o desenho de um gráfico? Incremente a versão de estilo do módulo.
+# -----------------------------------------------------------------------------
+
+CHART_CACHE_DIR = os.path.join(CACHE_DIR, "graficos")
+
+# Gráficos reutilizados / desenhados neste processo (ver report_chart_cache)
+_STATS = {'hits': [], 'misses': []}
+
+def chart_key(name, style_version, *inputs, **params):
+    """Hash (sha256) do gráfico: nome da função, versão de estilo, matplotlib, dados e parâmetros."""
+    h = hashlib.sha256()
+    feed_hash(h, (name, style_version, matplotlib.__version__))
+    feed_hash(h, inputs)
+    feed_hash(h, params)
+    return h.hexdigest()
+
+def _entry_paths(key):
+    return os.path.join(CHART_CACHE_DIR, f"{key}.json"), os.path.join(CHART_CACHE_DIR, key)
+
+def _relocate(result, func):
+    """Aplica func a cada caminho do resultado (caminho ou lista de caminhos)."""
+    return [func(p) for p in result] if isinstance(result, list) else func(result)
+
+def restore_chart(key, output_dir=None):
+    """
+    Publica as imagens guardadas na chave nos caminhos originais (relativos a `output_dir`, se houver).
+    Retorna o resultado registrado da função (caminho ou lista de caminhos) ou None se não houver cache.
+    """
+    manifest, blob_dir = _entry_paths(key)
+    if not os.path.exists(manifest):
+        return None
+    with open(manifest, encoding='utf-8') as f:
+        result = json.load(f)['result']
+    if output_dir is not None:
+        result = _relocate(result, lambda p: os.path.join(output_dir, p))
+    paths = result if isinstance(result, list) else [result]
+    blobs = [os.path.join(blob_dir, f"{i}.png") for i in range(len(paths))]
+    if not all(os.path.exists(b) for b in blobs):
+        return None
+    for blob, path in zip(blobs, paths):
+        with open(blob, 'rb') as f:
+            write_bytes(path, f.read())
+    return result
+
+def store_chart(key, result, output_dir=None):
+    """Guarda as imagens geradas (caminho ou lista de caminhos retornados pela função, relativos a `output_dir`)."""
+    paths = result if isinstance(result, list) else [result]
+    if not paths or not all(isinstance(p, str) for p in paths):
+        return
+    contents = [read_bytes(p) for p in paths]
+    if output_dir is not None:
+        result = _relocate(result, lambda p: os.path.relpath(p, output_dir))
+    manifest, blob_dir = _entry_paths(key)
+    os.makedirs(blob_dir, exist_ok=True)
+    for i, data in enumerate(contents):
+        tmp = os.path.join(blob_dir, f"{i}.png.tmp")
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, os.path.join(blob_dir, f"{i}.png"))
+    # Manifesto por último: entrada só é válida com todas as imagens gravadas
+    tmp = manifest + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'result': result}, f, ensure_ascii=False)
+    os.replace(tmp, manifest)
+
+def cached_chart(style_version):
+    """
+    Decorador para funções que desenham e salvam gráficos e retornam o caminho (ou lista de caminhos).
+    Com a mesma chave (dados, parâmetros e `style_version`), as imagens são copiadas do cache.
+    """
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = None
+            # A pasta de saída muda a cada execução (ver publish): fica fora da chave
+            params = dict(signature.bind(*args, **kwargs).arguments)
+            output_dir = params.pop('output_dir', None)
+            try:
+                key = chart_key(name, style_version, **params)
+                result = restore_chart(key, output_dir)
+                if result is not None:
+                    _STATS['hits'].append(result)
+                    for path in (result if isinstance(result, list) else [result]):
+                        print(f"Gráfico reutilizado (cache): {path}")
+                    return result
+            except Exception as e:
+                print(f"Aviso: Cache de gráficos indisponível ({func.__name__}): {e}")
+
+            result = func(*args, **kwargs)
+            if result is not None:
+                _STATS['misses'].append(result)
+                if key is not None:
+                    try:
+                        store_chart(key, result, output_dir)
+                    except Exception as e:
+                        print(f"Aviso: Não foi possível guardar o gráfico no cache: {e}")
+            return result
+        return wrapper
+    return decorator
+
+def pop_chart_stats():
+    """Retorna e zera os gráficos reutilizados/desenhados (usado pelos processos do pool)."""
+    stats = {'hits': list(_STATS['hits']), 'misses': list(_STATS['misses'])}
+    _STATS['hits'].clear()
+    _STATS['misses'].clear()
+    return stats
+
+def merge_chart_stats(stats):
+    _STATS['hits'].extend(stats['hits'])
+    _STATS['misses'].extend(stats['misses'])
+
+def report_chart_cache():
+    """Imprime quantos gráficos vieram do cache e quais foram redesenhados; zera a contagem."""
+    stats = pop_chart_stats()
+    hits, misses = stats['hits'], stats['misses']
+    if not hits and not misses:
+        return stats
+    print(f"\n--- Cache de gráficos: {len(hits)} reutilizados, {len(misses)} desenhados ---")
+    for result in misses:
+        for path in (result if isinstance(result, list) else [result]):
+            print(f"   Desenhado: {os.path.basename(path)}")
+    return stats
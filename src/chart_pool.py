@@ -0,0 +1,103 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .chart_cache import pop_chart_stats, merge_chart_stats, report_chart_cache
+from . import artifacts
+from .tracing import traced
+
+# -----------------------------------------------------------------------------
+# RENDERIZAÇÃO PARALELA DOS GRÁFICOS
+# Cada gráfico é um job (função render_* de visualization + entradas já agregadas,
+# pequenas) desenhado num processo separado. O tempo da fase de gráficos fica
+# próximo ao do gráfico mais lento, em vez da soma de todos. Gráficos com os
+# mesmos dados da execução anterior vêm do cache (ver chart_cache). Os processos
+# devolvem os bytes dos PNGs, publicados no processo principal (ver artifacts).
+# -----------------------------------------------------------------------------
+
+def chart_job(render, *args, **kwargs):
+    """Job de gráfico: nome da função render_* de visualization e seus argumentos (dados agregados)."""
+    return (render, args, kwargs)
+
+def _init_worker():
+    # Backend sem janela nos processos de renderização (spawn no Windows)
+    import matplotlib
+    matplotlib.use('Agg')
+    # Imagens voltam para o processo principal em vez de serem gravadas aqui
+    artifacts.defer_writes(True)
+
+def _run_job(job):
+    """Desenha um job e retorna (caminho da imagem ou None, segundos, uso do cache)."""
+    from . import visualization
+    render, args, kwargs = job
+    t0 = time.perf_counter()
+    path = getattr(visualization, render)(*args, **kwargs)
+    return path, time.perf_counter() - t0, pop_chart_stats()
+
+def _run_job_in_worker(job):
+    """_run_job num processo do pool, devolvendo também as imagens [(caminho, bytes)]."""
+    return _run_job(job) + (artifacts.take_pending(),)
+
+def _run_sequential(jobs):
+    paths = []
+    for job in jobs:
+        try:
+            path, _, stats = _run_job(job)
+            merge_chart_stats(stats)
+            paths.append(path)
+        except Exception as e:
+            print(f"Aviso: Falha ao gerar o gráfico ({job[0]}): {e}")
+            paths.append(None)
+    return paths
+
+@traced()
+def render_charts(jobs, max_workers=None, draft=False):
+    """
+    Desenha todos os jobs em paralelo (um processo por núcleo, no máximo um por job).
+    Retorna os caminhos das imagens na ordem dos jobs (None para gráficos não gerados).
+    Se o pool de processos não puder ser usado, desenha em sequência no processo atual.
+    `draft`: perfil de rascunho (baixa resolução) em todos os gráficos.
+    """
+    if not jobs:
+        return []
+    if draft:
+        jobs = [(render, args, {**kwargs, 'draft': True}) for render, args, kwargs in jobs]
+    workers = min(max_workers or os.cpu_count() or 1, len(jobs))
+    print(f"\n--- Gerando {len(jobs)} gráficos ({workers} processos) ---")
+    t0 = time.perf_counter()
+    if workers <= 1:
+        paths = _run_sequential(jobs)
+        report_chart_cache()
+        return paths
+
+    paths = [None] * len(jobs)
+    failed = []
+    slowest = 0.0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {pool.submit(_run_job_in_worker, job): i for i, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    paths[i], secs, stats, images = future.result()
+                    for path, data in images:
+                        artifacts.write_bytes(path, data)
+                    merge_chart_stats(stats)
+                    slowest = max(slowest, secs)
+                except Exception as e:
+                    print(f"Aviso: Falha ao gerar o gráfico ({jobs[i][0]}) no pool: {e}")
+                    failed.append(i)
+    except Exception as e:
+        print(f"Aviso: Pool de processos indisponível ({e}). Gerando gráficos em sequência.")
+        paths = _run_sequential(jobs)
+        report_chart_cache()
+        return paths
+
+    # Jobs que falharam no pool (ex: processo encerrado) são refeitos no processo atual
+    if failed:
+        failed.sort()
+        for i, path in zip(failed, _run_sequential([jobs[i] for i in failed])):
+            paths[i] = path
+
+    print(f"Gráficos gerados em {time.perf_counter() - t0:.1f}s (mais lento: {slowest:.1f}s)")
+    report_chart_cache()
+    return paths
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import types
+import pickle
+import shutil
+import hashlib
+import inspect
+import argparse
+import numpy as np
+import pandas as pd
+from .data_loader import CACHE_DIR
+from .utils import feed_hash
+from .prep_store import PARQUET_COMPRESSION
+from . import resident
+
+# -----------------------------------------------------------------------------
+# CHECKPOINTS DAS ETAPAS
+# A saída de cada etapa de dados (limpeza, enriquecimento, histórico, df PrEP,
+# cubo, métricas) fica em .cache/etapas/<data de fechamento>/<etapa>/<chave>.
+# Chave = hash do nome da etapa, do código que ela usa e das chaves das entradas
+# (dados externos, como as bases, entram pelo conteúdo). Com --resume, etapas
+# com a mesma chave são retomadas do disco em vez de recalculadas.
+# -----------------------------------------------------------------------------
+
+CHECKPOINT_DIR = os.path.join(CACHE_DIR, "etapas")
+MANIFEST = "manifest.json"
+
+# Opções da linha de comando que mudam o resultado das etapas com checkpoint: só elas entram na
+# chave (pastas, alvos, saídas pedidas e opções novas não invalidam os checkpoints).
+# memoria_gb entra só como "com orçamento": a compactação muda os tipos das colunas, o valor não
+KEY_ARGS = {
+    'data_fechamento': str,
+    'no_cache': bool,
+    'memoria_gb': lambda v: v is not None,
+}
+
+def value_fingerprint(value):
+    """Hash (sha256) do conteúdo de um valor (DataFrames, coleções, escalares ou argumentos da CLI)."""
+    if isinstance(value, argparse.Namespace):
+        value = {k: norm(getattr(value, k, None)) for k, norm in KEY_ARGS.items()}
+    h = hashlib.sha256()
+    feed_hash(h, value)
+    return h.hexdigest()
+
+def _referenced_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _referenced_names(const)
+    return names
+
+def _package_modules(namespace, names, package):
+    """Módulos do pacote de onde vêm os nomes (funções, classes, constantes importadas ou módulos)."""
+    modules = set()
+    for name in names:
+        obj = namespace.get(name)
+        module = obj.__name__ if inspect.ismodule(obj) else getattr(obj, '__module__', None)
+        if isinstance(module, str) and module.startswith(package + '.'):
+            modules.add(module)
+    return modules
+
+def code_version(func):
+    """
+    Hash do código de uma etapa: fonte da função e arquivos dos módulos do pacote que ela usa
+    (com as dependências deles). Mudou o cálculo? A chave muda e o checkpoint deixa de valer.
+    """
+    package = func.__globals__.get('__package__') or func.__module__.rpartition('.')[0]
+    h = hashlib.sha256(inspect.getsource(func).encode())
+    pending = _package_modules(func.__globals__, _referenced_names(func.__code__), package)
+    seen = set()
+    while pending:
+        module = pending.pop()
+        if module in seen or module == func.__module__:
+            continue
+        seen.add(module)
+        namespace = vars(sys.modules[module])
+        pending |= _package_modules(namespace, list(namespace), package)
+    for module in sorted(seen):
+        h.update(module.encode())
+        with open(sys.modules[module].__file__, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def stage_key(name, func, input_keys):
+    """Chave da etapa: nome, versão do código e chaves das entradas (na ordem declarada)."""
+    h = hashlib.sha256()
+    feed_hash(h, (name, code_version(func), list(input_keys)))
+    return h.hexdigest()
+
+def output_key(key, output):
+    """Chave de uma saída a partir da chave da etapa que a produziu."""
+    return hashlib.sha256(f"{key}|{output}".encode()).hexdigest()
+
+def checkpoint_path(scope, name, key):
+    return os.path.join(CHECKPOINT_DIR, str(scope), name, key[:16])
+
+def has_checkpoint(path):
+    return os.path.exists(os.path.join(path, MANIFEST))
+
+NAN_FLAG = "__nan__"
+
+def _nan_columns(df):
+    """
+    Colunas de texto com nulos NaN (o Parquet devolve None; a posição dos NaN é gravada à parte).
+    Retorna None se o Parquet não preservar o DataFrame (ex: números e textos na mesma coluna).
+    """
+    if not all(isinstance(c, str) and not c.startswith(NAN_FLAG) for c in df.columns) or df.columns.has_duplicates:
+        return None
+    if not isinstance(df.index, pd.RangeIndex) and df.index.dtype == object:
+        return None
+    nan_columns = []
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True) not in ('string', 'empty'):
+            return None
+        nulls = df[col][df[col].isna()]
+        if not all(v is None or isinstance(v, float) for v in nulls):
+            return None
+        if any(v is not None for v in nulls):
+            nan_columns.append(col)
+    return nan_columns
+
+def _save_frame(df, base):
+    """DataFrame em Parquet tipado ou, se o Parquet não preservar os dados, em pickle. Retorna a entrada do manifesto."""
+    nan_columns = _nan_columns(df)
+    if nan_columns is not None:
+        try:
+            flags = {NAN_FLAG + col: df[col].map(lambda v: isinstance(v, float)).astype(bool) for col in nan_columns}
+            df.assign(**flags).to_parquet(base + '.parquet', compression=PARQUET_COMPRESSION)
+            return {'format': 'parquet', 'nan_columns': nan_columns}
+        except Exception:
+            if os.path.exists(base + '.parquet'):
+                os.remove(base + '.parquet')
+    df.to_pickle(base + '.pkl')
+    return {'format': 'pickle'}
+
+def save_checkpoint(path, outputs):
+    """Grava as saídas de uma etapa (dict nome -> valor) e remove checkpoints antigos da mesma etapa."""
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    manifest = {}
+    for name, value in outputs.items():
+        base = os.path.join(tmp, name)
+        if isinstance(value, pd.DataFrame):
+            manifest[name] = _save_frame(value, base)
+        elif isinstance(value, dict) and value and all(isinstance(v, pd.DataFrame) for v in value.values()):
+            os.makedirs(base)
+            keys = list(value)
+            manifest[name] = {'format': 'frames', 'keys': keys,
+                              'frames': [_save_frame(value[k], os.path.join(base, str(i))) for i, k in enumerate(keys)]}
+        else:
+            with open(base + '.pkl', 'wb') as f:
+                pickle.dump(value, f)
+            manifest[name] = {'format': 'pickle'}
+    # Manifesto por último: checkpoint só é válido com todas as saídas gravadas
+    with open(os.path.join(tmp, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    stage_dir = os.path.dirname(path)
+    resident.forget('checkpoint', stage_dir)
+    for old in os.listdir(stage_dir):
+        if old != os.path.basename(tmp):
+            shutil.rmtree(os.path.join(stage_dir, old), ignore_errors=True)
+    os.replace(tmp, path)
+
+def _load_frame(base, entry):
+    if entry['format'] == 'pickle':
+        return pd.read_pickle(base + '.pkl')
+    df = pd.read_parquet(base + '.parquet')
+    for col in entry['nan_columns']:
+        df[col] = df[col].mask(df.pop(NAN_FLAG + col), np.nan)
+    return df
+
+def load_checkpoint(path):
+    """Saídas gravadas por save_checkpoint (dict nome -> valor). No serviço local, ficam em memória."""
+    stamp = resident.file_stamp(os.path.join(path, MANIFEST))
+    outputs = resident.recall('checkpoint', os.path.dirname(path), stamp)
+    if outputs is not None:
+        return outputs
+    with open(os.path.join(path, MANIFEST), encoding='utf-8') as f:
+        manifest = json.load(f)
+    outputs = {}
+    for name, entry in manifest.items():
+        base = os.path.join(path, name)
+        if entry['format'] == 'frames':
+            outputs[name] = {k: _load_frame(os.path.join(base, str(i)), frame)
+                             for i, (k, frame) in enumerate(zip(entry['keys'], entry['frames']))}
+        elif entry['format'] == 'parquet':
+            outputs[name] = _load_frame(base, entry)
+        else:
+            with open(base + '.pkl', 'rb') as f:
+                outputs[name] = pickle.load(f)
+    return resident.remember('checkpoint', os.path.dirname(path), outputs, stamp)
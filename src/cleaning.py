@@ -1,6 +1,8 @@
 import pandas as pd
 import numpy as np
+from .tracing import traced
 
+@traced()
 def clean_disp_df(df_disp, data_fechamento):
     """
     Limpa e prepara o dataframe de dispensas conforme lógica estrita fornecida.
@@ -42,6 +44,7 @@ def clean_disp_df(df_disp, data_fechamento):
     
     return df_disp, df_disp_semdupl
 
+@traced()
 def process_cadastro(df_cad):
     """
     Limpa e normaliza o dataframe de Cadastro PrEP.
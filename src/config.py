@@ -13,6 +13,9 @@ PATH_SINAN_ADULTO = r"V:/2025/Monitoramento e Avaliação/COMPARTILHADO/AMA - Ba
 PATH_PVHA_PRIM_ULT = r"//SAP109/Bancos AMA/Arquivos Atuais/Bancos Atuais HIV/Mensais/PVHA_prim_ult.csv"
 PATH_TABELA_IBGE = r"V:/2025/Monitoramento e Avaliação/DOCUMENTOS/Power BI/Tabela_IBGE_UF e Municípios.xlsx"
 
+# Subpasta (no diretório de saída) dos gráficos do modo rascunho: não substituem as imagens de publicação
+DRAFT_CHART_DIR = "rascunho"
+
 # Ordem dos meses para plotagem/ordenação
 MONTHS_ORDER = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
 
@@ -0,0 +1,374 @@
+import os
+import pandas as pd
+import numpy as np
+from .config import MONTHS_ORDER
+from .data_loader import CACHE_DIR
+from .analysis import POPULATION_VARIABLES, MUN_GROUP_COLS, format_population_table, format_uf_summary, format_mun_summary, _sorted_disp_work, _latest_disp_spans
+from .tracing import traced
+
+# -----------------------------------------------------------------------------
+# CUBO DE MONITORAMENTO
+# Mês x Geografia (UDM) x População x Faixa Etária x Raça x Escolaridade.
+# Todas as abas do Excel, gráficos e métricas do PPT são fatias deste cubo.
+# -----------------------------------------------------------------------------
+
+GEO_DIMS = ['regiao_UDM', 'UF_UDM', 'Cod_UF', 'cod_ibge_udm', 'nome_mun_udm', 'codigo_udm', 'nome_udm', 'endereco_udm', 'bairro_udm', 'cep_udm']
+PERSON_DIMS = ['Pop_genero_pratica', 'fetar', 'raca4_cat', 'escol4']
+TIME_DIMS = ['ano', 'mes']
+
+# Medidas:
+# - cadastrados / *_atual: foto na data de fechamento
+# - disp_12m / em_prep / descontinuados: foto anual (Dezembro, ou mês de fechamento no ano atual)
+# - dispensacoes: mês da dispensa | novos_usuarios: mês da primeira dispensa
+# - em_prep_mes / descontinuados_mes: situação no fim de cada mês (regra de generate_prep_history),
+#   na geografia da dispensa mais recente do paciente
+MEASURES = ['cadastrados', 'dispensacoes', 'novos_usuarios',
+            'disp_12m', 'em_prep', 'descontinuados',
+            'disp_12m_atual', 'em_prep_atual', 'descontinuados_atual',
+            'em_prep_mes', 'descontinuados_mes']
+
+def get_cube_path(data_fechamento, cache_dir=CACHE_DIR):
+    data = pd.to_datetime(data_fechamento).date()
+    return os.path.join(cache_dir, f"cubo_monitoramento_{data}.parquet")
+
+def _normalize_dim(series):
+    """Colunas texto com tipos mistos (ex: CEP lido como int e str) viram str, preservando nulos."""
+    if series.dtype == object:
+        return series.where(series.isna(), series.astype(str))
+    return series
+
+def _group_keys(frame, dims, first=None):
+    """
+    Fatoriza as dimensões uma única vez.
+    `first` (máscara): grupos numerados pela ordem de aparição dessas linhas, depois das demais.
+    Retorna (id do grupo por linha, DataFrame com uma linha por grupo).
+    """
+    if first is not None:
+        order = np.argsort(~np.asarray(first, dtype=bool), kind='stable')
+        gid_order, keys = _group_keys(frame.iloc[order], dims)
+        gid = np.empty_like(gid_order)
+        gid[order] = gid_order
+        return gid, keys
+    gid = frame.groupby(dims, dropna=False, observed=True, sort=False).ngroup().to_numpy()
+    _, first_idx = np.unique(gid, return_index=True)
+    keys = frame[dims].iloc[first_idx].reset_index(drop=True)
+    return gid, keys
+
+def _count_block(gid, keys, ano, mes, weights):
+    """
+    Soma os pesos (dict medida -> array) por (grupo, ano, mês) via bincount.
+    ano/mes podem ser escalares (foto) ou arrays (fluxo mensal).
+    """
+    ym = np.asarray(ano, dtype='int64') * 100 + np.asarray(mes, dtype='int64')
+    comb = gid.astype('int64') * 1_000_000 + ym
+    uniq, inv = np.unique(comb, return_inverse=True)
+
+    block = keys.iloc[uniq // 1_000_000].reset_index(drop=True)
+    block['ano'] = ((uniq % 1_000_000) // 100).astype('int16')
+    block['mes'] = (uniq % 100).astype('int8')
+    for name, w in weights.items():
+        block[name] = np.bincount(inv, weights=np.asarray(w, dtype='float64'), minlength=len(uniq)).astype('int64')
+
+    return block[block[list(weights)].to_numpy().any(axis=1)]
+
+def _interval_cells(gid, lo, hi, n_months):
+    """
+    Contagem de intervalos de meses [lo, hi) por grupo, só nas células (grupo, mês) com contagem > 0
+    (memória proporcional às células ocupadas). Retorna (grupo, mês, contagem) por célula.
+    """
+    keep = hi > lo
+    stride = n_months + 1
+    events = np.concatenate([gid[keep] * stride + lo[keep], gid[keep] * stride + hi[keep]])
+    deltas = np.concatenate([np.ones(keep.sum()), -np.ones(keep.sum())])
+    uniq, inv = np.unique(events, return_inverse=True)
+    value = np.cumsum(np.bincount(inv, weights=deltas, minlength=len(uniq))).astype('int64')
+
+    # Cada contagem vale do seu evento até o próximo; o último evento do grupo zera a contagem
+    length = np.append(np.diff(uniq), 0)
+    pos = value > 0
+    starts, lens = uniq[pos], length[pos]
+    cells = np.repeat(starts, lens) + np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+    return cells // stride, cells % stride, np.repeat(value[pos], lens)
+
+@traced()
+def build_monitoring_cube(df_prep, df_disp_semdupl, data_fechamento):
+    """
+    Materializa o cubo de monitoramento para a data de fechamento.
+    Lê df_prep e df_disp_semdupl uma única vez; as saídas passam a ser fatias do cubo.
+    """
+    print("Gerando cubo de monitoramento (Mês x Geografia x UDM x População)...")
+
+    hoje_dt = pd.to_datetime(data_fechamento)
+    ano_atual, mes_atual = hoje_dt.year, hoje_dt.month
+
+    geo_dims = [c for c in GEO_DIMS if c in df_prep.columns or c in df_disp_semdupl.columns]
+    person_dims = [c for c in PERSON_DIMS if c in df_prep.columns]
+    dims = geo_dims + person_dims
+
+    blocks = []
+
+    # -------------------------------------------------------------------------
+    # 1. Fatos por Paciente (df_prep)
+    # -------------------------------------------------------------------------
+    pac = pd.DataFrame(index=df_prep.index)
+    for c in dims:
+        pac[c] = _normalize_dim(df_prep[c]) if c in df_prep.columns else np.nan
+    # Grupos (e linhas do cubo) na ordem de aparição dos pacientes Em PrEP: empates do value_counts
+    # nas frequências (active_counts) seguem essa ordem
+    em_prep_atual = (df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente').to_numpy() if 'EmPrEP_Atual' in df_prep.columns else None
+    gid, keys = _group_keys(pac, dims, first=em_prep_atual)
+
+    # Procuraram PrEP (todos os cadastrados)
+    blocks.append(_count_block(gid, keys, ano_atual, mes_atual, {'cadastrados': np.ones(len(pac))}))
+
+    # Novos usuários (mês da primeira dispensa)
+    if 'dt_disp_min' in df_prep.columns:
+        dt_min = pd.to_datetime(df_prep['dt_disp_min'])
+        mask = dt_min.notna().to_numpy()
+        blocks.append(_count_block(gid[mask], keys, dt_min.dt.year.to_numpy()[mask], dt_min.dt.month.to_numpy()[mask],
+                                   {'novos_usuarios': np.ones(mask.sum())}))
+
+    # Foto Atual
+    if 'EmPrEP_Atual' in df_prep.columns and 'Disp_Ultimos_12m' in df_prep.columns:
+        blocks.append(_count_block(gid, keys, ano_atual, mes_atual, {
+            'disp_12m_atual': (df_prep['Disp_Ultimos_12m'] == 'Teve dispensação nos últimos 12 meses').to_numpy(),
+            'em_prep_atual': em_prep_atual,
+            'descontinuados_atual': (df_prep['EmPrEP_Atual'] == 'Estão descontinuados').to_numpy()
+        }))
+
+    # Fotos Anuais (Dezembro de cada ano; ano atual no mês de fechamento)
+    for ano in range(2018, ano_atual + 1):
+        col_disp, col_emprep = f"Disp_12m_{ano}", f"EmPrEP_{ano}"
+        if col_disp not in df_prep.columns or col_emprep not in df_prep.columns:
+            continue
+        mes_ref = mes_atual if ano == ano_atual else 12
+        blocks.append(_count_block(gid, keys, ano, mes_ref, {
+            'disp_12m': (df_prep[col_disp] == f'Teve dispensação em {ano}').to_numpy(),
+            'em_prep': (df_prep[col_emprep] == f'Em PrEP {ano}').to_numpy(),
+            'descontinuados': (df_prep[col_emprep] == f'Descontinuou em {ano}').to_numpy()
+        }))
+
+    # -------------------------------------------------------------------------
+    # 2. Fatos por Dispensa (df_disp_semdupl)
+    # Geografia da UDM da dispensa; atributos pessoais vindos do df_prep.
+    # -------------------------------------------------------------------------
+    if not df_disp_semdupl.empty:
+        disp = pd.DataFrame(index=df_disp_semdupl.index)
+        for c in geo_dims:
+            disp[c] = _normalize_dim(df_disp_semdupl[c]) if c in df_disp_semdupl.columns else np.nan
+
+        if person_dims:
+            attrs = df_prep.drop_duplicates('codigo_pac_eleito').set_index('codigo_pac_eleito')[person_dims]
+            attrs = attrs.reindex(df_disp_semdupl['codigo_pac_eleito'].to_numpy())
+            for c in person_dims:
+                disp[c] = _normalize_dim(attrs[c]).set_axis(disp.index)
+
+        dt = pd.to_datetime(df_disp_semdupl['dt_disp'])
+        gid_d, keys_d = _group_keys(disp, dims)
+        blocks.append(_count_block(gid_d, keys_d, dt.dt.year.to_numpy(), dt.dt.month.to_numpy(),
+                                   {'dispensacoes': np.ones(len(disp))}))
+
+        # Em PrEP / Descontinuados no fim de cada mês (Jan/2018 -> fechamento), no grupo da dispensa
+        # mais recente do paciente
+        month_ends = pd.date_range(pd.Timestamp(2018, 1, 31), hoje_dt.normalize(), freq=pd.offsets.MonthEnd())
+        cols = [c for c in ['codigo_pac_eleito', 'dt_disp', 'valid_until', 'duracao_sum'] if c in df_disp_semdupl.columns]
+        df_work = _sorted_disp_work(df_disp_semdupl[cols].assign(grupo=gid_d), ['grupo'])
+        j_start, j_stop, j_valid = _latest_disp_spans(df_work, month_ends)
+        arr_gid = df_work['grupo'].to_numpy().astype('int64')
+        for name, lo, hi in [('em_prep_mes', j_start, np.minimum(j_stop, j_valid)),
+                             ('descontinuados_mes', np.maximum(j_start, j_valid), j_stop)]:
+            g, m, count = _interval_cells(arr_gid, lo, hi, len(month_ends))
+            blocks.append(_count_block(g, keys_d, month_ends.year.values[m], month_ends.month.values[m], {name: count}))
+
+    # -------------------------------------------------------------------------
+    # 3. Consolidação
+    # -------------------------------------------------------------------------
+    cube = pd.concat(blocks, ignore_index=True)
+    for m in MEASURES:
+        if m not in cube.columns:
+            cube[m] = 0
+    cube[MEASURES] = cube[MEASURES].fillna(0).astype('int64')
+
+    cube = cube.groupby(dims + TIME_DIMS, dropna=False, observed=True, sort=False)[MEASURES].sum().reset_index()
+
+    print(f"Cubo gerado: {len(cube)} células ({len(dims)} dimensões + Ano/Mês).")
+    return cube
+
+@traced()
+def save_cube(cube, data_fechamento, cache_dir=CACHE_DIR):
+    """Salva o cubo em Parquet (um arquivo por data de fechamento)."""
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    path = get_cube_path(data_fechamento, cache_dir)
+    try:
+        cube.to_parquet(path, index=False)
+        print(f"--- [CUBO] Salvo em: {path} ---")
+    except Exception as e:
+        print(f"Aviso: Não foi possível salvar o cubo em Parquet: {e}")
+    return path
+
+def load_cube(data_fechamento, cache_dir=CACHE_DIR):
+    """Carrega o cubo da data de fechamento, se existir. Retorna None caso contrário."""
+    path = get_cube_path(data_fechamento, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        print(f"--- [CUBO] Carregando: {path} ---")
+        return pd.read_parquet(path)
+    except Exception as e:
+        print(f"Erro ao ler cubo: {e}")
+        return None
+
+# -----------------------------------------------------------------------------
+# FATIAS
+# -----------------------------------------------------------------------------
+
+def slice_cube(cube, by, measures=MEASURES, dropna=True):
+    """Agrega o cubo pelas dimensões pedidas (groupby + soma das medidas)."""
+    return cube.groupby(by, dropna=dropna, observed=True)[list(measures)].sum()
+
+def _month_year_table(cube, measure, index_name, columns_name):
+    """Matriz Mês x Ano de uma medida de fluxo (equivalente ao crosstab + reindex dos meses)."""
+    s = slice_cube(cube, ['mes', 'ano'], [measure])[measure]
+    s = s[s > 0]
+    tab = s.unstack(fill_value=0)
+    tab.index = [MONTHS_ORDER[m - 1] for m in tab.index]
+    tab = tab.reindex(MONTHS_ORDER)
+    tab.index.name = index_name
+    tab.columns = tab.columns.astype(int)
+    tab.columns.name = columns_name
+    return tab
+
+def active_counts(cube, col, dropna=True):
+    """
+    Frequência de uma variável entre os 'Em PrEP atualmente' (equivalente ao value_counts).
+    Mesma ordem de partida do value_counts antes da ordenação por frequência (decide os empates):
+    ordem de aparição (linhas do cubo na ordem dos pacientes Em PrEP) ou, em variáveis categóricas,
+    ordem das categorias (inclusive as sem ocorrência) com os nulos no fim.
+    """
+    rows = cube[cube['em_prep_atual'] > 0]
+    s = rows.groupby(col, dropna=dropna, observed=True, sort=False)['em_prep_atual'].sum()
+    if isinstance(cube[col].dtype, pd.CategoricalDtype):
+        nan_count = s[s.index.isna()].sum()
+        cats = cube[col].cat.categories
+        s = s[s.index.notna()].reindex(pd.CategoricalIndex(cats, categories=cats, ordered=cube[col].cat.ordered), fill_value=0)
+        if nan_count > 0:
+            s = pd.concat([s, pd.Series([nan_count], index=[np.nan])])
+    return s.sort_values(ascending=False)
+
+def disp_metrics_from_cube(cube):
+    """Aba 'Disp_total' (Dispensas por Mês/Ano)."""
+    tab = _month_year_table(cube, 'dispensacoes', 'mes_disp', 'ano_disp')
+    tab.loc['Total'] = tab.sum()
+    return tab
+
+def new_users_metrics_from_cube(cube):
+    """Aba 'Novos usuários' (Primeira dispensa por Mês/Ano)."""
+    tab = _month_year_table(cube, 'novos_usuarios', 'mes_pri_disp', 'ano_pri_disp')
+    tab.loc['Total'] = tab.sum()
+    return tab
+
+def classifications_from_cube(cube):
+    """Aba 'Geral' (mesmas chaves de classify_prep_users)."""
+    tot = cube[MEASURES].sum()
+    count_12m = int(tot['disp_12m_atual'])
+    count_emprep = int(tot['em_prep_atual'])
+    return {
+        "Procuraram_PrEP": int(tot['cadastrados']),
+        "Iniciaram_PrEP": int(tot['novos_usuarios']),
+        "Disp_Ultimos_12m": count_12m,
+        "Disp_Ultimos_12m_Nao": int(tot['cadastrados']) - count_12m,
+        "EmPrEP_Atual": count_emprep,
+        "Descontinuados": count_12m - count_emprep
+    }
+
+def cascade_counts_from_cube(cube):
+    """Barras do gráfico de cascata (Procuraram, Iniciaram, 12m, Em PrEP, Descontinuados)."""
+    tot = cube[MEASURES].sum()
+    return [int(tot['cadastrados']), int(tot['novos_usuarios']), int(tot['disp_12m_atual']),
+            int(tot['em_prep_atual']), int(tot['descontinuados_atual'])]
+
+def annual_summary_from_cube(cube, data_fechamento):
+    """Aba 'Em PrEP por ano'."""
+    hoje_dt = pd.to_datetime(data_fechamento)
+    by_year = slice_cube(cube, ['ano'], ['disp_12m', 'em_prep'])
+
+    rows = []
+    for ano in range(2018, hoje_dt.year + 1):
+        count_disp = int(by_year['disp_12m'].get(ano, 0))
+        count_emprep = int(by_year['em_prep'].get(ano, 0))
+        perc = (count_emprep / count_disp * 100) if count_disp > 0 else 0
+        rows.append({
+            "Ano": ano,
+            "Pelo menos uma dispensação nos últimos 12 meses": count_disp,
+            "Em PrEP": count_emprep,
+            "% Em PrEP": round(perc, 1)
+        })
+    return pd.DataFrame(rows)
+
+def annual_chart_from_cube(cube, data_fechamento):
+    """
+    Séries do gráfico 'Em PrEP por ano': (anos, em_prep, em_prep + descontinuados).
+    O ano atual usa a foto de fechamento (EmPrEP_Atual).
+    """
+    hoje_dt = pd.to_datetime(data_fechamento)
+    years = np.arange(2018, hoje_dt.year + 1)
+    by_year = slice_cube(cube, ['ano'], ['em_prep', 'descontinuados'])
+    tot = cube[MEASURES].sum()
+
+    prep_counts, total_counts = [], []
+    for year in years:
+        if year == hoje_dt.year:
+            n_emprep, n_desc = int(tot['em_prep_atual']), int(tot['descontinuados_atual'])
+        else:
+            n_emprep = int(by_year['em_prep'].get(year, 0))
+            n_desc = int(by_year['descontinuados'].get(year, 0))
+        prep_counts.append(n_emprep)
+        total_counts.append(n_emprep + n_desc)
+    return years, np.array(prep_counts), np.array(total_counts)
+
+def monthly_status_from_cube(cube, by=()):
+    """
+    Em PrEP / Descontinuados no fim de cada mês por dimensões `by` (vazio = total, como o histórico
+    de generate_prep_history_multi na data de fechamento).
+    """
+    tab = slice_cube(cube, list(by) + TIME_DIMS, ['em_prep_mes', 'descontinuados_mes'])
+    tab = tab[(tab['em_prep_mes'] > 0) | (tab['descontinuados_mes'] > 0)].reset_index()
+    return tab.rename(columns={'ano': 'Year', 'mes': 'Month', 'em_prep_mes': 'Em PrEP', 'descontinuados_mes': 'Descontinuados'})
+
+def population_metrics_from_cube(cube):
+    """Aba 'Populações (em PrEP)'."""
+    print("Gerando métricas de Populações (Cubo)...")
+    if cube['em_prep_atual'].sum() == 0:
+        return pd.DataFrame()
+    counts_by_var = [(col, title, active_counts(cube, col, dropna=False))
+                     for col, title in POPULATION_VARIABLES if col in cube.columns]
+    return format_population_table(counts_by_var)
+
+def _status_counts(cube, by):
+    tab = slice_cube(cube, by, ['cadastrados', 'disp_12m_atual', 'em_prep_atual', 'descontinuados_atual'])
+    # Apenas grupos com pacientes no df_prep (como no groupby original)
+    tab = tab[tab['cadastrados'] > 0].drop(columns='cadastrados')
+    tab.columns = ['dispensation_count', 'em_prep_count', 'descontinuados_count']
+    return tab.reset_index()
+
+def uf_summary_from_cube(cube):
+    """Aba 'Dados por UF'."""
+    print("Gerando resumo por UF (Cubo)...")
+    UF_tab = _status_counts(cube, ['regiao_UDM', 'UF_UDM', 'Cod_UF'])
+    disp_total = slice_cube(cube, ['UF_UDM'], ['dispensacoes'])['dispensacoes'].reset_index()
+    disp_total.columns = ['UF_UDM', 'disp_total']
+    return format_uf_summary(UF_tab, disp_total)
+
+def mun_summary_from_cube(cube):
+    """Aba 'Mun'."""
+    print("Gerando resumo por Município/Serviço (Cubo)...")
+    available_cols = [c for c in MUN_GROUP_COLS if c in cube.columns]
+    if not available_cols:
+        return pd.DataFrame()
+    UF_mun_tab = _status_counts(cube, available_cols)
+    disp_total = None
+    if 'nome_udm' in cube.columns:
+        disp_total = slice_cube(cube, ['nome_udm'], ['dispensacoes'])['dispensacoes'].reset_index()
+        disp_total.columns = ['nome_udm', 'disp_total']
+    return format_mun_summary(UF_mun_tab, disp_total, available_cols)
@@ -2,6 +2,7 @@ import pandas as pd
 import datetime
 import os
 import pickle
+from . import resident
 from .config import BASE_PATH_V, CAMINHO_COLUNAS_DEFAULT, PATH_CADASTRO_HIV, PATH_PVHA, PATH_SINAN_ADULTO, PATH_PVHA_PRIM_ULT, PATH_TABELA_IBGE
 
 CACHE_DIR = ".cache"
@@ -42,13 +43,19 @@ def carregar_bases(hoje: datetime.date,
         cache_file = os.path.join(CACHE_DIR, f"bases_{hoje}.pkl")
         
         if os.path.exists(cache_file):
+            # No serviço local (src/service.py), as bases já lidas ficam em memória
+            bases = resident.recall('bases', cache_file, resident.file_stamp(cache_file))
+            if bases is not None:
+                print(f"--- [SERVIÇO] Bases em memória ({cache_file}) ---")
+                return bases
+
             print(f"--- [CACHE] Encontrado cache local: {cache_file} ---")
             print("Carregando bases do disco local (muito mais rápido)...")
             try:
                 with open(cache_file, 'rb') as f:
                     bases = pickle.load(f)
                 print("--- [CACHE] Bases carregadas com sucesso! ---")
-                return bases
+                return resident.remember('bases', cache_file, bases, resident.file_stamp(cache_file))
             except Exception as e:
                 print(f"Erro ao ler cache: {e}. Tentando carga original...")
     
@@ -164,6 +171,7 @@ def carregar_bases(hoje: datetime.date,
             print(f"--- [CACHE] Salvando bases localmente em: {cache_file} ---")
             with open(cache_file, 'wb') as f:
                 pickle.dump(bases, f)
+            resident.remember('bases', cache_file, bases, resident.file_stamp(cache_file))
         except Exception as e:
             print(f"Aviso: Não foi possível salvar o cache: {e}")
 
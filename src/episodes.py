@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+import pandas as pd
+import numpy as np
+from .data_loader import CACHE_DIR
+from .tracing import traced
+from .utils import feed_hash
+
+# -----------------------------------------------------------------------------
+# EPISÓDIOS DE USO CONTÍNUO DE PrEP
+# Uma linha por paciente x episódio, persistida por data de fechamento.
+# Análises de comportamento (perfis, interrupções, abandono) leem os episódios
+# em vez de recalcular intervalos sobre todas as dispensas.
+# -----------------------------------------------------------------------------
+
+# Dias além da cobertura da dispensa anterior (valid_until) que caracterizam interrupção
+GAP_MARGIN_DAYS = 30
+# Sem cobertura há mais que isso na data de fechamento = abandono
+ABANDONO_DAYS = 180
+
+MOTIVO_RETORNO = 'Interrupção (retornou)'
+MOTIVO_EM_USO = 'Em uso'
+MOTIVO_DESCONTINUADO = 'Descontinuado'
+MOTIVO_ABANDONO = 'Abandono (180 dias)'
+
+def get_episodes_path(data_fechamento, cache_dir=CACHE_DIR):
+    data = pd.to_datetime(data_fechamento).date()
+    return os.path.join(cache_dir, f"episodios_prep_{data}.parquet")
+
+def _source_path(path):
+    # Carimbo das dispensas de origem, ao lado do Parquet dos episódios
+    return os.path.splitext(path)[0] + ".fonte.json"
+
+def _episode_inputs(df_disp_semdupl):
+    # Colunas das dispensas usadas na segmentação (paciente, data, duração, cobertura)
+    df_work = df_disp_semdupl[['codigo_pac_eleito', 'dt_disp']].copy()
+    df_work['dt_disp'] = pd.to_datetime(df_work['dt_disp'])
+    if 'duracao_sum' in df_disp_semdupl.columns:
+        df_work['duracao'] = df_disp_semdupl['duracao_sum']
+    elif 'duracao' in df_disp_semdupl.columns:
+        df_work['duracao'] = df_disp_semdupl['duracao']
+    else:
+        df_work['duracao'] = 30
+    if 'valid_until' in df_disp_semdupl.columns:
+        df_work['valid_until'] = pd.to_datetime(df_disp_semdupl['valid_until'])
+    else:
+        df_work['valid_until'] = df_work['dt_disp'] + pd.to_timedelta(df_work['duracao'] * 1.4, unit='D')
+    return df_work
+
+def episodes_source(df_disp_semdupl, gap_margin_days=GAP_MARGIN_DAYS):
+    """Hash das dispensas (só as colunas usadas) e dos parâmetros da segmentação."""
+    h = hashlib.sha256()
+    feed_hash(h, (gap_margin_days, ABANDONO_DAYS))
+    feed_hash(h, _episode_inputs(df_disp_semdupl).reset_index(drop=True))
+    return h.hexdigest()
+
+@traced()
+def build_episodes(df_disp_semdupl, data_fechamento, gap_margin_days=GAP_MARGIN_DAYS):
+    """
+    Segmenta as dispensas de cada paciente em episódios de uso contínuo.
+    Novo episódio quando a dispensa ocorre mais de `gap_margin_days` após o valid_until da anterior.
+    Retorna: codigo_pac_eleito | episodio | dt_inicio | dt_ultima_disp | dt_fim_cobertura |
+             n_disp | duracao_total | dias_gap_anterior | motivo_encerramento
+    """
+    print("Segmentando episódios de uso de PrEP...")
+    hoje_dt = pd.to_datetime(data_fechamento).normalize()
+
+    df_work = _episode_inputs(df_disp_semdupl)
+    df_work = df_work.dropna(subset=['codigo_pac_eleito', 'dt_disp'])
+    df_work = df_work.sort_values(['codigo_pac_eleito', 'dt_disp'], kind='mergesort')
+
+    arr_ids = df_work['codigo_pac_eleito'].values
+    arr_dts = df_work['dt_disp'].values
+    arr_valid = df_work['valid_until'].values
+    n = len(arr_ids)
+    if n == 0:
+        return pd.DataFrame(columns=['codigo_pac_eleito', 'episodio', 'dt_inicio', 'dt_ultima_disp', 'dt_fim_cobertura',
+                                     'n_disp', 'duracao_total', 'dias_gap_anterior', 'motivo_encerramento'])
+
+    # Detecção vetorizada de quebras: novo paciente ou dispensa após o fim da cobertura + margem
+    new_pac = np.ones(n, dtype=bool)
+    new_pac[1:] = arr_ids[1:] != arr_ids[:-1]
+    gap = np.zeros(n, dtype=bool)
+    gap[1:] = arr_dts[1:] > arr_valid[:-1] + np.timedelta64(gap_margin_days, 'D')
+    new_ep = new_pac | gap
+
+    starts = np.flatnonzero(new_ep)
+    ends = np.append(starts[1:], n) - 1
+
+    # Número do episódio dentro do paciente (1, 2, ...)
+    pac_of_ep = np.cumsum(new_pac)[starts]
+    first_ep_of_pac = np.searchsorted(pac_of_ep, pac_of_ep, side='left')
+    episodio = np.arange(len(starts)) - first_ep_of_pac + 1
+
+    dias_gap = np.full(len(starts), np.nan)
+    has_prev = gap[starts] & ~new_pac[starts]
+    dias_gap[has_prev] = (arr_dts[starts[has_prev]] - arr_valid[starts[has_prev] - 1]) / np.timedelta64(1, 'D')
+
+    df_ep = pd.DataFrame({
+        'codigo_pac_eleito': arr_ids[starts],
+        'episodio': episodio,
+        'dt_inicio': arr_dts[starts],
+        'dt_ultima_disp': arr_dts[ends],
+        'dt_fim_cobertura': arr_valid[ends],
+        'n_disp': ends - starts + 1,
+        'duracao_total': np.add.reduceat(df_work['duracao'].to_numpy(dtype='float64'), starts),
+        'dias_gap_anterior': dias_gap
+    })
+
+    # Motivo de encerramento: retorno (há episódio seguinte) ou situação na data de fechamento
+    is_last = np.append(pac_of_ep[1:] != pac_of_ep[:-1], True)
+    conditions = [
+        ~is_last,
+        df_ep['dt_fim_cobertura'] >= hoje_dt,
+        df_ep['dt_fim_cobertura'] >= hoje_dt - pd.to_timedelta(ABANDONO_DAYS, unit='D')
+    ]
+    choices = [MOTIVO_RETORNO, MOTIVO_EM_USO, MOTIVO_DESCONTINUADO]
+    df_ep['motivo_encerramento'] = np.select(conditions, choices, default=MOTIVO_ABANDONO)
+
+    print(f"Episódios: {len(df_ep)} ({df_ep['codigo_pac_eleito'].nunique()} pacientes)")
+    return df_ep
+
+@traced()
+def save_episodes(df_ep, data_fechamento, cache_dir=CACHE_DIR, fonte=None):
+    """
+    Salva a tabela de episódios em Parquet (um arquivo por data de fechamento).
+    `fonte`: hash das dispensas de origem (episodes_source), gravado ao lado para validar a reutilização.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    path = get_episodes_path(data_fechamento, cache_dir)
+    source_path = _source_path(path)
+    try:
+        if os.path.exists(source_path):
+            os.remove(source_path)
+        df_ep.to_parquet(path, index=False)
+        if fonte is not None:
+            with open(source_path, 'w', encoding='utf-8') as f:
+                json.dump({'fonte': fonte}, f)
+        print(f"--- [EPISÓDIOS] Salvo em: {path} ---")
+    except Exception as e:
+        print(f"Aviso: Não foi possível salvar os episódios em Parquet: {e}")
+    return path
+
+def load_episodes(data_fechamento, cache_dir=CACHE_DIR, fonte=None):
+    """
+    Carrega os episódios da data de fechamento, se existirem. Retorna None caso contrário.
+    Com `fonte`, só reutiliza o arquivo gerado a partir das mesmas dispensas (ver save_episodes).
+    """
+    path = get_episodes_path(data_fechamento, cache_dir)
+    if not os.path.exists(path):
+        return None
+    if fonte is not None:
+        try:
+            with open(_source_path(path), encoding='utf-8') as f:
+                stamp = json.load(f).get('fonte')
+        except Exception:
+            stamp = None
+        if stamp != fonte:
+            print(f"--- [EPISÓDIOS] {path} não corresponde às dispensas atuais. Recalculando. ---")
+            return None
+    try:
+        print(f"--- [EPISÓDIOS] Carregando: {path} ---")
+        return pd.read_parquet(path)
+    except Exception as e:
+        print(f"Erro ao ler episódios: {e}")
+        return None
+
+def get_episodes(df_disp_semdupl, data_fechamento, cache_dir=CACHE_DIR):
+    """Episódios persistidos das mesmas dispensas e data de fechamento; se não existirem, segmenta e salva."""
+    fonte = episodes_source(df_disp_semdupl)
+    df_ep = load_episodes(data_fechamento, cache_dir, fonte)
+    if df_ep is None:
+        df_ep = build_episodes(df_disp_semdupl, data_fechamento)
+        save_episodes(df_ep, data_fechamento, cache_dir, fonte)
+    return df_ep
@@ -1,26 +1,354 @@
 import pandas as pd
+import numpy as np
 import os
-from openpyxl import load_workbook
+import re
+import time
+import datetime
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from itertools import repeat
+from xml.sax.saxutils import escape
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Border, Side, Alignment
+from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
+from .tracing import traced
 
-def write_to_sheet(ws, df, include_index=False):
+# Formatação compartilhada pelo modo streaming (mesmo estilo de cabeçalho do pandas.to_excel)
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+
+def style_header_cell(cell):
+    cell.font = HEADER_FONT
+    cell.border = HEADER_BORDER
+    cell.alignment = HEADER_ALIGNMENT
+    return cell
+
+def _cell_value(value):
+    # NaN/NaT/NA viram célula vazia (como na_rep='' do pandas)
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value
+
+def _column_values(values):
+    """Coluna como array object com None no lugar de NaN/NaT/NA (conversão por coluna, não por célula)."""
+    values = pd.Series(values)
+    return values.astype(object).where(values.notna(), None).to_numpy()
+
+def _report_rate(sheet_name, n_rows, secs):
+    rate = n_rows / secs if secs > 0 else float('inf')
+    print(f"  Aba '{sheet_name}': {n_rows} linhas em {secs:.3f}s ({rate:,.0f} linhas/s)")
+
+def stream_rows(ws, df, include_index=False):
     """
-    Escreve um DataFrame em uma worksheet existente, começando de A1.
-    Limpa o conteúdo anterior para evitar sobras de dados antigos.
+    Linhas de uma aba write-only (cabeçalho e índice formatados como no pandas.to_excel),
+    geradas sob demanda a partir das colunas já convertidas: o DataFrame não vira lista de linhas.
     """
-    # Deleta todas as linhas para limpar os dados antigos
-    # (Mantém gráficos em outras abas, mas cuidado se houver gráficos nesta aba referenciando estas células)
-    ws.delete_rows(1, ws.max_row + 1)
-    
-    # Escrever novos dados
-    for r in dataframe_to_rows(df, index=include_index, header=True):
-        ws.append(r)
+    index_names = list(df.index.names) if include_index else []
+    yield [style_header_cell(WriteOnlyCell(ws, value=_cell_value(v))) for v in index_names + list(df.columns)]
+
+    index_cols = [_column_values(df.index.get_level_values(i)) for i in range(len(index_names))]
+    data_cols = [_column_values(df.iloc[:, j]) for j in range(df.shape[1])]
+    is_datetime = [pd.api.types.is_datetime64_any_dtype(df.iloc[:, j]) for j in range(df.shape[1])]
+
+    for idx_values, values in zip(zip(*index_cols) if index_cols else repeat(()), zip(*data_cols)):
+        cells = [style_header_cell(WriteOnlyCell(ws, value=v)) for v in idx_values]
+        if any(is_datetime):
+            for v, is_dt in zip(values, is_datetime):
+                if is_dt and v is not None:
+                    cell = WriteOnlyCell(ws, value=v.to_pydatetime())
+                    cell.number_format = DATETIME_FORMAT
+                    v = cell
+                cells.append(v)
+        else:
+            cells.extend(values)
+        yield cells
+
+def export_streaming(filepath, dfs_to_export):
+    """
+    Modo streaming (sem modelo): workbook write-only do openpyxl, que grava cada aba
+    direto no arquivo com memória constante. Informa linhas/s por aba.
+    """
+    print(f"Gerando Excel em modo streaming (sem modelo) em: {filepath}")
+    wb = Workbook(write_only=True)
+    for sheet_name, (df, idx_bool) in dfs_to_export.items():
+        ws = wb.create_sheet(sheet_name)
+        start = time.perf_counter()
+        for row in stream_rows(ws, df, idx_bool):
+            ws.append(row)
+        _report_rate(sheet_name, len(df), time.perf_counter() - start)
+    wb.save(filepath)
+    return filepath
+
+# -----------------------------------------------------------------------------
+# MODO MODELO: substitui apenas o XML das abas de dados dentro do .xlsx
+# Demais partes do arquivo (gráficos, estilos, pivot caches, nomes definidos) são copiadas sem alteração.
+# -----------------------------------------------------------------------------
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+WORKSHEET_CT = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+WORKSHEET_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+EXCEL_EPOCH = datetime.datetime(1899, 12, 30)
+# Formatos de data embutidos do Excel (numFmtId)
+DATE_NUMFMT_IDS = (14, 15, 16, 17, 22)
+
+_SHEETDATA_RE = re.compile(r'<((?:\w+:)?)sheetData(?:\s[^>]*)?(?:/>|>.*?</(?:\w+:)?sheetData>)', re.S)
+_DIMENSION_RE = re.compile(r'(<(?:\w+:)?dimension\s+ref=")[^"]*(")')
+_CELL_RE = re.compile(r'<(?:\w+:)?c\s[^>]*?r="([A-Z]+)(\d+)"[^>]*>')
+_STYLE_RE = re.compile(r'\ss="(\d+)"')
+_ILLEGAL_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def _template_styles(sheet_data_xml):
+    """Estilo (atributo s) de cada célula do modelo e o da última linha por coluna (herdado pelas linhas novas)."""
+    styles = {}
+    last_row = 0
+    for m in _CELL_RE.finditer(sheet_data_xml):
+        col, row = m.group(1), m.group(2)
+        style = _STYLE_RE.search(m.group(0))
+        if style:
+            styles[(col, int(row))] = style.group(1)
+        last_row = max(last_row, int(row))
+    last_styles = {col: st for (col, row), st in styles.items() if row == last_row}
+    return styles, last_row, last_styles
+
+def _xml_cell(ref, value, style, date_style=None):
+    s_attr = f' s="{style}"' if style is not None else ''
+    empty = f'<c r="{ref}"{s_attr}/>' if style is not None else ''
+    if value is None or value is pd.NA or value is pd.NaT:
+        return empty
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}"{s_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, np.integer)):
+        return f'<c r="{ref}"{s_attr}><v>{int(value)}</v></c>'
+    if isinstance(value, (float, np.floating)):
+        return f'<c r="{ref}"{s_attr}><v>{repr(float(value))}</v></c>' if np.isfinite(value) else empty
+    if isinstance(value, np.datetime64):
+        value = pd.Timestamp(value)
+        if value is pd.NaT:
+            return empty
+    if isinstance(value, datetime.date):
+        # Datas como número serial do Excel, com o estilo do modelo ou o estilo de data do styles.xml
+        # (acrescentado se o modelo não tiver); só sem styles.xml vão como texto
+        if not isinstance(value, datetime.datetime):
+            value = datetime.datetime(value.year, value.month, value.day)
+        if style is None:
+            style = date_style
+            if style is None:
+                return _xml_cell(ref, value.strftime('%Y-%m-%d %H:%M:%S'), None)
+            s_attr = f' s="{style}"'
+        serial = (value.replace(tzinfo=None) - EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c r="{ref}"{s_attr}><v>{repr(serial)}</v></c>'
+    text = escape(_ILLEGAL_XML_RE.sub('', str(value)))
+    if text == '':
+        return empty
+    space = ' xml:space="preserve"' if text != text.strip() else ''
+    return f'<c r="{ref}"{s_attr} t="inlineStr"><is><t{space}>{text}</t></is></c>'
+
+def _date_style(styles_xml):
+    """Índice (cellXfs) do primeiro estilo com formato de data no styles.xml do modelo, ou None."""
+    try:
+        root = ET.fromstring(styles_xml)
+    except ET.ParseError:
+        return None
+    date_fmts = set(DATE_NUMFMT_IDS)
+    numfmts = root.find(f'{{{NS_MAIN}}}numFmts')
+    if numfmts is not None:
+        for fmt in numfmts:
+            code = fmt.get('formatCode', '').lower()
+            if 'y' in code and 'd' in code:
+                date_fmts.add(int(fmt.get('numFmtId')))
+    cell_xfs = root.find(f'{{{NS_MAIN}}}cellXfs')
+    for i, xf in enumerate(cell_xfs if cell_xfs is not None else []):
+        if int(xf.get('numFmtId', 0)) in date_fmts:
+            return str(i)
+    return None
+
+def _append_child(xml, ns, tag, child_tag, child):
+    """
+    Acrescenta `child` ao fim do elemento <tag> (atualizando o count) no XML em texto.
+    Retorna (XML novo, posição do filho acrescentado) ou (xml, None) se o elemento não existir.
+    """
+    m = re.search(rf'<{ns}{tag}\b([^>]*?)(/?)>', xml)
+    if m is None:
+        return xml, None
+    attrs = re.sub(r'\scount="[^"]*"', '', m.group(1))
+    if m.group(2):
+        return xml[:m.start()] + f'<{ns}{tag}{attrs} count="1">{child}</{ns}{tag}>' + xml[m.end():], 0
+    close = xml.index(f'</{ns}{tag}>', m.end())
+    n = len(re.findall(rf'<{ns}{child_tag}\b', xml[m.end():close]))
+    return xml[:m.start()] + f'<{ns}{tag}{attrs} count="{n + 1}">' + xml[m.end():close] + child + xml[close:], n
+
+def _add_date_style(styles_xml):
+    """
+    Acrescenta ao styles.xml (texto) um formato de data (DATETIME_FORMAT, o do modo streaming) e um
+    estilo de célula com ele. Retorna (styles.xml novo, índice do estilo) ou (styles_xml, None).
+    """
+    m = re.search(r'<((?:\w+:)?)styleSheet\b[^>]*>', styles_xml)
+    if m is None:
+        return styles_xml, None
+    ns = m.group(1)
+    fmt_id = max([163] + [int(i) for i in re.findall(rf'<{ns}numFmt\b[^>]*?numFmtId="(\d+)"', styles_xml)]) + 1
+    numfmt = f'<{ns}numFmt numFmtId="{fmt_id}" formatCode="{escape(DATETIME_FORMAT, {chr(34): "&quot;"})}"/>'
+    # numFmts é o primeiro filho do styleSheet
+    new_xml, pos = _append_child(styles_xml, ns, 'numFmts', 'numFmt', numfmt)
+    if pos is None:
+        new_xml = styles_xml[:m.end()] + f'<{ns}numFmts count="1">{numfmt}</{ns}numFmts>' + styles_xml[m.end():]
+    xf = f'<{ns}xf numFmtId="{fmt_id}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    new_xml, index = _append_child(new_xml, ns, 'cellXfs', 'xf', xf)
+    if index is None:
+        return styles_xml, None
+    return new_xml, str(index)
+
+def _sheet_shape(df, include_index):
+    """Linhas e colunas ocupadas pelo layout do dataframe_to_rows (cabeçalho, linha de nomes do índice, dados)."""
+    n_rows = df.columns.nlevels + (1 if include_index else 0) + len(df)
+    n_cols = (df.index.nlevels if include_index else 0) + len(df.columns)
+    return n_rows, n_cols
+
+def _sheet_rows_xml(df, include_index, template_sheet_data, date_style=None):
+    """Linhas <row> no mesmo layout do dataframe_to_rows usado antes no modo modelo, geradas uma a uma."""
+    styles, last_row, last_styles = _template_styles(template_sheet_data)
+    _, n_cols = _sheet_shape(df, include_index)
+    letters = [get_column_letter(i + 1) for i in range(n_cols)]
+    for r, values in enumerate(dataframe_to_rows(df, index=include_index, header=True), start=1):
+        cells = ''.join(_xml_cell(f"{col}{r}", v, styles.get((col, r)) if r <= last_row else last_styles.get(col), date_style)
+                        for col, v in zip(letters, values))
+        yield f'<row r="{r}">{cells}</row>'
+
+def _write_sheet(zout, name, prefix, suffix, df, include_index, template_sheet_data='', date_style=None, ns_prefix=''):
+    """
+    Grava a aba em streaming: XML do modelo antes do <sheetData> + linhas novas + XML do modelo depois.
+    `ns_prefix`: prefixo do <sheetData> no modelo (ex: 'x:'); as linhas ficam no namespace principal
+    declarado no próprio <x:sheetData>.
+    """
+    n_rows, n_cols = _sheet_shape(df, include_index)
+    prefix = _DIMENSION_RE.sub(lambda m: f"{m.group(1)}A1:{get_column_letter(max(n_cols, 1))}{max(n_rows, 1)}{m.group(2)}", prefix, count=1)
+    ns_attr = f' xmlns="{NS_MAIN}"' if ns_prefix else ''
+    with zout.open(name, 'w') as fh:
+        fh.write(prefix.encode('utf-8'))
+        fh.write(f'<{ns_prefix}sheetData{ns_attr}>'.encode('utf-8'))
+        chunk = []
+        for row in _sheet_rows_xml(df, include_index, template_sheet_data, date_style):
+            chunk.append(row)
+            if len(chunk) >= 1000:
+                fh.write(''.join(chunk).encode('utf-8'))
+                chunk = []
+        fh.write(''.join(chunk).encode('utf-8'))
+        fh.write(f'</{ns_prefix}sheetData>'.encode('utf-8'))
+        fh.write(suffix.encode('utf-8'))
+
+def fill_template(template_path, filepath, dfs_to_export):
+    """
+    Preenche o modelo trocando só o <sheetData> (e o <dimension>) das abas de dados no XML do .xlsx.
+    Estilos das células do modelo são mantidos pela posição; textos vão como inlineStr (sharedStrings intocado).
+    Abas ausentes no modelo são criadas. O workbook.xml só recebe fullCalcOnLoad (fórmulas recalculadas ao abrir);
+    o calcChain.xml é descartado apenas se alguma aba substituída tinha fórmulas.
+    """
+    with zipfile.ZipFile(template_path) as zin:
+        workbook_xml = zin.read('xl/workbook.xml').decode('utf-8')
+        rels_xml = zin.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+        ct_xml = zin.read('[Content_Types].xml').decode('utf-8')
+        # Estilo de data do modelo; sem nenhum, um formato de data é acrescentado ao styles.xml
+        styles_xml = zin.read('xl/styles.xml') if 'xl/styles.xml' in zin.namelist() else None
+        date_style = _date_style(styles_xml) if styles_xml is not None else None
+        new_styles = None
+        if styles_xml is not None and date_style is None:
+            new_styles, date_style = _add_date_style(styles_xml.decode('utf-8'))
+
+        # Aba -> parte XML (via relacionamentos do workbook)
+        rels = {rel.get('Id'): rel for rel in ET.fromstring(rels_xml).findall(f'{{{NS_PKG_REL}}}Relationship')}
+        sheet_parts = {}
+        sheet_ids = []
+        for sheet in ET.fromstring(workbook_xml).iter(f'{{{NS_MAIN}}}sheet'):
+            target = rels[sheet.get(f'{{{NS_REL}}}id')].get('Target')
+            part = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+            sheet_parts[sheet.get('name')] = part
+            sheet_ids.append(int(sheet.get('sheetId')))
 
-def export_to_excel(output_dir, data_fechamento, metrics_dict):
+        replaced = {sheet_parts[n]: n for n in dfs_to_export if n in sheet_parts}
+        new_sheets = [n for n in dfs_to_export if n not in sheet_parts]
+
+        # Partes dos XML das abas substituídas: prefixo/sufixo ao redor do <sheetData>
+        templates = {}
+        drop_calc_chain = False
+        for part in replaced:
+            xml = zin.read(part).decode('utf-8')
+            m = _SHEETDATA_RE.search(xml)
+            if m is None:
+                raise ValueError(f"Aba sem <sheetData> no modelo: {part}")
+            templates[part] = (xml[:m.start()], xml[m.end():], m.group(0), m.group(1))
+            drop_calc_chain |= '<f' in m.group(0)
+
+        # Novas abas: partes, relacionamentos e tipos de conteúdo
+        existing = [int(x) for x in re.findall(r'xl/worksheets/sheet(\d+)\.xml', ' '.join(zin.namelist()))]
+        next_part = max(existing, default=0) + 1
+        next_id = max(sheet_ids, default=0) + 1
+        new_parts = {}
+        for k, name in enumerate(new_sheets):
+            part = f"xl/worksheets/sheet{next_part + k}.xml"
+            rid = f"rIdPrEP{k + 1}"
+            new_parts[part] = name
+            attr_name = escape(name, {'"': '&quot;'})
+            workbook_xml = workbook_xml.replace('</sheets>', f'<sheet name="{attr_name}" sheetId="{next_id + k}" r:id="{rid}"/></sheets>', 1)
+            rels_xml = rels_xml.replace('</Relationships>', f'<Relationship Id="{rid}" Type="{WORKSHEET_REL}" Target="worksheets/sheet{next_part + k}.xml"/></Relationships>', 1)
+            ct_xml = ct_xml.replace('</Types>', f'<Override PartName="/{part}" ContentType="{WORKSHEET_CT}"/></Types>', 1)
+        if new_sheets and 'xmlns:r=' not in workbook_xml[:workbook_xml.find('<sheets')]:
+            workbook_xml = workbook_xml.replace('<workbook ', f'<workbook xmlns:r="{NS_REL}" ', 1)
+
+        # Recalcular fórmulas ao abrir
+        if re.search(r'<calcPr\b', workbook_xml):
+            if 'fullCalcOnLoad=' not in workbook_xml:
+                workbook_xml = re.sub(r'<calcPr\b', '<calcPr fullCalcOnLoad="1"', workbook_xml, count=1)
+        else:
+            m = re.search(r'<(oleSize|customWorkbookViews|pivotCaches|smartTagPr|smartTagTypes|webPublishing|fileRecoveryPr|webPublishObjects|extLst)\b|</workbook>', workbook_xml)
+            workbook_xml = workbook_xml[:m.start()] + '<calcPr fullCalcOnLoad="1"/>' + workbook_xml[m.start():]
+
+        if drop_calc_chain:
+            rels_xml = re.sub(r'<Relationship[^>]*Target="[^"]*calcChain\.xml"[^>]*/>', '', rels_xml)
+            ct_xml = re.sub(r'<Override[^>]*PartName="/xl/calcChain\.xml"[^>]*/>', '', ct_xml)
+
+        edited = {'xl/workbook.xml': workbook_xml, 'xl/_rels/workbook.xml.rels': rels_xml, '[Content_Types].xml': ct_xml}
+        if date_style is not None and new_styles is not None:
+            edited['xl/styles.xml'] = new_styles
+
+        with zipfile.ZipFile(filepath, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                name = info.filename
+                if drop_calc_chain and name == 'xl/calcChain.xml':
+                    continue
+                if name in replaced:
+                    sheet_name = replaced[name]
+                    df, idx_bool = dfs_to_export[sheet_name]
+                    prefix, suffix, old_data, ns_prefix = templates[name]
+                    start = time.perf_counter()
+                    _write_sheet(zout, name, prefix, suffix, df, idx_bool, old_data, date_style, ns_prefix)
+                    _report_rate(sheet_name, len(df), time.perf_counter() - start)
+                elif name in edited:
+                    zout.writestr(info, edited[name])
+                else:
+                    # Cópia sem alteração (gráficos, estilos, pivot caches, desenhos...)
+                    zout.writestr(info, zin.read(name))
+
+            for part, sheet_name in new_parts.items():
+                df, idx_bool = dfs_to_export[sheet_name]
+                start = time.perf_counter()
+                _write_sheet(zout, part, f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet xmlns="{NS_MAIN}" xmlns:r="{NS_REL}">',
+                             '</worksheet>', df, idx_bool, date_style=date_style)
+                _report_rate(sheet_name, len(df), time.perf_counter() - start)
+    return filepath
+
+@traced()
+def export_to_excel(output_dir, data_fechamento, metrics_dict, use_template=True):
     """
     Gera o arquivo Excel de monitoramento.
-    Se existir 'modelo_monitoramento.xlsx' na raiz, usa como template (preservando gráficos).
-    Caso contrário, gera um arquivo novo do zero.
+    Se existir 'modelo_monitoramento.xlsx' na raiz (e use_template=True), usa como template (preservando gráficos).
+    Caso contrário, gera um arquivo novo do zero em modo streaming (write-only).
     """
     data_dt = pd.to_datetime(data_fechamento)
     mes = data_dt.month
@@ -66,34 +394,20 @@ def export_to_excel(output_dir, data_fechamento, metrics_dict):
     # ---------------------------------------------------------
     # MODO MODELO (Template)
     # ---------------------------------------------------------
-    if os.path.exists(template_path):
+    if use_template and os.path.exists(template_path):
         print(f"Modelo encontrado! Usando '{template_path}' como base...")
         try:
-            wb = load_workbook(template_path)
-            
-            for sheet_name, (df, idx_bool) in dfs_to_export.items():
-                if sheet_name in wb.sheetnames:
-                    ws = wb[sheet_name]
-                    # Atualiza os dados preservando o resto do arquivo
-                    write_to_sheet(ws, df, idx_bool)
-                else:
-                    # Se o modelo não tiver a aba, cria
-                    ws = wb.create_sheet(sheet_name)
-                    write_to_sheet(ws, df, idx_bool)
-            
-            wb.save(filepath)
+            # Substitui só os dados das abas no XML do modelo (resto do arquivo copiado sem alteração)
+            fill_template(template_path, filepath, dfs_to_export)
             print(f"Excel gerado com sucesso (baseado no modelo) em: {filepath}")
             return filepath
         except Exception as e:
             print(f"Erro ao processar modelo: {e}. Tentando método padrão...")
     
     # ---------------------------------------------------------
-    # MODO PADRÃO (Raw)
+    # MODO PADRÃO (Streaming, sem modelo)
     # ---------------------------------------------------------
-    print(f"Gerando NOVO arquivo Excel (sem modelo) em: {filepath}")
-    with pd.ExcelWriter(filepath, engine='openpyxl', mode='w') as writer:
-        for sheet_name, (df, idx_bool) in dfs_to_export.items():
-            df.to_excel(writer, sheet_name=sheet_name, index=idx_bool)
+    export_streaming(filepath, dfs_to_export)
 
     print("Excel gerado com sucesso!")
     return filepath
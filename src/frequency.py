@@ -0,0 +1,88 @@
+import pandas as pd
+import numpy as np
+
+def _factorize(series):
+    """
+    Códigos inteiros da variável e o índice de categorias correspondente.
+    Categóricas: todas as categorias (como no value_counts) + NaN no último código.
+    Demais: valores na ordem de aparição, NaN incluído como um valor.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        n_cat = len(series.cat.categories)
+        codes = series.cat.codes.to_numpy().astype(np.int64)
+        codes[codes < 0] = n_cat
+        index = pd.CategoricalIndex(pd.Categorical.from_codes(np.append(np.arange(n_cat), -1), dtype=series.dtype))
+        return codes, index, True
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return codes.astype(np.int64), pd.Index(uniques), False
+
+def frequency_counts(df, variables, by=None, dropna=False):
+    """
+    Frequências de várias variáveis numa única passada: cada variável é fatorada uma vez e
+    todas as combinações (grupo x variável x categoria) saem de um único np.bincount.
+    Retorna {grupo: {variável: Series}}, cada Series no formato do value_counts(dropna=False)
+    (decrescente; empates na ordem de aparição). Sem `by`, o único grupo é None.
+    Linhas com `by` nulo são ignoradas.
+    """
+    if by is None:
+        g_codes = np.zeros(len(df), dtype=np.int64)
+        groups = [None]
+    else:
+        g_codes, groups = pd.factorize(df[by], use_na_sentinel=True)
+        g_codes = g_codes.astype(np.int64)
+        groups = list(groups)
+    in_group = g_codes >= 0
+
+    # Fatoração de cada variável e deslocamento do bloco dela no vetor empilhado
+    meta = []
+    offset = 0
+    for var in variables:
+        codes, index, is_cat = _factorize(df[var])
+        meta.append((var, codes[in_group], index, is_cat, offset))
+        offset += len(index)
+    width = offset
+
+    # Bincount empilhado: código = grupo * largura total + deslocamento da variável + categoria
+    g_valid = g_codes[in_group]
+    stacked = np.concatenate([g_valid * width + off + codes for _, codes, _, _, off in meta]) if meta else np.array([], dtype=np.int64)
+    counts = np.bincount(stacked, minlength=len(groups) * width).reshape(len(groups), width)
+
+    result = {}
+    for gi, group in enumerate(groups):
+        result[group] = {}
+        for var, _, index, is_cat, off in meta:
+            s = pd.Series(counts[gi, off:off + len(index)], index=index, name='count')
+            s.index.name = var
+            # Sem ocorrência: categorias são mantidas (como no value_counts), NaN e demais valores não
+            keep = (s > 0) | (s.index.notna() if is_cat else False)
+            if dropna:
+                keep &= s.index.notna()
+            s = s[keep]
+            result[group][var] = s.sort_values(ascending=False, kind='stable')
+    return result
+
+def frequency_table(df, variables, by=None):
+    """
+    Tabela longa de frequências (uma passada, ver frequency_counts):
+    [by] | Variável | Categoria | Frequência | % | % válido | Total
+    '%' usa todos os registros do grupo (inclui nulos); '% válido' exclui os nulos.
+    """
+    rows = []
+    for group, by_var in frequency_counts(df, variables, by=by).items():
+        for var, s in by_var.items():
+            total = s.sum()
+            valid = s[s.index.notna()]
+            temp = pd.DataFrame({
+                'Variável': var,
+                'Categoria': s.index.astype(object),
+                'Frequência': s.values,
+                '%': (s / total * 100).values if total > 0 else 0.0,
+                '% válido': (s / valid.sum() * 100).where(s.index.notna()).values if valid.sum() > 0 else np.nan,
+                'Total': total
+            })
+            if by is not None:
+                temp.insert(0, by, group)
+            rows.append(temp)
+    if not rows:
+        return pd.DataFrame()
+    return pd.concat(rows, ignore_index=True)
@@ -1,23 +1,272 @@
 import argparse
 import os
+import sys
 import time
 import pandas as pd
-from .config import MONTHS_ORDER
+from .config import DRAFT_CHART_DIR
 from .data_loader import carregar_bases
 from .cleaning import clean_disp_df, process_cadastro
 from .preprocessing import enrich_disp_data, calculate_intervals, flag_first_last_disp, calculate_population_groups
-from .analysis import generate_disp_metrics, generate_new_users_metrics, generate_prep_history, generate_prep_history_legacy, classify_prep_users, generate_population_metrics, classify_udm_active, generate_annual_summary, generate_uf_summary, generate_mun_summary, calculate_ppt_metrics
-from .prep_consolidation import create_prep_dataframe
+from .analysis import generate_prep_history, classify_udm_active, generate_udm_history, generate_prep_history_multi, generate_cohort_retention, cohort_retention_matrix, calculate_ppt_metrics
+from .prep_consolidation import create_prep_dataframe, widen_yearly_extremes
+from .prep_store import save_prep_parquet, save_disp_ano_dataset, export_csv_background, wait_csv_export, get_prep_paths
 from .excel_generator import export_to_excel
-from .visualization import plot_dispensations, plot_cascade, plot_prep_annual_summary, plot_new_users, plot_horizontal_bars, plot_modalities, plot_ist_metrics, plot_vertical_bars
-from .optimization_tools import measure_time, compare_dataframes
-from .ppt_generator import generate_ppt
+from .visualization import active_column_counts, modalities_table, ist_metrics_sums
+from .chart_pool import chart_job, render_charts
+from .artifacts import defer_writes, persist_artifacts
+from .publish import start_staging, publish, publish_remaining, wait_publish
+from .pipeline import stage, run_pipeline
+from .tracing import span, write_trace
+from .memory import start_budget, stop_budget
+from .cube import build_monitoring_cube, save_cube, active_counts, classifications_from_cube, cascade_counts_from_cube, annual_chart_from_cube, disp_metrics_from_cube, new_users_metrics_from_cube, population_metrics_from_cube, annual_summary_from_cube, uf_summary_from_cube, mun_summary_from_cube
+from .episodes import build_episodes, save_episodes, episodes_source
+from .ppt_generator import generate_ppt, PPT_METRIC_KEYS
+
+# -----------------------------------------------------------------------------
+# ETAPAS DO PIPELINE
+# Cada etapa recebe as entradas declaradas em STAGES e retorna as saídas.
+# Etapas que só leem os mesmos dataframes (Excel, gráficos, métricas do PPT,
+# exportação do df PrEP, histórico por UDM...) rodam ao mesmo tempo.
+# -----------------------------------------------------------------------------
+
+def _stage_bases(args):
+    # carregar_disp=True, carregar_cad=True, carregar_pvha=True -> Carrega tudo que precisamos
+    data_fechamento = pd.to_datetime(args.data_fechamento).date()
+    bases = carregar_bases(data_fechamento, carregar_disp=True, carregar_cad=True, carregar_pvha=True, use_cache=not args.no_cache)
+    # Dispensas brutas à parte: só a limpeza usa (liberadas depois dela com --memoria_gb)
+    df_disp = bases.pop("Disp", pd.DataFrame())
+    return df_disp, bases
+
+def _stage_limpeza(disp_bruta, bases, args):
+    df_disp = disp_bruta
+    df_cad_prep = bases.get("Cadastro_PrEP", pd.DataFrame()) # Demográfico
+
+    if df_disp.empty:
+        raise ValueError("Base de dispensas vazia ou não encontrada.")
+
+    # Processar Cadastro (Normalizar datas e deduplicar)
+    df_cad_prep = process_cadastro(df_cad_prep)
+
+    # 2. Limpeza (Conforme orientações estritas)
+    df_disp, df_disp_semdupl = clean_disp_df(df_disp, args.data_fechamento)
+    return df_disp_semdupl, df_cad_prep
+
+def _stage_enriquecimento(disp_limpa, cad_prep, bases):
+    df_cad_hiv = bases.get("Cadastro_HIV", pd.DataFrame())   # PVHA (Cod_unificado)
+    df_pvha = bases.get("PVHA", pd.DataFrame())
+    df_pvha_prim = bases.get("PVHA_Prim", pd.DataFrame())
+    df_ibge = bases.get("Tabela_IBGE", pd.DataFrame())
+
+    # 3. Processamento (Enriquecimento completo com os 4 merges)
+    df_disp_semdupl = enrich_disp_data(disp_limpa, cad_prep, df_cad_hiv, df_pvha, df_pvha_prim, df_ibge)
+    df_disp_semdupl = calculate_intervals(df_disp_semdupl)
+    df_disp_semdupl = flag_first_last_disp(df_disp_semdupl)
+    return df_disp_semdupl
+
+def _stage_dispensas(disp_enriquecida, args):
+    # 4. Análise e Outputs
+    # a) Histórico EmPrEP Detalhado (Gera flags no dataframe e tabela histórica)
+    df_disp_semdupl, df_history = generate_prep_history(disp_enriquecida, args.data_fechamento)
+
+    # b) Classificação UDM Ativa
+    df_disp_semdupl = classify_udm_active(df_disp_semdupl, args.data_fechamento)
+
+    # Ano da dispensa (antes na consolidação): 'disp' sai pronta daqui e só esta etapa a grava no checkpoint
+    df_disp_semdupl['ano_disp'] = df_disp_semdupl['dt_disp'].dt.year
+    return df_disp_semdupl, df_history
+
+def _stage_consolidacao(disp, cad_prep, bases, args):
+    # 5. Consolidação Final (df PrEP - Uma linha por paciente)
+    # Datas min/max por ano ficam na tabela longa df_disp_ano (colunas largas só na exportação).
+    df_prep, df_disp_ano = create_prep_dataframe(disp, cad_prep, bases.get("Cadastro_HIV", pd.DataFrame()), bases.get("PVHA", pd.DataFrame()),
+                                                 bases.get("PVHA_Prim", pd.DataFrame()), data_fechamento=args.data_fechamento, return_yearly=True)
+
+    # Recalcular grupos populacionais no consolidado para garantir consistência
+    df_prep = calculate_population_groups(df_prep)
+
+    print(f"\n--- DataFrame Consolidado 'df PrEP' ---")
+    print(f"Linhas: {len(df_prep)} (Deve bater com usuários únicos no cadastro)")
+    print(f"Colunas: {len(df_prep.columns)}")
+    return df_prep, df_disp_ano
+
+def _stage_revisoes(disp, args):
+    # a.1) Histórico como reportado em datas de fechamento anteriores (revisões)
+    datas_revisao = [d for d in args.datas_revisao if pd.to_datetime(d) <= pd.to_datetime(args.data_fechamento)]
+    if len(datas_revisao) < len(args.datas_revisao):
+        print("Aviso: Datas de revisão posteriores à data de fechamento foram ignoradas.")
+    df_history_multi = generate_prep_history_multi(disp, datas_revisao + [args.data_fechamento])
+    revisao_file = os.path.join(args.output_dir, "historico_revisoes.csv")
+    print(f"Salvando histórico por data de fechamento em: {revisao_file}")
+    df_history_multi.to_csv(revisao_file, sep=';', index=False)
+    publish(revisao_file)
+    return revisao_file
+
+def _stage_episodios(disp, args):
+    # a.2) Episódios de uso contínuo (persistidos por fechamento para as análises de comportamento)
+    df_episodios = build_episodes(disp, args.data_fechamento)
+    save_episodes(df_episodios, args.data_fechamento, fonte=episodes_source(disp))
+    return df_episodios
+
+def _stage_base_prep(prep, disp_ano, args):
+    # 6. Salvar df_prep: Parquet tipado (lido pelos scripts de análise) e CSV opcional em segundo plano
+    df_prep_export = widen_yearly_extremes(prep, disp_ano)
+    parquet_ok = save_prep_parquet(df_prep_export, args.output_dir)
+    disp_ano_path = save_disp_ano_dataset(disp_ano, args.output_dir)
+    publish(get_prep_paths(args.output_dir)[0], disp_ano_path)
+    csv_thread = None
+    if not args.skip_csv or not parquet_ok:
+        csv_thread = export_csv_background(df_prep_export, args.output_dir)
+    return csv_thread
+
+def _stage_historico_udm(disp, args):
+    # Histórico mensal por serviço (codigo_udm x mês)
+    df_udm_history = generate_udm_history(disp, args.data_fechamento)
+    udm_file = os.path.join(args.output_dir, "historico_udm.csv")
+    print(f"Salvando histórico por UDM em: {udm_file}")
+    df_udm_history.to_csv(udm_file, sep=';', index=False)
+    publish(udm_file)
+    return udm_file
+
+def _stage_retencao(disp, args):
+    # Retenção por coorte de início (% Em PrEP k meses após a primeira dispensa)
+    df_retencao = generate_cohort_retention(disp, args.data_fechamento)
+    retencao_file = os.path.join(args.output_dir, "retencao_coortes.csv")
+    print(f"Salvando retenção por coorte em: {retencao_file}")
+    df_retencao.to_csv(retencao_file, sep=';', index=False)
+    publish(retencao_file)
+    print("\n--- Retenção por Coorte (% Em PrEP após 1, 3, 6 e 12 meses) ---")
+    print(cohort_retention_matrix(df_retencao).tail(13))
+    return retencao_file
+
+def _stage_cubo(prep, disp, args):
+    # 7. Cubo de Monitoramento (calculado uma vez; Excel, gráficos e PPT são fatias dele)
+    cube = build_monitoring_cube(prep, disp, args.data_fechamento)
+    save_cube(cube, args.data_fechamento)
+
+    # -------------------------------------------------------------------------
+    # CONFERÊNCIA DE VALORES
+    # -------------------------------------------------------------------------
+    print("\n--- Conferência EmPrEP_Atual ---")
+    if "EmPrEP_Atual" in prep.columns:
+        print(prep["EmPrEP_Atual"].value_counts())
+
+    print("\n--- Dispensas por Mês/Ano ---")
+    print(disp_metrics_from_cube(cube))
+    return cube
+
+def _stage_excel(cube, historico, args):
+    metrics_to_export = {
+        # c) Classificações Atuais (12m, EmPrEP)
+        'classificacoes': classifications_from_cube(cube),
+        # d) Dispensas por Mês/Ano
+        'disp_mes_ano': disp_metrics_from_cube(cube),
+        # e) Novos Usuários por Mês/Ano
+        'novos_usuarios': new_users_metrics_from_cube(cube),
+        'historico': historico,
+        # f) Populações (apenas Em PrEP atualmente)
+        'populacoes': population_metrics_from_cube(cube),
+        # g) Resumo Anual (Nova Aba)
+        'annual_summary': annual_summary_from_cube(cube, args.data_fechamento),
+        # h) Resumo por UF (Nova Aba)
+        'uf_summary': uf_summary_from_cube(cube),
+        # i) Resumo por Mun (Nova Aba)
+        'mun_summary': mun_summary_from_cube(cube)
+    }
+
+    excel_file = export_to_excel(args.output_dir, args.data_fechamento, metrics_to_export, use_template=not args.excel_sem_modelo)
+    publish(excel_file)
+    return excel_file
+
+def _stage_graficos(cube, prep, disp, graficos_ppt, args):
+    # Gráficos: jobs com as fatias já agregadas, desenhados juntos no pool de processos
+    chart_jobs = []
+    # Rascunho: imagens numa subpasta própria, para não substituir as de publicação no output_dir
+    chart_dir = os.path.join(args.output_dir, DRAFT_CHART_DIR) if args.rascunho else args.output_dir
+
+    # Gráfico de Cascata
+    chart_jobs.append(chart_job('render_cascade', cascade_counts_from_cube(cube), chart_dir))
+
+    # Gráfico Anual (Barras Agrupadas)
+    chart_jobs.append(chart_job('render_prep_annual_summary', *annual_chart_from_cube(cube, args.data_fechamento), chart_dir))
+
+    # Gráfico de Novos Usuários
+    chart_jobs.append(chart_job('render_new_users', new_users_metrics_from_cube(cube), args.data_fechamento, chart_dir))
+
+    # Gráfico de Dispensas
+    chart_jobs.append(chart_job('render_dispensations', disp_metrics_from_cube(cube), args.data_fechamento, chart_dir))
+
+    if graficos_ppt:
+        # Gráficos Adicionais para o PPT
+
+        # Slide 5: Populações (Roxo, %, sem Outros)
+        chart_jobs.append(chart_job('render_horizontal_bars', active_counts(cube, 'Pop_genero_pratica'), 'PrEP_pop.png', chart_dir,
+                                    color='#604A7B', show_percentage=True, filter_others=True))
+
+        # Slide 6: Faixa Etária (Vertical, Azul Escuro, %)
+        chart_jobs.append(chart_job('render_vertical_bars', active_counts(cube, 'fetar'), 'PrEP_fetar.png', chart_dir,
+                                    color='#254061', show_percentage=True))
+
+        # Slide 7: Escolaridade (Vertical, %, Sem Ignorado)
+        escol_order = ["Sem educação formal a 3 anos", "De 4 a 7 anos", "De 8 a 11 anos", "12 ou mais anos"]
+        chart_jobs.append(chart_job('render_vertical_bars', active_counts(cube, 'escol4'), 'PrEP_escol4.png', chart_dir,
+                                    color='#215968', show_percentage=True, filter_ignored=True, custom_order=escol_order))
+
+        # Slide 8: Raça (Horizontal, %)
+        chart_jobs.append(chart_job('render_horizontal_bars', active_counts(cube, 'raca4_cat'), 'PrEP_raca.png', chart_dir,
+                                    color='#215968', show_percentage=True))
+
+        # Gráfico de Modalidades (Horizontal Bars Teal)
+        modalidades = modalities_table(disp)
+        if modalidades is not None:
+            chart_jobs.append(chart_job('render_modalities', modalidades, chart_dir))
+
+        # Gráfico de IST (Baseado em Dispensas). Ambos gravam PrEP_IST.png: o de dispensas
+        # prevalece e o de st_ist (ajuste conforme seu banco real) só é gerado na falta dele
+        ist_sums = ist_metrics_sums(disp)
+        if ist_sums is not None:
+            chart_jobs.append(chart_job('render_ist_metrics', *ist_sums, chart_dir))
+        elif 'st_ist' in prep.columns:
+            chart_jobs.append(chart_job('render_horizontal_bars', active_column_counts(prep, 'st_ist').sort_values(ascending=False),
+                                        'PrEP_IST.png', chart_dir, color='#C0504D'))
+
+    # Imagens ficam em memória para o PPT (defer_writes em main); gravadas no output_dir ao final
+    return render_charts(chart_jobs, draft=args.rascunho)
+
+def _stage_metricas_ppt(prep, disp, cube, args):
+    # Métricas para o Texto dos Slides
+    return calculate_ppt_metrics(prep, disp, args.data_fechamento, cube=cube, outputs=PPT_METRIC_KEYS)
+
+def _stage_ppt(ppt_metrics, graficos_paths, args):
+    print("\n--- Iniciando Geração do PowerPoint ---")
+    generate_ppt(args.output_dir, ppt_metrics, args.data_fechamento, draft=args.rascunho)
+
+STAGES = [
+    stage('bases', _stage_bases, ['args'], ['disp_bruta', 'bases'], external=True),
+    # Checkpoints só a partir de 'dispensas': cada tabela de dispensas é gravada uma vez (limpeza e
+    # enriquecimento só rodam com --resume se as dispensas precisarem ser recalculadas)
+    stage('limpeza', _stage_limpeza, ['disp_bruta', 'bases', 'args'], ['disp_limpa', 'cad_prep']),
+    stage('enriquecimento', _stage_enriquecimento, ['disp_limpa', 'cad_prep', 'bases'], ['disp_enriquecida']),
+    stage('dispensas', _stage_dispensas, ['disp_enriquecida', 'args'], ['disp', 'historico'], checkpoint=True),
+    stage('consolidacao', _stage_consolidacao, ['disp', 'cad_prep', 'bases', 'args'], ['prep', 'disp_ano'], checkpoint=True),
+    stage('revisoes', _stage_revisoes, ['disp', 'args'], ['arquivo_revisoes']),
+    stage('episodios', _stage_episodios, ['disp', 'args'], ['episodios_df']),
+    stage('base_prep', _stage_base_prep, ['prep', 'disp_ano', 'args'], ['csv_thread']),
+    stage('historico_udm', _stage_historico_udm, ['disp', 'args'], ['arquivo_historico_udm']),
+    stage('retencao', _stage_retencao, ['disp', 'args'], ['arquivo_retencao']),
+    stage('cubo', _stage_cubo, ['prep', 'disp', 'args'], ['cube'], checkpoint=True),
+    stage('excel', _stage_excel, ['cube', 'historico', 'args'], ['arquivo_excel']),
+    stage('graficos', _stage_graficos, ['cube', 'prep', 'disp', 'graficos_ppt', 'args'], ['graficos_paths']),
+    stage('metricas_ppt', _stage_metricas_ppt, ['prep', 'disp', 'cube', 'args'], ['ppt_metrics'], checkpoint=True),
+    stage('ppt', _stage_ppt, ['ppt_metrics', 'graficos_paths', 'args'], []),
+]
+# Alvos padrão (execução completa); revisoes entra quando há --datas_revisao
+DEFAULT_TARGETS = ['base_prep', 'episodios', 'historico_udm', 'retencao', 'excel', 'graficos', 'ppt']
 
 def main():
     start_time = time.time()
-    
+
     default_output = r"V:\2026\Monitoramento e Avaliação\DOCUMENTOS\PrEP\Dados_automaticos"
-    
+
     parser = argparse.ArgumentParser(description="Monitoramento PrEP CLI")
     parser.add_argument("--data_fechamento", required=True, help="Data de fechamento no formato YYYY-MM-DD (Ex: 2025-09-30)")
     parser.add_argument("--output_dir", default=default_output, help="Diretório para salvar os outputs")
@@ -25,9 +274,18 @@ def main():
     parser.add_argument("--auto", action="store_true", help="Modo automático (não pergunta e gera tudo).")
     parser.add_argument("--skip_excel", action="store_true", help="Pular geração do Excel.")
     parser.add_argument("--skip_ppt", action="store_true", help="Pular geração do PowerPoint.")
-    
+    parser.add_argument("--excel_sem_modelo", action="store_true", help="Gera o Excel em modo streaming (write-only), ignorando o modelo_monitoramento.xlsx.")
+    parser.add_argument("--skip_csv", action="store_true", help="Pular a exportação CSV do df PrEP (o Parquet é sempre gerado).")
+    parser.add_argument("--rascunho", action="store_true", help="Gráficos e PPT em modo rascunho (baixa resolução, mais rápido) para conferir números e layout.")
+    parser.add_argument("--datas_revisao", nargs="+", default=None, help="Datas de fechamento anteriores (YYYY-MM-DD) para reconstituir o histórico Em PrEP/Descontinuados (Ex: 2024-12-31 2025-06-30).")
+    parser.add_argument("--alvos", nargs="+", default=None, choices=[s['name'] for s in STAGES],
+                        help="Gera apenas estes alvos (e as etapas de que dependem). Ex: --alvos excel ou --alvos cubo graficos. Padrão: tudo.")
+    parser.add_argument("--resume", action="store_true", help="Retoma as etapas de dados (dispensas, df PrEP, cubo, métricas) dos checkpoints da execução anterior quando bases e código não mudaram (e grava os novos).")
+    parser.add_argument("--checkpoint", action="store_true", help="Grava os checkpoints das etapas de dados para uma próxima execução com --resume (sem retomar os atuais).")
+    parser.add_argument("--memoria_gb", type=float, default=None, help="Orçamento de memória em GB (Ex: 8): compacta as tabelas, libera intermediárias e avisa perto do limite.")
+
     args = parser.parse_args()
-    
+
     # Interatividade (Se não for auto)
     if not args.auto:
         print("\n--- Configuração de Saída ---")
@@ -35,11 +293,23 @@ def main():
         if not args.skip_excel:
             resp = input("Gerar Excel? (S/n): ").strip().lower()
             if resp == 'n': args.skip_excel = True
-            
+
         if not args.skip_ppt:
             resp = input("Gerar PowerPoint? (S/n): ").strip().lower()
             if resp == 'n': args.skip_ppt = True
-    
+
+    # Alvos: --alvos ou a execução completa, menos os pulados (--skip_excel / --skip_ppt)
+    targets = list(args.alvos or DEFAULT_TARGETS + (['revisoes'] if args.datas_revisao else []))
+    if args.skip_excel and 'excel' in targets:
+        targets.remove('excel')
+        print("\n[INFO] Geração de Excel pulada pelo usuário.")
+    if args.skip_ppt and 'ppt' in targets:
+        targets.remove('ppt')
+        print("\n[INFO] Geração de PowerPoint pulada pelo usuário.")
+    if 'revisoes' in targets and not args.datas_revisao:
+        print("Aviso: Alvo 'revisoes' requer --datas_revisao; ignorado.")
+        targets.remove('revisoes')
+
     # Garantir que o diretório de saída exista
     if not os.path.exists(args.output_dir):
         try:
@@ -48,7 +318,14 @@ def main():
         except Exception as e:
             print(f"Aviso: Não foi possível criar o diretório {args.output_dir}. Usando diretório atual. Erro: {e}")
             args.output_dir = "."
-    
+
+    # Outputs gravados numa pasta local e publicados no output_dir em segundo plano
+    publish_dir = args.output_dir
+    try:
+        args.output_dir = start_staging(publish_dir)
+    except Exception as e:
+        print(f"Aviso: Não foi possível preparar a pasta local ({e}). Gravando direto em {publish_dir}.")
+
     # Validar Data
     try:
         data_fechamento = pd.to_datetime(args.data_fechamento).date()
@@ -57,165 +334,48 @@ def main():
         return
 
     print(f"Executando Monitoramento PrEP para data: {data_fechamento}")
-    
-    # 1. Carregar Bases
-    # carregar_disp=True, carregar_cad=True, carregar_pvha=True -> Carrega tudo que precisamos
-    bases = carregar_bases(data_fechamento, carregar_disp=True, carregar_cad=True, carregar_pvha=True, use_cache=not args.no_cache)
-    
-    df_disp = bases.get("Disp", pd.DataFrame())
-    df_cad_prep = bases.get("Cadastro_PrEP", pd.DataFrame()) # Demográfico
-    df_cad_hiv = bases.get("Cadastro_HIV", pd.DataFrame())   # PVHA (Cod_unificado)
-    df_pvha = bases.get("PVHA", pd.DataFrame())
-    df_pvha_prim = bases.get("PVHA_Prim", pd.DataFrame())
-    df_ibge = bases.get("Tabela_IBGE", pd.DataFrame())
-    
-    if df_disp.empty:
-        print("Erro: Base de dispensas vazia ou não encontrada.")
-        return
 
-    # Processar Cadastro (Normalizar datas e deduplicar)
-    df_cad_prep = process_cadastro(df_cad_prep)
+    # Orçamento de memória: acompanha o pico do processo (ver memory)
+    memory_budget = start_budget(args.memoria_gb) if args.memoria_gb else None
 
-    # 2. Limpeza (Conforme orientações estritas)
-    df_disp, df_disp_semdupl = clean_disp_df(df_disp, args.data_fechamento)
-    
-    # 3. Processamento (Enriquecimento completo com os 4 merges)
-    df_disp_semdupl = enrich_disp_data(df_disp_semdupl, df_cad_prep, df_cad_hiv, df_pvha, df_pvha_prim, df_ibge)
-    df_disp_semdupl = calculate_intervals(df_disp_semdupl)
-    df_disp_semdupl = flag_first_last_disp(df_disp_semdupl)
-    
-    # 4. Análise e Outputs
-    # a) Histórico EmPrEP Detalhado (Gera flags no dataframe e tabela histórica)
-    df_disp_semdupl, df_history = generate_prep_history(df_disp_semdupl, args.data_fechamento)
-    
-    # b) Classificação UDM Ativa
-    df_disp_semdupl = classify_udm_active(df_disp_semdupl, args.data_fechamento)
+    # Rastro da execução: cada etapa e sub-etapa é um span sob 'execucao' (ver tracing)
+    with span('execucao', data_fechamento=str(data_fechamento), alvos=targets) as root:
+        # Imagens ficam em memória para o PPT; gravadas no output_dir ao final (persist_artifacts)
+        defer_writes(True)
+        # Chaves e checkpoints só quando pedidos (hash das bases e gravação das tabelas custam tempo e disco)
+        checkpoint_scope = data_fechamento if args.resume or args.checkpoint else None
+        context, failed = run_pipeline(STAGES, targets, context={'args': args, 'graficos_ppt': 'ppt' in targets},
+                                       checkpoint_scope=checkpoint_scope, resume=args.resume, memory_budget=memory_budget)
 
-    # 5. Consolidação Final (df PrEP - Uma linha por paciente)
-    df_prep = create_prep_dataframe(df_disp_semdupl, df_cad_prep, df_cad_hiv, df_pvha, df_pvha_prim, data_fechamento=args.data_fechamento)
-    
-    # Recalcular grupos populacionais no consolidado para garantir consistência
-    df_prep = calculate_population_groups(df_prep)
-    
-    print(f"\n--- DataFrame Consolidado 'df PrEP' ---")
-    print(f"Linhas: {len(df_prep)} (Deve bater com usuários únicos no cadastro)")
-    print(f"Colunas: {len(df_prep.columns)}")
-    
-    # 6. Salvar df_prep em CSV (Opcional, mas útil para conferência)
-    prep_file = os.path.join(args.output_dir, "df_prep_consolidado.csv")
-    print(f"Salvando base consolidada em: {prep_file}")
-    df_prep.to_csv(prep_file, sep=';', index=False)
-    
-    # Gerar Gráfico de Cascata
-    plot_cascade(df_prep, args.output_dir)
-    
-    # Gerar Gráfico Anual (Barras Agrupadas)
-    plot_prep_annual_summary(df_prep, args.data_fechamento, args.output_dir)
-    
-    # Gerar Gráfico de Novos Usuários
-    plot_new_users(df_prep, args.data_fechamento, args.output_dir)
-
-    # c) Classificações Atuais (12m, EmPrEP) 
-    classificacoes = classify_prep_users(df_prep, args.data_fechamento)
-    
-    # -------------------------------------------------------------------------
-    # CONFERÊNCIA DE VALORES
-    # -------------------------------------------------------------------------
-    print("\n--- Conferência EmPrEP_Atual ---")
-    if "EmPrEP_Atual" in df_prep.columns:
-        print(df_prep["EmPrEP_Atual"].value_counts())
-    
-    # d) Dispensas por Mês/Ano
-    disp_metrics = generate_disp_metrics(df_disp_semdupl)
-    print("\n--- Dispensas por Mês/Ano ---")
-    print(disp_metrics)
-    
-    # Gerar Gráfico
-    plot_dispensations(df_disp_semdupl, args.data_fechamento, args.output_dir)
-    
-    # e) Novos Usuários por Mês/Ano
-    new_users_metrics = generate_new_users_metrics(df_prep)
-    
-    # f) Populações (apenas Em PrEP atualmente)
-    pop_metrics = generate_population_metrics(df_prep)
-    
-    # g) Resumo Anual (Nova Aba)
-    annual_summary = generate_annual_summary(df_prep, args.data_fechamento)
-    
-    # h) Resumo por UF (Nova Aba)
-    uf_summary = generate_uf_summary(df_prep, df_disp_semdupl)
-    
-    # i) Resumo por Mun (Nova Aba)
-    mun_summary = generate_mun_summary(df_prep, df_disp_semdupl)
-    
-    # Exportação Excel
-    if not os.path.exists(args.output_dir):
-        os.makedirs(args.output_dir)
-        
-    metrics_to_export = {
-        'classificacoes': classificacoes,
-        'disp_mes_ano': disp_metrics,
-        'novos_usuarios': new_users_metrics,
-        'historico': df_history, 
-        'populacoes': pop_metrics,
-        'annual_summary': annual_summary,
-        'uf_summary': uf_summary,
-        'mun_summary': mun_summary
-    }
-    
-    if not args.skip_excel:
-        excel_file = export_to_excel(args.output_dir, args.data_fechamento, metrics_to_export)
-    else:
-        print("\n[INFO] Geração de Excel pulada pelo usuário.")
+        with span('gravar_imagens'):
+            persist_artifacts()
+        defer_writes(False)
 
-    # -------------------------------------------------------------------------
-    # GERAÇÃO DO POWERPOINT
-    # -------------------------------------------------------------------------
-    if not args.skip_ppt:
-        print("\n--- Iniciando Geração do PowerPoint ---")
-        
-        # 1. Calcular Métricas para o Texto dos Slides
-        ppt_metrics = calculate_ppt_metrics(df_prep, df_disp_semdupl, args.data_fechamento)
-        
-        # 2. Gerar Gráficos Adicionais para o PPT
-        
-        # Slide 5: Populações (Roxo, %, sem Outros)
-        plot_horizontal_bars(df_prep, 'Pop_genero_pratica', 'PrEP_pop.png', args.output_dir, 
-                             color='#604A7B', show_percentage=True, filter_others=True)
-        
-        # Slide 6: Faixa Etária (Vertical, Azul Escuro, %)
-        plot_vertical_bars(df_prep, 'fetar', 'PrEP_fetar.png', args.output_dir, 
-                           color='#254061', show_percentage=True)
-        
-        # Slide 7: Escolaridade (Vertical, %, Sem Ignorado)
-        escol_order = ["Sem educação formal a 3 anos", "De 4 a 7 anos", "De 8 a 11 anos", "12 ou mais anos"]
-        plot_vertical_bars(df_prep, 'escol4', 'PrEP_escol4.png', args.output_dir, 
-                           color='#215968', show_percentage=True, filter_ignored=True, custom_order=escol_order)
-                           
-        # Slide 8: Raça (Horizontal, %)
-        plot_horizontal_bars(df_prep, 'raca4_cat', 'PrEP_raca.png', args.output_dir, 
-                             color='#215968', show_percentage=True)
-        
-        # Tentar gerar gráfico de IST se coluna existir (ajuste 'st_ist' conforme seu banco real)
-        if 'st_ist' in df_prep.columns:
-            plot_horizontal_bars(df_prep, 'st_ist', 'PrEP_IST.png', args.output_dir, color='#C0504D')
-        
-        # Gráfico de Modalidades (Horizontal Bars Teal)
-        plot_modalities(df_disp_semdupl, args.output_dir)
-        
-        # Gráfico de IST (Baseado em Dispensas)
-        plot_ist_metrics(df_disp_semdupl, args.output_dir)
-        
-        # 3. Criar Arquivo PPTX
-        generate_ppt(args.output_dir, ppt_metrics, args.data_fechamento)
-    else:
-        print("\n[INFO] Geração de PowerPoint pulada pelo usuário.")
+        with span('aguardar_csv'):
+            wait_csv_export(context.get('csv_thread'))
+
+        compute_time = time.time() - start_time
+
+        # Publicação no output_dir (o que ainda não foi enviado: imagens, PPT, CSV do df PrEP...)
+        with span('publicacao'):
+            publish_remaining()
+            wait_publish()
+    write_trace(root, data_fechamento)
+    if memory_budget is not None:
+        stop_budget(root)
 
     end_time = time.time()
     elapsed_time = end_time - start_time
+    print(f"\nTempo de processamento: {int(compute_time // 60)}m {int(compute_time % 60)}s")
+    print(f"Tempo de publicação (após o processamento): {elapsed_time - compute_time:.1f}s")
     minutes = int(elapsed_time // 60)
     seconds = int(elapsed_time % 60)
-    print(f"\nTempo total de execução: {minutes}m {seconds}s")
+    print(f"Tempo total de execução: {minutes}m {seconds}s")
+
+    # Execução com etapas que falharam termina com erro (run_auto e o serviço usam o código de saída)
+    if failed:
+        print(f"\nErro: Etapas não concluídas: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,130 @@
+import time
+import threading
+import numpy as np
+import pandas as pd
+from .tracing import rss_bytes
+
+# -----------------------------------------------------------------------------
+# ORÇAMENTO DE MEMÓRIA (--memoria_gb)
+# Com orçamento, as tabelas produzidas pelas etapas são compactadas no lugar sem
+# mudar valores (inteiros em int32 e, abaixo de 1e6, em float32, textos repetidos
+# apontando para um único objeto por valor), as intermediárias são liberadas
+# quando a última etapa que as usa termina e o RSS do processo é acompanhado em
+# segundo plano: perto do limite, um aviso é impresso e novas etapas esperam as
+# que estão em execução.
+# -----------------------------------------------------------------------------
+
+WARN_FRACTION = 0.85
+SAMPLE_INTERVAL = 0.1
+GB = 1024 ** 3
+
+_BUDGET = {'limit': None, 'peak': 0, 'warned': False, 'thread': None, 'stop': None}
+
+def _compact_column(series):
+    """Coluna compactada (int32 / float32 / textos compartilhados) ou None se não houver ganho."""
+    if series.dtype == np.int64:
+        if len(series) and series.min() >= np.iinfo(np.int32).min and series.max() <= np.iinfo(np.int32).max:
+            return series.astype(np.int32)
+        return None
+    if series.dtype == np.float64:
+        # Só inteiros abaixo de 1e6 (anos, durações, contagens com nulos): exatos em float32 e com o
+        # mesmo texto em astype(str)/CSV (float32 maiores viram notação científica, ex: códigos IBGE)
+        values = series.to_numpy()
+        valid = ~np.isnan(values)
+        if not valid.any() or not ((np.abs(values[valid]) < 1e6) & (values[valid] == np.round(values[valid]))).all():
+            return None
+        return pd.Series(values.astype(np.float32), index=series.index, name=series.name)
+    if series.dtype != object:
+        return None
+    codes, uniques = pd.factorize(series)
+    # Só textos de baixa cardinalidade (categorias, rótulos Em PrEP...); nulos ficam como estão (None ou NaN)
+    if len(uniques) > len(series) // 2 or not all(isinstance(v, str) for v in uniques):
+        return None
+    values = series.to_numpy(dtype=object, copy=True)
+    valid = codes >= 0
+    values[valid] = np.asarray(uniques, dtype=object)[codes[valid]]
+    return pd.Series(values, index=series.index, name=series.name)
+
+def compact_frame(df):
+    """
+    Compacta o DataFrame no lugar, uma coluna por vez (o pico é uma coluna, não uma cópia da tabela),
+    sem mudar valores: int64 que cabem em int32 viram int32, float64 inteiros abaixo de 1e6 viram
+    float32 e textos repetidos passam a apontar para um único objeto por valor. Datas não mudam (não há tipo
+    de data menor que datetime64[ns] no pandas). Retorna o próprio df.
+    """
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return df
+    for i in range(df.shape[1]):
+        column = _compact_column(df.iloc[:, i])
+        if column is not None:
+            df.isetitem(i, column)
+    return df
+
+def _frames(values):
+    for value in values:
+        if isinstance(value, pd.DataFrame):
+            yield value
+        elif isinstance(value, dict):
+            yield from (v for v in value.values() if isinstance(v, pd.DataFrame))
+
+def compact_outputs(outputs, inputs=()):
+    """
+    compact_frame nas saídas de uma etapa (DataFrames e dicionários de DataFrames, ex: bases), no lugar.
+    Tabelas que também são entradas (`inputs`, inclusive dentro de dicionários) ficam como estão:
+    outras etapas podem estar lendo, e a etapa que as produziu já as compactou.
+    """
+    received = {id(df) for df in _frames(inputs)}
+    for df in _frames(outputs.values()):
+        if id(df) not in received:
+            compact_frame(df)
+    return outputs
+
+def _monitor():
+    while not _BUDGET['stop'].is_set():
+        rss = rss_bytes()
+        if rss is not None:
+            _BUDGET['peak'] = max(_BUDGET['peak'], rss)
+            if rss >= WARN_FRACTION * _BUDGET['limit'] and not _BUDGET['warned']:
+                _BUDGET['warned'] = True
+                print(f"Aviso: Memória do processo em {rss / GB:.1f} GB ({rss / _BUDGET['limit']:.0%} do orçamento de "
+                      f"{_BUDGET['limit'] / GB:g} GB); novas etapas aguardam as que estão em execução.")
+            elif rss < 0.75 * _BUDGET['limit']:
+                _BUDGET['warned'] = False
+        time.sleep(SAMPLE_INTERVAL)
+
+def start_budget(limit_gb):
+    """Começa a acompanhar o RSS do processo contra o orçamento (em GB). Retorna o limite em bytes."""
+    if rss_bytes() is None:
+        print("Aviso: Memória do processo indisponível (instale psutil); orçamento não será acompanhado.")
+    _BUDGET.update(limit=limit_gb * GB, peak=rss_bytes() or 0, warned=False, stop=threading.Event())
+    _BUDGET['thread'] = threading.Thread(target=_monitor, name="orcamento_memoria", daemon=True)
+    _BUDGET['thread'].start()
+    return _BUDGET['limit']
+
+def near_budget():
+    """True se o RSS atual está acima da fração de aviso do orçamento (sem orçamento: False)."""
+    rss = rss_bytes()
+    return _BUDGET['limit'] is not None and rss is not None and rss >= WARN_FRACTION * _BUDGET['limit']
+
+def _peak_stage(sp):
+    stages = [c for c in sp.get('filhos', []) if 'rss_inicio_mb' in c]
+    return max(stages, key=lambda c: c['rss_inicio_mb'] + c['pico_delta_mb'], default=None)
+
+def stop_budget(root=None):
+    """
+    Encerra o acompanhamento e imprime o pico contra o orçamento. `root`: span da execução (ver tracing),
+    para apontar a etapa com maior pico. Retorna o pico em bytes.
+    """
+    if _BUDGET['thread'] is None:
+        return None
+    _BUDGET['stop'].set()
+    _BUDGET['thread'].join()
+    peak, limit = max(_BUDGET['peak'], rss_bytes() or 0), _BUDGET['limit']
+    print(f"\n--- Memória: pico de {peak / GB:.2f} GB ({peak / limit:.0%} do orçamento de {limit / GB:g} GB) ---")
+    stage = _peak_stage(root) if root is not None else None
+    if stage is not None:
+        print(f"Etapa com maior pico: {stage['nome']} ({(stage['rss_inicio_mb'] + stage['pico_delta_mb']) / 1024:.2f} GB)")
+    if peak > limit:
+        print("Aviso: Pico acima do orçamento de memória.")
+    _BUDGET.update(limit=None, thread=None)
+    return peak
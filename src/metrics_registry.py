@@ -0,0 +1,85 @@
+import time
+
+
+class MetricRegistry:
+    """
+    Registro de métricas com dependências declaradas.
+    Cada métrica informa de quais entradas depende (fontes ou outras métricas);
+    o cálculo só acontece quando alguma saída solicitada precisa dela.
+    Uma métrica pode ter versões por fonte disponível (ex: do cubo ou do df_prep), cada uma
+    com as próprias entradas: só as entradas da versão usada são calculadas.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, name, func, inputs=(), output=True, requires=None):
+        """
+        Registra a métrica `name`. output=False marca valores intermediários (compartilhados).
+        `requires`: fonte que precisa estar presente (não None) para usar esta versão; versões com
+        `requires` têm prioridade sobre a registrada sem (usada quando a fonte falta).
+        """
+        variants = [v for v in self._metrics.get(name, []) if v[3] != requires]
+        variants.append((func, tuple(inputs), output, requires))
+        self._metrics[name] = sorted(variants, key=lambda v: v[3] is None)
+
+    def metric(self, name, inputs=(), output=True, requires=None):
+        """Decorator equivalente a register()."""
+        def decorator(func):
+            self.register(name, func, inputs, output, requires)
+            return func
+        return decorator
+
+    def outputs(self):
+        """Nomes das métricas finais (na ordem de registro)."""
+        return [name for name, variants in self._metrics.items() if variants[0][2]]
+
+    def context(self, **sources):
+        """Cria um contexto de avaliação para as fontes informadas (DataFrames, datas, cubo...)."""
+        return MetricContext(self, sources)
+
+
+class MetricContext:
+    """
+    Avaliação preguiçosa e memoizada de um MetricRegistry.
+    Guarda o custo (segundos) de cada métrica calculada, sem contar as dependências.
+    """
+
+    def __init__(self, registry, sources):
+        self.registry = registry
+        self.sources = dict(sources)
+        self.costs = {}
+        self._cache = {}
+
+    def get(self, name):
+        if name in self.sources:
+            return self.sources[name]
+        if name in self._cache:
+            return self._cache[name]
+        if name not in self.registry._metrics:
+            raise KeyError(f"Métrica não registrada: {name}")
+
+        for func, inputs, _, requires in self.registry._metrics[name]:
+            if requires is None or self.get(requires) is not None:
+                break
+        else:
+            raise KeyError(f"Métrica sem versão para as fontes informadas: {name}")
+        args = [self.get(dep) for dep in inputs]
+
+        start = time.perf_counter()
+        value = func(*args)
+        self.costs[name] = time.perf_counter() - start
+
+        self._cache[name] = value
+        return value
+
+    def evaluate(self, names):
+        """Calcula apenas as métricas pedidas (e o que elas exigem)."""
+        return {name: self.get(name) for name in names}
+
+    def report_costs(self, top=10):
+        """Imprime as métricas mais caras desta avaliação."""
+        total = sum(self.costs.values())
+        print(f"Métricas calculadas: {len(self.costs)} ({total:.4f} sec)")
+        for name, cost in sorted(self.costs.items(), key=lambda item: item[1], reverse=True)[:top]:
+            print(f"  {name}: {cost:.4f} sec")
@@ -1,4 +1,5 @@
 import time
+import tracemalloc
 import pandas as pd
 import numpy as np
 
@@ -63,3 +64,54 @@ def compare_dataframes(df_old, df_new, name="Check"):
     except AssertionError as e:
         print(f"ERRO: Conteúdo diverge: {e}")
         return False
+
+def measure_peak(func, *args, **kwargs):
+    """
+    Executa func(*args, **kwargs) medindo tempo de parede e pico de memória (tracemalloc).
+    Retorna (resultado, segundos, pico_mb).
+    """
+    tracemalloc.start()
+    start = time.time()
+    try:
+        result = func(*args, **kwargs)
+        elapsed = time.time() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 1024 ** 2
+
+def generate_synthetic_disp(n_pacientes, data_fechamento, seed=0):
+    """
+    Gera base sintética de dispensas no formato de df_disp_semdupl (uma linha por paciente/data)
+    para testes de equivalência e desempenho, sem depender das bases da rede.
+    """
+    rng = np.random.default_rng(seed)
+    hoje_dt = pd.to_datetime(data_fechamento).normalize()
+    inicio = pd.Timestamp(2018, 1, 1)
+    n_dias = (hoje_dt - inicio).days
+
+    # 1 a 12 dispensas por paciente, a partir de uma data inicial aleatória
+    n_disp = rng.integers(1, 13, n_pacientes)
+    ids = np.repeat(np.arange(1, n_pacientes + 1), n_disp)
+    duracao = rng.choice([30, 60, 90, 120], len(ids))
+
+    # Intervalo até a próxima dispensa: duração +/- atraso (atrasos longos geram descontinuados)
+    gaps = duracao + rng.integers(-10, 200, len(ids))
+    cum_prev = np.cumsum(gaps) - gaps
+    group_start = np.repeat(np.cumsum(n_disp) - n_disp, n_disp)
+    dias = np.repeat(rng.integers(0, n_dias, n_pacientes), n_disp) + cum_prev - cum_prev[group_start]
+
+    keep = dias <= n_dias
+    udm_por_paciente = rng.integers(1, max(2, n_pacientes // 200) + 1, n_pacientes)
+
+    df = pd.DataFrame({
+        'codigo_pac_eleito': ids[keep],
+        'dt_disp': inicio + pd.to_timedelta(dias[keep], unit='D'),
+        'duracao': duracao[keep],
+        'duracao_sum': duracao[keep],
+        'codigo_udm': udm_por_paciente[ids[keep] - 1]
+    })
+    df['ano_disp'] = df['dt_disp'].dt.year
+
+    # Mesma ordenação de clean_disp_df
+    return df.sort_values(['codigo_pac_eleito', 'dt_disp'], ascending=[True, False]).reset_index(drop=True)
@@ -0,0 +1,232 @@
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .tracing import span, current_span, record_frames
+from .memory import compact_outputs, near_budget
+from .checkpoints import value_fingerprint, stage_key, output_key, checkpoint_path, has_checkpoint, save_checkpoint, load_checkpoint
+
+# -----------------------------------------------------------------------------
+# ORQUESTRAÇÃO DAS ETAPAS (DAG)
+# Cada etapa declara as entradas que consome e as saídas que produz (nomes no
+# contexto). Só as etapas necessárias para os alvos pedidos são executadas, e
+# etapas independentes (ex: Excel, gráficos, métricas do PPT, exportação do df
+# PrEP) rodam ao mesmo tempo em threads.
+# -----------------------------------------------------------------------------
+
+def stage(name, func, inputs=(), outputs=(), checkpoint=False, external=False):
+    """
+    Etapa do pipeline: func recebe as entradas como argumentos nomeados e retorna as saídas
+    (um valor se houver uma saída, tupla na ordem de `outputs` se houver várias).
+    `checkpoint`: grava as saídas (ver checkpoints) para retomar com --resume. Só em etapas cujas saídas
+    não repetem a saída de outra etapa com checkpoint (cada tabela é gravada uma vez).
+    `external`: saídas vêm de fora do pipeline (ex: bases) e são identificadas pelo conteúdo.
+    """
+    return {'name': name, 'func': func, 'inputs': tuple(inputs), 'outputs': tuple(outputs),
+            'checkpoint': checkpoint, 'external': external}
+
+def _producers(stages):
+    producers = {}
+    for s in stages:
+        for out in s['outputs']:
+            if out in producers:
+                raise ValueError(f"Saída '{out}' produzida por mais de uma etapa ({producers[out]['name']}, {s['name']})")
+            producers[out] = s
+    return producers
+
+def select_stages(stages, targets, available=()):
+    """
+    Etapas necessárias para construir os alvos (nomes de etapas ou de saídas), na ordem declarada.
+    `available`: nomes já presentes no contexto (não precisam de etapa).
+    """
+    by_name = {s['name']: s for s in stages}
+    producers = _producers(stages)
+    needed = set()
+    pending = list(targets)
+    while pending:
+        target = pending.pop()
+        if target in available:
+            continue
+        s = by_name.get(target) or producers.get(target)
+        if s is None:
+            raise KeyError(f"Alvo desconhecido: {target}")
+        if s['name'] in needed:
+            continue
+        needed.add(s['name'])
+        pending.extend(s['inputs'])
+    return [s for s in stages if s['name'] in needed]
+
+def _run_stage(s, kwargs, checkpoint=None, parent=None, compact=False):
+    t0 = time.perf_counter()
+    with span(s['name'], parent=parent) as sp:
+        record_frames(sp, 'entradas', kwargs)
+        result = s['func'](**kwargs)
+        if len(s['outputs']) == 0:
+            result = ()
+        elif len(s['outputs']) == 1:
+            result = (result,)
+        outputs = dict(zip(s['outputs'], result))
+        if compact and outputs:
+            with span('compactar'):
+                outputs = compact_outputs(outputs, kwargs.values())
+        record_frames(sp, 'saidas', outputs)
+        secs = time.perf_counter() - t0
+        if checkpoint is not None:
+            try:
+                with span('gravar_checkpoint'):
+                    save_checkpoint(checkpoint, outputs)
+            except Exception as e:
+                print(f"Aviso: Não foi possível gravar o checkpoint da etapa '{s['name']}': {e}")
+    return outputs, secs
+
+def run_pipeline(stages, targets, context=None, max_workers=4, checkpoint_scope=None, resume=False, memory_budget=None):
+    """
+    Executa as etapas necessárias para os alvos, cada uma assim que suas entradas estiverem prontas.
+    Falha numa etapa: o traceback vai para o stderr e as que dependem dela não são executadas (as demais continuam).
+    `checkpoint_scope` (ex: data de fechamento): etapas com checkpoint gravam as saídas; com `resume`,
+    etapas com o mesmo código e as mesmas entradas são retomadas do disco (carregadas só se alguma
+    etapa executada precisar delas) e etapas que só alimentavam as retomadas deixam de ser executadas.
+    Sem `checkpoint_scope`, nenhuma chave é calculada e nada é gravado.
+    `memory_budget` (bytes, ver memory): compacta as saídas, libera do contexto as entradas cujas etapas
+    consumidoras terminaram e, perto do orçamento, só inicia uma etapa quando nenhuma estiver em execução.
+    Retorna (contexto com todas as saídas produzidas, nomes das etapas que falharam ou foram puladas).
+    """
+    context = dict(context or {})
+    selected = select_stages(stages, targets, available=context)
+    print(f"\n--- Pipeline: {len(selected)} etapas ({', '.join(s['name'] for s in selected)}) ---")
+
+    # Spans das etapas (threads do pool) ficam sob o span atual (ver tracing)
+    parent = current_span()
+    use_keys = checkpoint_scope is not None
+    # Chaves das entradas/saídas (ver checkpoints) e saídas retomadas ainda não carregadas
+    keys = {name: value_fingerprint(value) for name, value in context.items()} if use_keys else {}
+    stage_keys = {}
+    restored = {}
+    no_resume = set()
+    # Etapas dispensadas porque só alimentavam etapas retomadas (voltam se um checkpoint estiver ilegível)
+    pruned = []
+    order = {s['name']: n for n, s in enumerate(selected)}
+
+    producers = _producers(selected)
+    # Etapas que consomem cada nome (para liberar intermediárias com orçamento de memória)
+    consumers = {}
+    for s in selected:
+        for i in s['inputs']:
+            consumers.setdefault(i, set()).add(s['name'])
+    finished = set()
+
+    def release(s):
+        finished.add(s['name'])
+        if memory_budget is None:
+            return
+        skipped_names = {p['name'] for p in pruned}
+        for i in s['inputs']:
+            if consumers[i] - skipped_names <= finished and context.pop(i, None) is not None:
+                print(f"[Memória] '{i}' liberado (etapas consumidoras concluídas)")
+
+    def prune():
+        # Em espera ficam só as etapas dos alvos e as que alimentam uma delas (entradas não retomadas)
+        candidates = waiting + pruned
+        by_name = {s['name']: s for s in candidates}
+        needed = {s['name'] for s in candidates if s['name'] in targets or set(s['outputs']) & set(targets)}
+        pending = list(needed)
+        while pending:
+            for i in by_name[pending.pop()]['inputs']:
+                producer = producers.get(i)
+                if i in context or i in restored or producer is None or producer['name'] not in by_name or producer['name'] in needed:
+                    continue
+                needed.add(producer['name'])
+                pending.append(producer['name'])
+        for s in candidates:
+            if s['name'] not in needed and s not in pruned:
+                print(f"[Etapa {s['name']}] não será executada (só alimentava etapas retomadas)")
+        waiting[:] = sorted((s for s in candidates if s['name'] in needed), key=lambda s: order[s['name']])
+        pruned[:] = [s for s in candidates if s['name'] not in needed]
+
+    waiting = list(selected)
+    failed = []
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="etapa") as pool:
+        while waiting or running:
+            # Etapas cujas entradas dependem de uma etapa que falhou não serão executadas
+            skipped = True
+            while skipped:
+                skipped = [s for s in waiting if any(i in producers and producers[i]['name'] in failed for i in s['inputs'])]
+                for s in skipped:
+                    print(f"Aviso: Etapa '{s['name']}' pulada (depende de etapa que falhou).")
+                    failed.append(s['name'])
+                    waiting.remove(s)
+                    release(s)
+
+            # Chave de cada etapa assim que as chaves das entradas são conhecidas; com resume, retoma do checkpoint
+            decided = use_keys
+            while decided:
+                decided = False
+                for s in [s for s in waiting if s['name'] not in stage_keys and all(i in keys for i in s['inputs'])]:
+                    key = stage_keys[s['name']] = stage_key(s['name'], s['func'], [keys[i] for i in s['inputs']])
+                    # Saídas de etapas internas têm a chave da etapa (conhecida antes de executá-la)
+                    if not s['external']:
+                        for out in s['outputs']:
+                            keys[out] = output_key(key, out)
+                        decided = True
+                    path = checkpoint_path(checkpoint_scope, s['name'], key)
+                    if resume and s['checkpoint'] and s['name'] not in no_resume and has_checkpoint(path):
+                        for out in s['outputs']:
+                            restored[out] = (s, path)
+                        waiting.remove(s)
+                        print(f"[Etapa {s['name']}] retomada do checkpoint (entradas e código sem alteração)")
+            if resume:
+                prune()
+
+            requeued = False
+            for s in [s for s in waiting if (not use_keys or s['name'] in stage_keys)
+                      and all(i in context or i in restored for i in s['inputs'])]:
+                # Saídas retomadas são carregadas quando uma etapa executada precisa delas
+                for i in s['inputs']:
+                    if i in context or i not in restored:
+                        continue
+                    producer, path = restored[i]
+                    try:
+                        print(f"Carregando checkpoint da etapa '{producer['name']}'...")
+                        with span(f"carregar_checkpoint_{producer['name']}"):
+                            context.update(load_checkpoint(path))
+                    except Exception as e:
+                        print(f"Aviso: Checkpoint da etapa '{producer['name']}' ilegível ({e}). Recalculando.")
+                        no_resume.add(producer['name'])
+                        for out in producer['outputs']:
+                            restored.pop(out, None)
+                        waiting.append(producer)
+                        requeued = True
+                if not all(i in context for i in s['inputs']):
+                    continue
+                if memory_budget is not None and running and near_budget():
+                    continue
+                waiting.remove(s)
+                checkpoint = None
+                if use_keys and s['checkpoint']:
+                    checkpoint = checkpoint_path(checkpoint_scope, s['name'], stage_keys[s['name']])
+                running[pool.submit(_run_stage, s, {i: context[i] for i in s['inputs']}, checkpoint, parent,
+                                     memory_budget is not None)] = s
+
+            if not running:
+                if requeued:
+                    continue
+                if waiting:
+                    raise RuntimeError(f"Entradas sem etapa produtora: {[s['name'] for s in waiting]}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                s = running.pop(future)
+                try:
+                    outputs, secs = future.result()
+                    context.update(outputs)
+                    if use_keys and s['external']:
+                        for out, value in outputs.items():
+                            keys[out] = value_fingerprint(value)
+                    print(f"[Etapa {s['name']}] concluída em {secs:.1f}s")
+                except Exception as e:
+                    print(f"Erro na etapa '{s['name']}': {e}")
+                    traceback.print_exception(type(e), e, e.__traceback__)
+                    failed.append(s['name'])
+                release(s)
+    return context, failed
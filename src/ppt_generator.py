@@ -5,12 +5,31 @@ from pptx.enum.shapes import MSO_SHAPE
 import os
 import shutil
 import pandas as pd
-
-def generate_ppt(output_dir, metrics, data_fechamento):
+from .config import DRAFT_CHART_DIR
+from .artifacts import open_image
+from .tracing import traced
+
+# Métricas usadas nos textos dos slides (calculate_ppt_metrics só calcula estas)
+PPT_METRIC_KEYS = [
+    'hoje2', 'latest_month_year_count', 'mediana_uso',
+    'emPrEP_porcent', 'formatted_em_prep_count', 'descontinuados_porcent', 'formatted_discontinued_count',
+    'highest_percentage_pop', 'formatted_highest_count_pop', 'highest_category_pop', 'highest_percentage_fetar', 'formatted_highest_count_fetar', 'highest_category_fetar',
+    'formatted_young_percentage', 'formatted_young_counts', 'median_age',
+    'highest_percentage_escol', 'formatted_highest_count_escol', 'highest_category_escol', 'highest_percentage_raca', 'formatted_highest_count_raca', 'highest_category_raca',
+    'formatted_raca_negra_percentage', 'formatted_raca_negra_counts',
+    'denominator_IST', 'highest_percentage_IST', 'formatted_highest_count_IST', 'highest_category_IST',
+    'prep_diaria_percent', 'prep_diaria_count_formatted', 'prep_demand_percent', 'prep_demand_count_formatted'
+]
+
+@traced()
+def generate_ppt(output_dir, metrics, data_fechamento, draft=False):
     """
     Gera a apresentação PowerPoint com os slides e gráficos.
+    Imagens publicadas em memória (artifacts) são usadas sem ler o output_dir.
+    `draft`: salva como '..._rascunho.pptx' (mesmos slides, com os gráficos do modo rascunho, da subpasta DRAFT_CHART_DIR).
     """
     print("Gerando apresentação PowerPoint...")
+    image_dir = os.path.join(output_dir, DRAFT_CHART_DIR) if draft else output_dir
     
     ppt = Presentation()
     ppt.slide_width = Inches(13.333)
@@ -103,9 +122,9 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     slide = ppt.slides.add_slide(ppt.slide_layouts[6])
     
     # Imagem (Fundo) - Ajustado Left=3.0 (Direita) para evitar sobreposição com texto
-    chart_img_path = os.path.join(output_dir, 'PrEP_novosusuarios.png')
-    if os.path.exists(chart_img_path):
-        slide.shapes.add_picture(chart_img_path, Inches(0.3), Inches(0.2), width=Inches(8),height=Inches(4))
+    chart_img = open_image(os.path.join(image_dir, 'PrEP_novosusuarios.png'))
+    if chart_img is not None:
+        slide.shapes.add_picture(chart_img, Inches(0.3), Inches(0.2), width=Inches(8),height=Inches(4))
     
     # Texto (Frente)
     title_box = slide.shapes.add_textbox(Inches(0.3), Inches(0.2), width=Inches(8), height=Inches(4))
@@ -130,9 +149,9 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     slide = ppt.slides.add_slide(ppt.slide_layouts[6])
     
     # Imagem (Fundo) - Ajustado Left=3.0 (Direita)
-    chart_img_path = os.path.join(output_dir, 'PrEP_emprep.png')
-    if os.path.exists(chart_img_path):
-        slide.shapes.add_picture(chart_img_path, Inches(3.0), Inches(1.5), height=Inches(6.0))
+    chart_img = open_image(os.path.join(image_dir, 'PrEP_emprep.png'))
+    if chart_img is not None:
+        slide.shapes.add_picture(chart_img, Inches(3.0), Inches(1.5), height=Inches(6.0))
     
     # Texto
     title_box = slide.shapes.add_textbox(Inches(0.3), Inches(0.2), width=Inches(8), height=Inches(4))
@@ -157,9 +176,9 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     slide = ppt.slides.add_slide(ppt.slide_layouts[6])
     
     # Imagem
-    chart_img_path = os.path.join(output_dir, 'PrEP_cascata.png')
-    if os.path.exists(chart_img_path):
-        slide.shapes.add_picture(chart_img_path, Inches(0.3), Inches(1), height=Inches(6.0))
+    chart_img = open_image(os.path.join(image_dir, 'PrEP_cascata.png'))
+    if chart_img is not None:
+        slide.shapes.add_picture(chart_img, Inches(0.3), Inches(1), height=Inches(6.0))
     
     # Texto
     title_box = slide.shapes.add_textbox(Inches(8), Inches(0.2), width=Inches(5), height=Inches(1))
@@ -184,9 +203,9 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     slide = ppt.slides.add_slide(ppt.slide_layouts[6])
     
     # Imagem
-    chart_img_path = os.path.join(output_dir, 'PrEP_pop.png')
-    if os.path.exists(chart_img_path):
-        slide.shapes.add_picture(chart_img_path, Inches(0.3), Inches(1), height=Inches(6.0))
+    chart_img = open_image(os.path.join(image_dir, 'PrEP_pop.png'))
+    if chart_img is not None:
+        slide.shapes.add_picture(chart_img, Inches(0.3), Inches(1), height=Inches(6.0))
     
     # Texto
     title_box = slide.shapes.add_textbox(Inches(8), Inches(0.2), width=Inches(5), height=Inches(1))
@@ -220,9 +239,9 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     slide = ppt.slides.add_slide(ppt.slide_layouts[6])
     
     # Imagem (Ajuste de altura reduzida)
-    chart_img_path = os.path.join(output_dir, 'PrEP_fetar.png')
-    if os.path.exists(chart_img_path):
-        slide.shapes.add_picture(chart_img_path, Inches(0.3), Inches(0.8), height=Inches(5.5))
+    chart_img = open_image(os.path.join(image_dir, 'PrEP_fetar.png'))
+    if chart_img is not None:
+        slide.shapes.add_picture(chart_img, Inches(0.3), Inches(0.8), height=Inches(5.5))
     
     title_box = slide.shapes.add_textbox(Inches(8), Inches(0.2), width=Inches(5), height=Inches(1))
     tf = title_box.text_frame
@@ -255,9 +274,9 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     slide = ppt.slides.add_slide(ppt.slide_layouts[6])
     
     # Imagem
-    chart_img_path = os.path.join(output_dir, 'PrEP_escol4.png')
-    if os.path.exists(chart_img_path):
-        slide.shapes.add_picture(chart_img_path, Inches(0.3), Inches(0.8), height=Inches(6.3))
+    chart_img = open_image(os.path.join(image_dir, 'PrEP_escol4.png'))
+    if chart_img is not None:
+        slide.shapes.add_picture(chart_img, Inches(0.3), Inches(0.8), height=Inches(6.3))
     
     # Título e Texto (Mover para Extrema Esquerda: Inches(0.3))
     title_box = slide.shapes.add_textbox(Inches(0.3), Inches(0.2), width=Inches(5), height=Inches(1))
@@ -291,9 +310,9 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     slide = ppt.slides.add_slide(ppt.slide_layouts[6])
     
     # Imagem
-    chart_img_path = os.path.join(output_dir, 'PrEP_raca.png')
-    if os.path.exists(chart_img_path):
-        slide.shapes.add_picture(chart_img_path, Inches(0.3), Inches(0.8), height=Inches(6.3))
+    chart_img = open_image(os.path.join(image_dir, 'PrEP_raca.png'))
+    if chart_img is not None:
+        slide.shapes.add_picture(chart_img, Inches(0.3), Inches(0.8), height=Inches(6.3))
     
     title_box = slide.shapes.add_textbox(Inches(8), Inches(0.2), width=Inches(5), height=Inches(1))
     tf = title_box.text_frame
@@ -326,9 +345,9 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     slide = ppt.slides.add_slide(ppt.slide_layouts[6])
     
     # Imagem
-    chart_img_path = os.path.join(output_dir, 'PrEP_IST.png')
-    if os.path.exists(chart_img_path):
-        slide.shapes.add_picture(chart_img_path, Inches(0.3), Inches(1.5), height=Inches(6.0))
+    chart_img = open_image(os.path.join(image_dir, 'PrEP_IST.png'))
+    if chart_img is not None:
+        slide.shapes.add_picture(chart_img, Inches(0.3), Inches(1.5), height=Inches(6.0))
     
     title_box = slide.shapes.add_textbox(Inches(0.3), Inches(0.2), width=Inches(8), height=Inches(4))
     tf = title_box.text_frame
@@ -362,9 +381,9 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     slide = ppt.slides.add_slide(ppt.slide_layouts[6])
     
     # Imagem
-    chart_img_path = os.path.join(output_dir, 'PrEP_modalidades.png')
-    if os.path.exists(chart_img_path):
-        slide.shapes.add_picture(chart_img_path, Inches(3.0), Inches(3), height=Inches(4))
+    chart_img = open_image(os.path.join(image_dir, 'PrEP_modalidades.png'))
+    if chart_img is not None:
+        slide.shapes.add_picture(chart_img, Inches(3.0), Inches(3), height=Inches(4))
     
     title_box = slide.shapes.add_textbox(Inches(0.3), Inches(0.2), width=Inches(8), height=Inches(4))
     tf = title_box.text_frame
@@ -429,7 +448,7 @@ def generate_ppt(output_dir, metrics, data_fechamento):
     mes = int(data_dt.month)
     ano = int(data_dt.year)
     
-    filename = "Monitoramento_PrEP_{:02d}_{}.pptx".format(mes, ano)
+    filename = "Monitoramento_PrEP_{:02d}_{}{}.pptx".format(mes, ano, "_rascunho" if draft else "")
     save_path = os.path.join(output_dir, filename)
     
     print(f"Salvando PPT em: {save_path}")
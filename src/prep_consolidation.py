@@ -1,52 +1,37 @@
 import pandas as pd
 import numpy as np
-from datetime import timedelta
+from .ages import age_bands
+from .tracing import traced
 
-def create_prep_dataframe(df_disp_semdupl, df_cad_prep, df_cad_hiv=pd.DataFrame(), df_pvha=pd.DataFrame(), df_pvha_prim=pd.DataFrame(), data_fechamento=None):
+@traced()
+def create_prep_dataframe(df_disp_semdupl, df_cad_prep, df_cad_hiv=pd.DataFrame(), df_pvha=pd.DataFrame(), df_pvha_prim=pd.DataFrame(), data_fechamento=None, return_yearly=False):
     """
     Cria o dataframe consolidado 'df PrEP' (uma linha por paciente),
     juntando dados do Cadastro com a última dispensa e métricas históricas.
+    As datas min/max por ano ficam numa tabela longa (return_yearly=True devolve (df_prep, df_disp_ano));
+    as colunas largas dt_disp_min_{ano}/dt_disp_max_{ano} só são montadas na exportação (widen_yearly_extremes).
     """
     print("Gerando DataFrame consolidado 'df PrEP'...")
     
     if df_cad_prep.empty:
-        return pd.DataFrame()
+        return (pd.DataFrame(), pd.DataFrame()) if return_yearly else pd.DataFrame()
 
-    # Garantir datetime no Disp
+    # Garantir datetime e ano no Disp (no pipeline já vêm da etapa de dispensas: a tabela, lida por
+    # outras etapas ao mesmo tempo, só é alterada se faltar algo)
     if not df_disp_semdupl.empty and 'dt_disp' in df_disp_semdupl.columns:
-        df_disp_semdupl['dt_disp'] = pd.to_datetime(df_disp_semdupl['dt_disp'])
-        df_disp_semdupl['ano_disp'] = df_disp_semdupl['dt_disp'].dt.year
+        if not pd.api.types.is_datetime64_any_dtype(df_disp_semdupl['dt_disp']):
+            df_disp_semdupl['dt_disp'] = pd.to_datetime(df_disp_semdupl['dt_disp'])
+        ano_disp = df_disp_semdupl['dt_disp'].dt.year
+        if 'ano_disp' not in df_disp_semdupl.columns or not df_disp_semdupl['ano_disp'].equals(ano_disp):
+            df_disp_semdupl['ano_disp'] = ano_disp
 
-    # 1. Calcular Métricas Históricas por Paciente
+    # 1-2. Métricas Históricas por Paciente e Última Dispensa (uma ordenação, reduções por fronteira)
     if not df_disp_semdupl.empty:
-        grp = df_disp_semdupl.groupby('codigo_pac_eleito')
-        agg_df = grp.agg(
-            dt_disp_min=('dt_disp', 'min'),
-            dt_disp_max=('dt_disp', 'max'),
-            duracao_sum_total=('duracao_sum', 'sum')
-        ).reset_index()
-        
-        # Datas Min/Max por Ano
-        grp_ano = df_disp_semdupl.groupby(['codigo_pac_eleito', 'ano_disp']).agg(
-            min_date=('dt_disp', 'min'),
-            max_date=('dt_disp', 'max')
-        ).reset_index()
-        
-        pivot_min = grp_ano.pivot(index='codigo_pac_eleito', columns='ano_disp', values='min_date')
-        pivot_max = grp_ano.pivot(index='codigo_pac_eleito', columns='ano_disp', values='max_date')
-        
-        pivot_min.columns = [f'dt_disp_min_{col}' for col in pivot_min.columns]
-        pivot_max.columns = [f'dt_disp_max_{col}' for col in pivot_max.columns]
-        
-        agg_df = agg_df.merge(pivot_min, on='codigo_pac_eleito', how='left')
-        agg_df = agg_df.merge(pivot_max, on='codigo_pac_eleito', how='left')
-        
-        # 2. Obter a Última Dispensa
-        df_last_disp = df_disp_semdupl.sort_values(by=['codigo_pac_eleito', 'dt_disp'], ascending=[True, False])
-        df_last_disp = df_last_disp.drop_duplicates(subset=['codigo_pac_eleito'], keep='first')
+        agg_df, df_last_disp, df_disp_ano = summarize_patient_dispensations(df_disp_semdupl)
     else:
         df_last_disp = pd.DataFrame()
         agg_df = pd.DataFrame()
+        df_disp_ano = pd.DataFrame(columns=['codigo_pac_eleito', 'ano_disp', 'dt_disp_min', 'dt_disp_max'])
     
     # 3. Merge Base: Cadastro + Última Dispensa
     df_prep = df_cad_prep.copy()
@@ -105,15 +90,86 @@ def create_prep_dataframe(df_disp_semdupl, df_cad_prep, df_cad_hiv=pd.DataFrame(
         df_prep['dt_disp'] = pd.to_datetime(df_prep['dt_disp'], errors='coerce')
         df_prep['data_nascimento'] = pd.to_datetime(df_prep['data_nascimento'], errors='coerce')
         
-        # Calcular idade na data da última dispensa
-        # Usando 365 dias conforme solicitação do usuário
-        df_prep['idade_real'] = (df_prep['dt_disp'] - df_prep['data_nascimento']) / timedelta(days=365)
-        df_prep['idade_real'] = df_prep['idade_real'].apply(np.floor).astype('Int64')
-        
-        # Faixas Etárias
-        cut_points = [-np.inf, 17, 24, 29, 39, 49, np.inf]
-        labels = ['<18', '18 a 24', '25 a 29', '30 a 39', '40 a 49', '50 e mais']
-        
-        df_prep['fetar'] = pd.cut(df_prep['idade_real'], bins=cut_points, labels=labels)
+        # Idade em anos completos na data da última dispensa e Faixas Etárias (src/ages.py)
+        idades = age_bands(df_prep['data_nascimento'], df_prep['dt_disp'], esquemas=['fetar'], coluna_idade='idade_real')
+        df_prep['idade_real'] = idades['idade_real']
+        df_prep['fetar'] = idades['fetar']
     
+    if return_yearly:
+        return df_prep, df_disp_ano
     return df_prep
+
+def summarize_patient_dispensations(df_disp_semdupl):
+    """
+    Reduções por paciente sobre uma única ordenação (paciente, data) das dispensas:
+    - agg_df: dt_disp_min, dt_disp_max, duracao_sum_total
+    - df_last_disp: linha da última dispensa de cada paciente
+    - df_disp_ano (longa): codigo_pac_eleito | ano_disp | dt_disp_min | dt_disp_max
+    Ordena apenas os arrays de chave (não copia a base inteira como sort_values + drop_duplicates).
+    """
+    ids = df_disp_semdupl['codigo_pac_eleito'].to_numpy()
+    dts = df_disp_semdupl['dt_disp'].to_numpy()
+    valid = pd.notna(ids) & pd.notna(dts)
+    rows = np.flatnonzero(valid)
+    order = rows[np.lexsort((dts[rows], ids[rows]))]
+    
+    ids_s = ids[order]
+    dts_s = dts[order]
+    years_s = dts_s.astype('datetime64[Y]').astype(np.int64) + 1970
+    n = len(order)
+    
+    # Fronteiras de paciente e de (paciente, ano)
+    new_pac = np.ones(n, dtype=bool)
+    new_pac[1:] = ids_s[1:] != ids_s[:-1]
+    new_year = new_pac.copy()
+    new_year[1:] |= years_s[1:] != years_s[:-1]
+    
+    starts = np.flatnonzero(new_pac)
+    ends = np.append(starts[1:], n) - 1
+    starts_y = np.flatnonzero(new_year)
+    ends_y = np.append(starts_y[1:], n) - 1
+    
+    duracao = df_disp_semdupl['duracao_sum'].to_numpy()[order]
+    if duracao.dtype.kind == 'f':
+        duracao = np.nan_to_num(duracao)
+    
+    agg_df = pd.DataFrame({
+        'codigo_pac_eleito': ids_s[starts],
+        'dt_disp_min': dts_s[starts],
+        'dt_disp_max': dts_s[ends],
+        'duracao_sum_total': np.add.reduceat(duracao, starts) if n else duracao[:0]
+    })
+    
+    # Última dispensa = última linha de cada paciente na ordenação
+    df_last_disp = df_disp_semdupl.iloc[order[ends]]
+    
+    df_disp_ano = pd.DataFrame({
+        'codigo_pac_eleito': ids_s[starts_y],
+        'ano_disp': years_s[starts_y],
+        'dt_disp_min': dts_s[starts_y],
+        'dt_disp_max': dts_s[ends_y]
+    })
+    
+    return agg_df, df_last_disp, df_disp_ano
+
+@traced()
+def widen_yearly_extremes(df_prep, df_disp_ano):
+    """
+    Colunas largas dt_disp_min_{ano}/dt_disp_max_{ano} (formato do CSV consolidado),
+    inseridas após duracao_sum_total. Usar apenas na exportação.
+    """
+    if df_disp_ano.empty:
+        return df_prep
+    
+    pivot_min = df_disp_ano.pivot(index='codigo_pac_eleito', columns='ano_disp', values='dt_disp_min')
+    pivot_max = df_disp_ano.pivot(index='codigo_pac_eleito', columns='ano_disp', values='dt_disp_max')
+    pivot_min.columns = [f'dt_disp_min_{col}' for col in pivot_min.columns]
+    pivot_max.columns = [f'dt_disp_max_{col}' for col in pivot_max.columns]
+    wide = pd.concat([pivot_min, pivot_max], axis=1)
+    
+    wide = wide.reindex(df_prep['codigo_pac_eleito'].to_numpy())
+    wide.index = df_prep.index
+    
+    cols = list(df_prep.columns)
+    pos = cols.index('duracao_sum_total') + 1 if 'duracao_sum_total' in cols else len(cols)
+    return pd.concat([df_prep[cols[:pos]], wide, df_prep[cols[pos:]]], axis=1)
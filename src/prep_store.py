@@ -0,0 +1,141 @@
+import os
+import threading
+import pandas as pd
+from .tracing import traced
+from . import resident
+
+# -----------------------------------------------------------------------------
+# ARMAZENAMENTO DO df PrEP CONSOLIDADO
+# Parquet tipado e comprimido (leitura preferencial dos scripts de análise) e
+# CSV com sep=';' opcional, gravado em segundo plano.
+# -----------------------------------------------------------------------------
+
+PREP_CSV = "df_prep_consolidado.csv"
+PREP_PARQUET = "df_prep_consolidado.parquet"
+# Tabela longa paciente x ano (datas min/max de dispensa), particionada por ano_disp
+DISP_ANO_DATASET = "df_prep_disp_ano"
+
+PARQUET_COMPRESSION = 'zstd'
+ROW_GROUP_SIZE = 100_000
+
+def get_prep_paths(output_dir):
+    return os.path.join(output_dir, PREP_PARQUET), os.path.join(output_dir, PREP_CSV)
+
+def _parquet_ready(df):
+    """Colunas object com tipos misturados (ex: números e textos) viram texto; nulos são mantidos."""
+    import pyarrow as pa
+    df = df.copy(deep=False)
+    for col in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+@traced()
+def save_prep_parquet(df_prep, output_dir):
+    """
+    Salva o df PrEP em Parquet (zstd, row groups com estatísticas min/max por coluna).
+    Retorna True se o arquivo foi gravado.
+    """
+    path, _ = get_prep_paths(output_dir)
+    try:
+        _parquet_ready(df_prep).to_parquet(path, index=False, compression=PARQUET_COMPRESSION,
+                                           row_group_size=ROW_GROUP_SIZE, write_statistics=True)
+        print(f"Base consolidada (Parquet) salva em: {path}")
+        return True
+    except Exception as e:
+        print(f"Aviso: Não foi possível salvar o df PrEP em Parquet: {e}")
+        return False
+
+@traced()
+def save_disp_ano_dataset(df_disp_ano, output_dir):
+    """Salva a tabela longa paciente x ano como dataset Parquet particionado por ano_disp."""
+    path = os.path.join(output_dir, DISP_ANO_DATASET)
+    try:
+        df_disp_ano.to_parquet(path, index=False, partition_cols=['ano_disp'], compression=PARQUET_COMPRESSION,
+                               existing_data_behavior='delete_matching')
+        print(f"Datas por ano (Parquet particionado) salvas em: {path}")
+    except Exception as e:
+        print(f"Aviso: Não foi possível salvar as datas por ano em Parquet: {e}")
+    return path
+
+def export_csv_background(df_prep, output_dir):
+    """Grava o CSV (sep=';') numa thread em segundo plano. Retorna a thread (ver wait_csv_export)."""
+    _, path = get_prep_paths(output_dir)
+
+    def _write():
+        try:
+            df_prep.to_csv(path, sep=';', index=False)
+            print(f"\nBase consolidada (CSV) salva em: {path}")
+        except Exception as e:
+            print(f"Aviso: Não foi possível salvar o df PrEP em CSV: {e}")
+
+    print(f"Salvando base consolidada (CSV, em segundo plano) em: {path}")
+    thread = threading.Thread(target=_write, name="export_csv_prep")
+    thread.start()
+    return thread
+
+def wait_csv_export(thread):
+    if thread is not None and thread.is_alive():
+        print("Aguardando a exportação do CSV do df PrEP...")
+    if thread is not None:
+        thread.join()
+
+def prep_exists(file_path=PREP_CSV):
+    """True se existir o CSV ou o Parquet correspondente."""
+    return os.path.exists(file_path) or os.path.exists(os.path.splitext(file_path)[0] + '.parquet')
+
+def _read_prep_resident(parquet_path, columns, nrows):
+    """No serviço local (src/service.py): tabela inteira em memória; colunas e linhas saem dela."""
+    stamp = resident.file_stamp(parquet_path)
+    select = lambda df: (df if columns is None else df[[c for c in df.columns if c in columns]]).iloc[:nrows]
+    df = resident.recall('prep', stamp[0], stamp, select)
+    if df is not None:
+        print(f"Lendo Parquet (em memória no serviço): {parquet_path}")
+        return df
+    print(f"Lendo Parquet: {parquet_path}")
+    resident.remember('prep', stamp[0], pd.read_parquet(parquet_path), stamp, copy_value=False)
+    return resident.recall('prep', stamp[0], stamp, select)
+
+def prep_parquet_info(file_path=PREP_CSV):
+    """(esquema do pyarrow, linhas) do Parquet do df PrEP, lidos do rodapé sem ler os dados. None sem Parquet."""
+    parquet_path = os.path.splitext(file_path)[0] + '.parquet'
+    try:
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(parquet_path)
+        return pf.schema_arrow, pf.metadata.num_rows
+    except Exception:
+        return None
+
+def read_prep(file_path=PREP_CSV, columns=None, nrows=None, filters=None, **csv_kwargs):
+    """
+    Lê o df PrEP consolidado, preferindo o Parquet ao lado do CSV (mesmo nome, extensão .parquet).
+    `columns`: apenas as colunas existentes são lidas (como usecols=lambda c: c in columns).
+    `filters`: expressão do pyarrow aplicada na leitura do Parquet (row groups descartados pelas
+    estatísticas). Não vale para o CSV nem no serviço local: quem passa deve filtrar de novo.
+    Sem Parquet (ou sem pyarrow), lê o CSV com sep=';' e os argumentos extras (encoding, low_memory...).
+    """
+    parquet_path = os.path.splitext(file_path)[0] + '.parquet'
+    if os.path.exists(parquet_path):
+        try:
+            if resident.enabled():
+                return _read_prep_resident(parquet_path, columns, nrows)
+            import pyarrow.parquet as pq
+            pf = pq.ParquetFile(parquet_path)
+            cols = None if columns is None else [c for c in pf.schema_arrow.names if c in columns]
+            print(f"Lendo Parquet: {parquet_path}")
+            if nrows is not None:
+                batch = next(pf.iter_batches(batch_size=nrows, columns=cols), None)
+                return batch.to_pandas() if batch is not None else pf.schema_arrow.empty_table().to_pandas()
+            if filters is not None:
+                try:
+                    return pq.read_table(parquet_path, columns=cols, filters=filters).to_pandas()
+                except Exception as e:
+                    print(f"Aviso: Filtro não aplicado na leitura do Parquet ({e}).")
+            return pq.read_table(parquet_path, columns=cols).to_pandas()
+        except Exception as e:
+            print(f"Aviso: Não foi possível ler o Parquet ({e}). Usando o CSV.")
+
+    usecols = None if columns is None else (lambda c: c in columns)
+    return pd.read_csv(file_path, sep=';', usecols=usecols, nrows=nrows, **csv_kwargs)
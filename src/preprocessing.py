@@ -1,7 +1,9 @@
 import pandas as pd
 import numpy as np
 from .config import UF_MAP, REGIAO_MAP
+from .tracing import traced
 
+@traced()
 def calculate_population_groups(df):
     """
     Calcula grupos populacionais (HSH, Travesti, etc.) e categorias sociodemográficas (Raça, Escolaridade).
@@ -230,6 +232,7 @@ def create_modalities_variable(df):
     
     return df
 
+@traced()
 def enrich_disp_data(df_disp_semdupl, df_cad_prep, df_cad_hiv, df_pvha, df_pvha_prim, df_ibge=None):
     """
     Enriquece o dataframe de dispensa com dados de cadastro, UF, Região, Óbito e IBGE.
@@ -341,6 +344,7 @@ def enrich_disp_data(df_disp_semdupl, df_cad_prep, df_cad_hiv, df_pvha, df_pvha_
     return df_disp_semdupl
 
 
+@traced()
 def calculate_intervals(df_disp_semdupl):
     if 'dt_resultado_testagem_hiv' in df_disp_semdupl.columns:
         df_disp_semdupl['dt_resultado_testagem_hiv'] = pd.to_datetime(df_disp_semdupl['dt_resultado_testagem_hiv'], errors='coerce')
@@ -348,6 +352,7 @@ def calculate_intervals(df_disp_semdupl):
         df_disp_semdupl['dias_teste_disp'] = (df_disp_semdupl['dt_disp'] - df_disp_semdupl['dt_resultado_hiv']).dt.days
     return df_disp_semdupl
 
+@traced()
 def flag_first_last_disp(df_disp_semdupl):
     print("Calculando primeira e última dispensa...")
     df_disp_semdupl['prim_disp'] = (df_disp_semdupl['dt_disp'] == df_disp_semdupl.groupby('codigo_pac_eleito')['dt_disp'].transform('min')).astype(int)
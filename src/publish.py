@@ -0,0 +1,187 @@
+import os
+import json
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .data_loader import CACHE_DIR
+
+# -----------------------------------------------------------------------------
+# PREPARAÇÃO LOCAL E PUBLICAÇÃO NO DIRETÓRIO DE SAÍDA
+# Os outputs são gravados numa pasta local (STAGING_DIR) e copiados em segundo
+# plano, vários ao mesmo tempo, para o output_dir (em geral o compartilhamento V:).
+# Cada cópia vai para um nome temporário, tem o tamanho conferido e só então é
+# renomeada: quem lê o compartilhamento nunca vê um arquivo pela metade.
+# Cada execução tem a sua pasta local (execuções simultâneas, ex: serviço local e
+# linha de comando, não se atrapalham). O que não pôde ser publicado fica na
+# pasta e é publicado de novo no início da execução seguinte.
+# -----------------------------------------------------------------------------
+
+STAGING_DIR = os.path.join(CACHE_DIR, "saida")
+PUBLISH_WORKERS = 4
+TMP_SUFFIX = ".publicando"
+# Pastas sem registro de pendências mais antigas que isto são de execuções interrompidas
+STALE_HOURS = 24
+
+# Estado da publicação em andamento (ver start_staging)
+_STATE = {'staging': None, 'target': None, 'pool': None, 'futures': {}, 'start': None}
+
+def start_staging(output_dir, staging_root=STAGING_DIR):
+    """
+    Cria a pasta local (vazia, só desta execução) que recebe os outputs e retorna o caminho dela.
+    Antes, publica as pendências de execuções anteriores (ver wait_publish).
+    Os arquivos são publicados em `output_dir` (ver publish, publish_remaining e wait_publish).
+    """
+    os.makedirs(staging_root, exist_ok=True)
+    retry_pending(staging_root)
+    staging_dir = tempfile.mkdtemp(prefix="execucao_", dir=staging_root)
+    _STATE.update(staging=os.path.abspath(staging_dir), target=output_dir, futures={}, start=None,
+                  pool=ThreadPoolExecutor(max_workers=PUBLISH_WORKERS, thread_name_prefix="publicacao"))
+    print(f"Outputs preparados localmente em: {staging_dir} (publicação em: {output_dir})")
+    return staging_dir
+
+def _pending_file(staging_dir):
+    return staging_dir.rstrip(os.sep) + ".json"
+
+def retry_pending(staging_root=STAGING_DIR):
+    """
+    Publica os itens que execuções anteriores não conseguiram publicar (registrados ao lado da pasta
+    local de cada uma) e remove as pastas que ficaram sem pendências. Pastas de outras execuções em
+    andamento são mantidas; as de execuções interrompidas, removidas depois de STALE_HOURS.
+    """
+    for name in sorted(os.listdir(staging_root)):
+        path = os.path.join(staging_root, name)
+        if not os.path.isdir(path):
+            continue
+        try:
+            with open(_pending_file(path), encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            if time.time() - os.path.getmtime(path) > STALE_HOURS * 3600:
+                print(f"Aviso: Removendo pasta local de execução interrompida: {path}")
+                shutil.rmtree(path, ignore_errors=True)
+            continue
+        remaining = []
+        for rel in info['pendentes']:
+            try:
+                _publish_one(os.path.join(path, rel), os.path.join(info['destino'], rel))
+            except Exception as e:
+                print(f"Aviso: Pendência {rel} da execução anterior ainda não publicada em {info['destino']}: {e}")
+                remaining.append(rel)
+        if remaining:
+            with open(_pending_file(path), 'w', encoding='utf-8') as f:
+                json.dump({'destino': info['destino'], 'pendentes': remaining}, f, ensure_ascii=False)
+            continue
+        print(f"Pendências da execução anterior publicadas em {info['destino']}: {', '.join(info['pendentes'])}")
+        shutil.rmtree(path, ignore_errors=True)
+        os.remove(_pending_file(path))
+
+def _copy_verified(src, dest):
+    """Copia src para dest via nome temporário, confere o tamanho e renomeia. Retorna os bytes copiados."""
+    directory = os.path.dirname(dest)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = dest + TMP_SUFFIX
+    size = os.path.getsize(src)
+    for tentativa in (1, 2):
+        try:
+            shutil.copyfile(src, tmp)
+            copied = os.path.getsize(tmp)
+            if copied != size:
+                raise IOError(f"tamanho divergente ({copied} de {size} bytes)")
+            os.replace(tmp, dest)
+            return size
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            if tentativa == 2:
+                raise
+
+def _prune_dataset_dirs(target_dirs, published):
+    """
+    Remove dos diretórios publicados os arquivos que não vieram desta execução
+    (como existing_data_behavior='delete_matching' nas partições do Parquet).
+    """
+    for directory in target_dirs:
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path) and os.path.normcase(path) not in published:
+                os.remove(path)
+
+def _publish_tree(src_dir, dest_dir):
+    """Publica um diretório (ex: dataset Parquet particionado). Retorna os bytes copiados."""
+    total = 0
+    published, leaf_dirs = set(), set()
+    for root, _, files in os.walk(src_dir):
+        dest_root = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+        for name in files:
+            dest = os.path.join(dest_root, name)
+            total += _copy_verified(os.path.join(root, name), dest)
+            published.add(os.path.normcase(dest))
+            leaf_dirs.add(dest_root)
+    _prune_dataset_dirs(leaf_dirs, published)
+    return total
+
+def _publish_one(path, dest):
+    return _publish_tree(path, dest) if os.path.isdir(path) else _copy_verified(path, dest)
+
+def publish(*paths):
+    """
+    Agenda a publicação (cópia em segundo plano) de arquivos ou diretórios já gravados na pasta local.
+    Caminhos fora da pasta local ou já agendados são ignorados. Sem start_staging, não faz nada.
+    """
+    staging, pool = _STATE['staging'], _STATE['pool']
+    if staging is None or pool is None:
+        return
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        rel = os.path.relpath(os.path.abspath(path), staging)
+        if rel.startswith(os.pardir) or rel in _STATE['futures']:
+            continue
+        if _STATE['start'] is None:
+            _STATE['start'] = time.perf_counter()
+        _STATE['futures'][rel] = pool.submit(_publish_one, path, os.path.join(_STATE['target'], rel))
+
+def publish_remaining():
+    """Agenda tudo o que está na pasta local e ainda não foi publicado."""
+    staging = _STATE['staging']
+    if staging is None or _STATE['pool'] is None:
+        return
+    for name in sorted(os.listdir(staging)):
+        publish(os.path.join(staging, name))
+
+def wait_publish():
+    """
+    Aguarda o fim da publicação e imprime o resumo (arquivos, tamanho, tempo e falhas).
+    Retorna a lista de caminhos (relativos) que não puderam ser publicados.
+    """
+    pool, futures = _STATE['pool'], _STATE['futures']
+    if pool is None:
+        return []
+    wait_start = time.perf_counter()
+    total, failed = 0, []
+    for rel, future in futures.items():
+        try:
+            total += future.result()
+        except Exception as e:
+            print(f"Aviso: Não foi possível publicar {rel} em {_STATE['target']}: {e}")
+            failed.append(rel)
+    pool.shutdown()
+    end = time.perf_counter()
+    elapsed = end - _STATE['start'] if _STATE['start'] is not None else 0.0
+
+    print(f"\n--- Publicação em {_STATE['target']}: {len(futures) - len(failed)} itens, "
+          f"{total / 1e6:.1f} MB em {elapsed:.1f}s (espera ao final: {end - wait_start:.1f}s) ---")
+    if failed:
+        # Registro ao lado da pasta: a próxima execução (start_staging) tenta publicar de novo
+        with open(_pending_file(_STATE['staging']), 'w', encoding='utf-8') as f:
+            json.dump({'destino': _STATE['target'], 'pendentes': failed}, f, ensure_ascii=False)
+        print(f"Aviso: {len(failed)} itens não publicados; cópia local mantida em {_STATE['staging']} "
+              "e publicada na próxima execução")
+    else:
+        shutil.rmtree(_STATE['staging'], ignore_errors=True)
+    _STATE['pool'] = None
+    return failed
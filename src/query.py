@@ -0,0 +1,338 @@
+import io
+import os
+import ast
+import sys
+import time
+import tokenize
+import operator
+import argparse
+import pandas as pd
+from . import resident
+from .prep_store import PREP_CSV, read_prep, prep_parquet_info
+
+# -----------------------------------------------------------------------------
+# CONSULTAS RÁPIDAS AO df PrEP (FILTRO + FREQUÊNCIA / TABELA CRUZADA)
+# Filtros na sintaxe do check_data (pandas/Python): comparações, and/or/not,
+# & | ~, in / not in e os métodos isna, notna, isin, between e str.contains /
+# str.startswith. A expressão é analisada (ast) e avaliada coluna a coluna, sem
+# eval. Cada condição vira uma máscara guardada e cada resposta é memorizada
+# por versão dos dados (arquivo e data de modificação): no serviço local
+# (src/service.py), perguntas repetidas ou parecidas respondem na hora.
+# Fora do serviço, só as colunas usadas são lidas do Parquet e as condições
+# simples do filtro (ligadas por and) descartam row groups já na leitura.
+#
+#   python -m src.query fetar --filter "EmPrEP_Atual == 'Em PrEP atualmente'"
+#   python -m src.query raca4_cat fetar --filter "ano_pri_disp >= 2023 and data_obito.isna()"
+# -----------------------------------------------------------------------------
+
+_COMPARE = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+            ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge}
+_METHODS = {'isna', 'isnull', 'notna', 'notnull', 'isin', 'between'}
+_STR_METHODS = {'contains', 'startswith', 'endswith'}
+# Como no df.query: & | ~ com a precedência de and / or / not (a == 1 & b == 2 dispensa parênteses)
+_BOOL_TOKENS = {'&': 'and', '|': 'or', '~': 'not'}
+MAX_MASKS = 256
+
+# Máscaras das condições e respostas da versão atual dos dados (descartadas quando o arquivo muda)
+_CACHE = {'stamp': None, 'masks': {}, 'results': {}}
+
+class QueryError(ValueError):
+    pass
+
+def parse_filter(expr):
+    """Árvore (ast) da expressão de filtro. QueryError se a sintaxe for inválida."""
+    try:
+        tokens = [(tokenize.NAME, _BOOL_TOKENS[t.string]) if t.type == tokenize.OP and t.string in _BOOL_TOKENS
+                  else (t.type, t.string) for t in tokenize.generate_tokens(io.StringIO(expr.strip()).readline)]
+        return ast.parse(tokenize.untokenize(tokens), mode='eval').body
+    except (SyntaxError, tokenize.TokenError) as e:
+        raise QueryError(f"Sintaxe inválida: {e.args[0]}") from None
+
+def filter_columns(node):
+    """Colunas citadas na expressão (ou na árvore) de filtro."""
+    if isinstance(node, str):
+        node = parse_filter(node)
+    return {n.id for n in ast.walk(node) if isinstance(n, ast.Name) and n.id not in ('True', 'False', 'None')}
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise QueryError(f"Valor não suportado: {ast.unparse(node)}") from None
+
+def _operand(node, df):
+    if isinstance(node, ast.Name):
+        if node.id not in df.columns:
+            raise QueryError(f"A coluna '{node.id}' não existe.")
+        return df[node.id]
+    return _literal(node)
+
+def _compare(node, df):
+    left = _operand(node.left, df)
+    mask = None
+    for op, right_node in zip(node.ops, node.comparators):
+        right = _operand(right_node, df)
+        if isinstance(op, (ast.In, ast.NotIn)):
+            if not isinstance(left, pd.Series):
+                raise QueryError("Use 'coluna in [valores]'.")
+            part = left.isin(right if isinstance(right, (list, tuple, set)) else [right])
+            part = ~part if isinstance(op, ast.NotIn) else part
+        elif type(op) in _COMPARE:
+            part = _COMPARE[type(op)](left, right)
+        else:
+            raise QueryError(f"Operador não suportado: {ast.unparse(node)}")
+        mask = part if mask is None else mask & part
+        left = right
+    return mask
+
+def _call(node, df):
+    func = node.func
+    if not isinstance(func, ast.Attribute):
+        raise QueryError(f"Função não suportada: {ast.unparse(node)}")
+    args = [_literal(a) for a in node.args]
+    kwargs = {k.arg: _literal(k.value) for k in node.keywords}
+    target = func.value
+    if isinstance(target, ast.Attribute) and target.attr == 'str' and func.attr in _STR_METHODS:
+        series = _operand(target.value, df)
+        kwargs.setdefault('na', False)
+        if func.attr == 'contains':
+            kwargs.setdefault('regex', False)
+        return getattr(series.astype(str).where(series.notna()).str, func.attr)(*args, **kwargs)
+    if func.attr in _METHODS and isinstance(target, ast.Name):
+        return getattr(_operand(target, df), func.attr)(*args, **kwargs)
+    raise QueryError(f"Método não suportado: {ast.unparse(node)}")
+
+def _mask(node, df, masks):
+    """Máscara booleana da expressão; condições (comparações e métodos) são guardadas em `masks`."""
+    if isinstance(node, ast.BoolOp):
+        parts = [_mask(v, df, masks) for v in node.values]
+        combine = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+        mask = parts[0]
+        for part in parts[1:]:
+            mask = combine(mask, part)
+        return mask
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+        left, right = _mask(node.left, df, masks), _mask(node.right, df, masks)
+        return left & right if isinstance(node.op, ast.BitAnd) else left | right
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+        return ~_mask(node.operand, df, masks)
+    if isinstance(node, (ast.Compare, ast.Call)):
+        key = ast.dump(node)
+        if key not in masks:
+            mask = _compare(node, df) if isinstance(node, ast.Compare) else _call(node, df)
+            if isinstance(mask, pd.Series) and mask.dtype == 'boolean':
+                mask = mask.fillna(False).astype(bool)
+            if not isinstance(mask, pd.Series) or mask.dtype != bool:
+                raise QueryError(f"A condição não é verdadeiro/falso por linha: {ast.unparse(node)}")
+            if len(masks) >= MAX_MASKS:
+                masks.clear()
+            masks[key] = mask.to_numpy()
+        return masks[key]
+    if isinstance(node, ast.Name) and node.id in df.columns and df[node.id].dtype == bool:
+        return df[node.id].to_numpy()
+    raise QueryError(f"Expressão não suportada: {ast.unparse(node)}")
+
+def _arrow_value(value, arrow_type):
+    """Literal convertido para comparar com uma coluna do tipo `arrow_type` como o pandas faria, ou None."""
+    import pyarrow as pa
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    if isinstance(value, bool) or value is None:
+        return None
+    if pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type):
+        return value if isinstance(value, (int, float)) else None
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return value if isinstance(value, str) else None
+    if pa.types.is_timestamp(arrow_type) and arrow_type.tz is None and isinstance(value, str):
+        try:
+            return pd.Timestamp(value)
+        except ValueError:
+            return None
+    return None
+
+def _field_condition(node, pc, schema):
+    """Condição do pyarrow equivalente a `node`, ou None se não houver (ou puder perder linhas)."""
+    def field_type(name_node):
+        return schema.field(name_node.id).type if name_node.id in schema.names else None
+
+    if isinstance(node, ast.Compare):
+        parts, left = [], node.left
+        for op, right in zip(node.ops, node.comparators):
+            # != e not in ficam de fora: no pandas, nulo != valor é verdadeiro; no pyarrow, a linha cairia
+            if isinstance(op, ast.In) and isinstance(left, ast.Name) and not isinstance(right, ast.Name) and field_type(left):
+                values = _literal(right)
+                values = [_arrow_value(v, field_type(left)) for v in (values if isinstance(values, (list, tuple, set)) else [values])]
+                if any(v is None for v in values):
+                    return None
+                parts.append(pc.field(left.id).isin(values))
+            elif type(op) in _COMPARE and type(op) is not ast.NotEq and isinstance(left, ast.Name) != isinstance(right, ast.Name):
+                name, value, func = (left, right, _COMPARE[type(op)]) if isinstance(left, ast.Name) else \
+                    (right, left, _COMPARE[type(op)] if isinstance(op, ast.Eq) else
+                     {ast.Lt: operator.gt, ast.LtE: operator.ge, ast.Gt: operator.lt, ast.GtE: operator.le}[type(op)])
+                value = _arrow_value(_literal(value), field_type(name)) if field_type(name) else None
+                if value is None:
+                    return None
+                parts.append(func(pc.field(name.id), value))
+            else:
+                return None
+            left = right
+        condition = parts[0]
+        for part in parts[1:]:
+            condition = condition & part
+        return condition
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name) \
+            and not node.keywords and field_type(node.func.value):
+        name, attr = node.func.value, node.func.attr
+        field, args = pc.field(name.id), [_literal(a) for a in node.args]
+        if attr in ('isna', 'isnull') and not args:
+            return field.is_null(nan_is_null=True)
+        if attr in ('notna', 'notnull') and not args:
+            return ~field.is_null(nan_is_null=True)
+        if attr == 'isin' and len(args) == 1 and isinstance(args[0], (list, tuple, set)):
+            values = [_arrow_value(v, field_type(name)) for v in args[0]]
+            return field.isin(values) if all(v is not None for v in values) else None
+        if attr == 'between' and len(args) == 2:
+            low, high = (_arrow_value(a, field_type(name)) for a in args)
+            return (field >= low) & (field <= high) if low is not None and high is not None else None
+    return None
+
+def arrow_filter(node, schema):
+    """
+    Filtro do pyarrow (para read_prep) com as condições simples ligadas por and no nível de cima
+    da expressão, nas colunas e tipos de `schema` (esquema do Parquet). Deixa passar linhas a mais,
+    nunca a menos: o filtro completo é aplicado depois. None se não houver condição aproveitável.
+    """
+    import pyarrow.compute as pc
+    terms, pending = [], [node]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, ast.BoolOp) and isinstance(item.op, ast.And):
+            pending.extend(item.values)
+        elif isinstance(item, ast.BinOp) and isinstance(item.op, ast.BitAnd):
+            pending.extend([item.left, item.right])
+        else:
+            terms.append(item)
+    conditions = []
+    for term in terms:
+        try:
+            condition = _field_condition(term, pc, schema)
+        except (QueryError, TypeError, ValueError):
+            condition = None
+        if condition is not None:
+            conditions.append(condition)
+    if not conditions:
+        return None
+    result = conditions[0]
+    for condition in conditions[1:]:
+        result = result & condition
+    return result
+
+def evaluate_filter(node, df):
+    """Máscara booleana (numpy) das linhas de df que atendem ao filtro (expressão ou árvore), sem guardar nada."""
+    return _mask(parse_filter(node) if isinstance(node, str) else node, df, {})
+
+def read_for_query(file_path, columns, node=None):
+    """
+    Lê só as colunas pedidas e as citadas no filtro, com as condições simples do filtro aplicadas
+    na leitura do Parquet (ver arrow_filter). Retorna (df, linhas do arquivo). O filtro completo
+    ainda precisa ser aplicado ao df (evaluate_filter).
+    """
+    needed = list(dict.fromkeys(list(columns) + (sorted(filter_columns(node)) if node is not None else [])))
+    info = prep_parquet_info(file_path) if node is not None and not resident.enabled() else None
+    filters = arrow_filter(node, info[0]) if info is not None else None
+    df = read_prep(file_path, columns=needed, filters=filters, low_memory=False)
+    return df, (len(df) if filters is None else info[1])
+
+def load_table(file_path=PREP_CSV):
+    """df PrEP (Parquet ao lado do CSV, se houver) e a versão do arquivo. No serviço, fica em memória."""
+    parquet_path = os.path.splitext(file_path)[0] + '.parquet'
+    path = parquet_path if os.path.exists(parquet_path) else file_path
+    stamp = resident.file_stamp(path)
+    df = resident.peek('prep', stamp[0], stamp)
+    if df is None:
+        print(f"Lendo base local: {path}...")
+        df = pd.read_parquet(path) if path == parquet_path else read_prep(file_path, low_memory=False)
+        resident.remember('prep', stamp[0], df, stamp, copy_value=False)
+    return df, stamp
+
+def _count(df, mask, columns):
+    if len(columns) == 1:
+        values = df[columns[0]] if mask is None else df[columns[0]][mask]
+        return values.value_counts(dropna=False).sort_index()
+    sub = df[columns] if mask is None else df.loc[mask, columns]
+    table = sub.groupby(columns, dropna=False, observed=True).size().unstack(fill_value=0)
+    # Rótulos como objetos (faixas categóricas não aceitariam a linha/coluna 'Total')
+    table.index, table.columns = table.index.astype(object), table.columns.astype(object)
+    table['Total'] = table.sum(axis=1)
+    table.loc['Total'] = table.sum()
+    return table
+
+def run_query(df, stamp, columns, filter_expr=None):
+    """
+    Frequência (uma coluna) ou tabela cruzada (duas colunas, com totais) das linhas que atendem ao filtro.
+    Retorna (resultado, linhas filtradas, memorizado?). Respostas e máscaras valem para a versão `stamp`.
+    """
+    if _CACHE['stamp'] != stamp:
+        _CACHE.update(stamp=stamp, masks={}, results={})
+    node = parse_filter(filter_expr) if filter_expr else None
+    key = (tuple(columns), ast.dump(node) if node is not None else None)
+    if key in _CACHE['results']:
+        return _CACHE['results'][key] + (True,)
+
+    for col in columns:
+        if col not in df.columns:
+            raise QueryError(f"A coluna '{col}' não existe.")
+    mask = _mask(node, df, _CACHE['masks']) if node is not None else None
+    rows = len(df) if mask is None else int(mask.sum())
+    _CACHE['results'][key] = (_count(df, mask, list(columns)), rows)
+    return _CACHE['results'][key] + (False,)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consulta rápida ao df PrEP consolidado (frequência ou tabela cruzada).")
+    parser.add_argument("colunas", nargs='+', help="Uma coluna (frequência) ou duas (linhas x colunas).")
+    parser.add_argument("--filter", default=None, help="Expressão de filtro. Ex: \"EmPrEP_Atual == 'Em PrEP atualmente' and data_obito.isna()\"")
+    parser.add_argument("--arquivo", default=PREP_CSV, help="df PrEP consolidado (o Parquet ao lado é preferido).")
+    args = parser.parse_args(argv)
+    if len(args.colunas) > 2:
+        parser.error("informe uma ou duas colunas.")
+
+    t0 = time.perf_counter()
+    try:
+        if resident.enabled():
+            df, stamp = load_table(args.arquivo)
+            result, rows, cached = run_query(df, stamp, args.colunas, args.filter)
+            total = len(df)
+        else:
+            # Consulta única: nada a memorizar, só as colunas usadas e o filtro empurrado para a leitura
+            node = parse_filter(args.filter) if args.filter else None
+            df, total = read_for_query(args.arquivo, args.colunas, node)
+            for col in args.colunas:
+                if col not in df.columns:
+                    raise QueryError(f"A coluna '{col}' não existe.")
+            mask = evaluate_filter(node, df) if node is not None else None
+            rows, cached = (len(df) if mask is None else int(mask.sum())), False
+            result = _count(df, mask, list(args.colunas))
+    except FileNotFoundError:
+        print(f"Erro: O arquivo '{args.arquivo}' não foi encontrado.")
+        return 1
+    except QueryError as e:
+        print(f"Erro: {e}")
+        print("Dica: Use sintaxe Pandas, ex: 'coluna == \"Valor\"', 'coluna.isna()' ou 'coluna in [1, 2]'")
+        return 1
+    except Exception as e:
+        print(f"Erro no filtro: {e}")
+        return 1
+
+    if args.filter:
+        print(f"Filtro: {args.filter} -> {rows} linhas (de {total})")
+    print(f"\n--- {'Frequência da variável' if len(args.colunas) == 1 else 'Tabela cruzada'}: {' x '.join(args.colunas)} ---")
+    with pd.option_context('display.max_rows', 500, 'display.max_columns', 50, 'display.width', 200):
+        print(result)
+    print(f"\nTotal: {rows}  ({(time.perf_counter() - t0) * 1000:.0f} ms{', memorizado' if cached else ''})")
+    return 0
+
+if __name__ == "__main__":
+    # Com o serviço local em execução, a consulta é respondida por ele (tabela já em memória)
+    from .service import send
+    code = send('consulta', sys.argv[1:])
+    sys.exit(main() if code is None else code)
@@ -0,0 +1,84 @@
+import os
+import copy
+import threading
+
+# -----------------------------------------------------------------------------
+# DADOS RESIDENTES (SERVIÇO LOCAL)
+# Dentro do serviço (src/service.py), as bases, o df PrEP lido do Parquet e os
+# checkpoints das etapas ficam em memória entre uma execução e outra. Fora do
+# serviço nada muda: recall sempre devolve None.
+# Quem recebe um valor recebe uma cópia (as etapas alteram os DataFrames que
+# recebem); a versão guardada nunca é alterada.
+# -----------------------------------------------------------------------------
+
+_MEMO = {}
+_LOCK = threading.Lock()
+_STATE = {'enabled': False}
+
+def enable(flag=True):
+    _STATE['enabled'] = flag
+    if not flag:
+        clear()
+
+def enabled():
+    return _STATE['enabled']
+
+def file_stamp(path):
+    """Identifica a versão de um arquivo (caminho absoluto, data de modificação e tamanho)."""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+def recall(group, key, stamp=None, select=None):
+    """
+    Cópia do valor guardado em (group, key) com a mesma `stamp`, ou None.
+    `select`: função aplicada ao valor guardado antes da cópia (ex: só algumas colunas).
+    """
+    if not _STATE['enabled']:
+        return None
+    with _LOCK:
+        entry = _MEMO.get((group, key))
+    if entry is None or entry[0] != stamp:
+        return None
+    value = select(entry[1]) if select is not None else entry[1]
+    return copy.deepcopy(value)
+
+def peek(group, key, stamp=None):
+    """Valor guardado em (group, key) com a mesma `stamp`, sem cópia (somente leitura), ou None."""
+    with _LOCK:
+        entry = _MEMO.get((group, key))
+    return entry[1] if entry is not None and entry[0] == stamp else None
+
+def remember(group, key, value, stamp=None, copy_value=True):
+    """
+    Guarda o valor em (group, key), substituindo a versão anterior. Retorna o próprio valor.
+    Guarda uma cópia, a não ser que quem chama não vá mais usar o valor (copy_value=False).
+    """
+    if _STATE['enabled']:
+        stored = copy.deepcopy(value) if copy_value else value
+        with _LOCK:
+            _MEMO[(group, key)] = (stamp, stored)
+    return value
+
+def forget(group, key=None):
+    """Remove (group, key), ou o grupo inteiro se key for None."""
+    with _LOCK:
+        for k in [k for k in _MEMO if k[0] == group and (key is None or k[1] == key)]:
+            del _MEMO[k]
+
+def clear():
+    with _LOCK:
+        _MEMO.clear()
+
+def _size(value):
+    if hasattr(value, 'memory_usage'):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+    if isinstance(value, dict):
+        return sum(_size(v) for v in value.values())
+    return 0
+
+def summary():
+    """[(grupo, chave, MB aproximados)] do que está em memória."""
+    with _LOCK:
+        items = list(_MEMO.items())
+    return [(group, key, _size(value) / 1e6) for (group, key), (_, value) in items]
@@ -0,0 +1,200 @@
+import io
+import os
+import gc
+import sys
+import json
+import glob
+import runpy
+import secrets
+import argparse
+import threading
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from . import resident
+
+# -----------------------------------------------------------------------------
+# SERVIÇO LOCAL (DADOS RESIDENTES)
+# Processo de longa duração que mantém em memória as bases, o df PrEP e os
+# checkpoints das etapas (ver resident) e executa, um de cada vez, o pipeline
+# (src.main) e scripts de análise (check_data.py, inspect_*.py...) pedidos por
+# um socket local (127.0.0.1, com chave em .cache/servico.json). A saída de cada
+# execução aparece no terminal de quem pediu.
+#
+#   python -m src.service iniciar                       (em um terminal à parte)
+#   python -m src.service main --data_fechamento 2025-09-30 --skip_ppt
+#   python -m src.service script check_data.py ano_disp --filter "ano_disp > 2020"
+#   python -m src.service consulta fetar --filter "EmPrEP_Atual == 'Em PrEP atualmente'"  (ver query)
+#   python -m src.service status | limpar | parar
+# -----------------------------------------------------------------------------
+
+# Mesmo .cache do data_loader; sem importá-lo, o cliente não carrega o pandas e responde mais rápido
+CACHE_DIR = ".cache"
+INFO_FILE = os.path.join(CACHE_DIR, "servico.json")
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+COMMANDS = ['iniciar', 'main', 'script', 'consulta', 'status', 'limpar', 'parar']
+
+class _ConnectionWriter(io.TextIOBase):
+    """stdout/stderr de uma execução no serviço, enviado ao cliente (descartado se ele desconectar)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text and self.conn is not None:
+            with self.lock:
+                try:
+                    self.conn.send(('saida', text))
+                except (OSError, EOFError):
+                    self.conn = None
+        return len(text)
+
+def _code_stamp():
+    """Data de modificação mais recente dos módulos de src/ (código já importado pelo serviço)."""
+    return max(os.stat(p).st_mtime_ns for p in glob.glob(os.path.join(SRC_DIR, "*.py")))
+
+def _run_job(request):
+    """Executa src.main ou um script no processo do serviço. Retorna o código de saída."""
+    argv = list(request['argumentos'])
+    if request['comando'] == 'consulta':
+        from . import query
+        return query.main(argv)
+    if request['comando'] == 'main':
+        # Sem terminal para perguntas; etapas de dados retomadas dos checkpoints (em memória) se nada mudou
+        recalcular = '--recalcular' in argv
+        argv = [a for a in argv if a != '--recalcular']
+        argv += [a for a in ('--auto', '--checkpoint' if recalcular else '--resume') if a not in argv]
+        from . import main as pipeline
+        sys.argv = ['src.main'] + argv
+        pipeline.main()
+    else:
+        if not argv:
+            print("Erro: informe o script (Ex: script check_data.py ano_disp).")
+            return 2
+        sys.argv = argv
+        runpy.run_path(argv[0], run_name='__main__')
+    return 0
+
+def _handle(conn, request, code_stamp):
+    writer = _ConnectionWriter(conn)
+    saved_argv, saved_stdin, saved_cwd = sys.argv, sys.stdin, os.getcwd()
+    code = 0
+    try:
+        os.chdir(request['cwd'])
+        sys.stdin = io.StringIO()
+        with redirect_stdout(writer), redirect_stderr(writer):
+            if request['comando'] in ('main', 'script', 'consulta') and _code_stamp() != code_stamp:
+                print("Aviso: O código de src/ mudou desde o início do serviço. Reinicie-o "
+                      "(python -m src.service parar / iniciar) para usar a versão nova.")
+                code = 3
+            elif request['comando'] == 'status':
+                items = resident.summary()
+                print(f"Serviço em execução (pid {os.getpid()}); {len(items)} itens em memória:")
+                for group, key, mb in items:
+                    print(f"  [{group}] {key}: {mb:,.1f} MB")
+            elif request['comando'] == 'limpar':
+                resident.clear()
+                print("Dados em memória descartados.")
+            else:
+                try:
+                    code = _run_job(request)
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                except Exception:
+                    traceback.print_exc()
+                    code = 1
+    finally:
+        sys.argv, sys.stdin = saved_argv, saved_stdin
+        os.chdir(saved_cwd)
+        gc.collect()
+    try:
+        conn.send(('fim', code))
+    except (OSError, EOFError):
+        pass
+
+def serve(port=0):
+    """Inicia o serviço (em primeiro plano) até receber 'parar'."""
+    resident.enable()
+    code_stamp = _code_stamp()
+    # Consultas (pandas e o motor de filtros) já importadas antes do primeiro pedido
+    from . import query
+    authkey = secrets.token_bytes(32)
+    with Listener(('127.0.0.1', port), authkey=authkey) as listener:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(INFO_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'porta': listener.address[1], 'chave': authkey.hex(), 'pid': os.getpid()}, f)
+        print(f"Serviço pronto em {listener.address[0]}:{listener.address[1]} (pid {os.getpid()}). "
+              "Use 'python -m src.service parar' para encerrar.")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, OSError, EOFError) as e:
+                    print(f"Aviso: Conexão recusada ({e}).")
+                    continue
+                with conn:
+                    try:
+                        request = conn.recv()
+                    except (OSError, EOFError):
+                        continue
+                    print(f"[Serviço] {request['comando']} {' '.join(request['argumentos'])}")
+                    if request['comando'] == 'parar':
+                        conn.send(('saida', "Serviço encerrado.\n"))
+                        conn.send(('fim', 0))
+                        break
+                    _handle(conn, request, code_stamp)
+                    print(f"[Serviço] {request['comando']} concluído")
+        except KeyboardInterrupt:
+            print("\nServiço interrompido.")
+        finally:
+            resident.enable(False)
+            if os.path.exists(INFO_FILE):
+                os.remove(INFO_FILE)
+
+def send(command, arguments=()):
+    """Envia um pedido ao serviço e repassa a saída ao terminal. Retorna o código de saída (None se não houver serviço)."""
+    try:
+        with open(INFO_FILE, encoding='utf-8') as f:
+            info = json.load(f)
+        conn = Client(('127.0.0.1', info['porta']), authkey=bytes.fromhex(info['chave']))
+    except (OSError, ValueError, KeyError, AuthenticationError):
+        return None
+    with conn:
+        conn.send({'comando': command, 'argumentos': list(arguments), 'cwd': os.getcwd()})
+        while True:
+            try:
+                kind, payload = conn.recv()
+            except (OSError, EOFError):
+                print("Aviso: Conexão com o serviço perdida.")
+                return 1
+            if kind == 'fim':
+                return payload
+            sys.stdout.write(payload)
+            sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serviço local do Monitoramento PrEP (bases e etapas em memória)")
+    parser.add_argument("comando", choices=COMMANDS,
+                        help="iniciar: sobe o serviço; main: executa o pipeline (argumentos de src.main; --recalcular refaz as etapas e grava checkpoints novos); "
+                             "script: executa um script (Ex: check_data.py ano_disp); consulta: frequência/tabela cruzada do df PrEP "
+                             "(ver src/query.py); status, limpar, parar.")
+    parser.add_argument("--porta", type=int, default=0, help="Porta local do serviço (só com 'iniciar'; padrão: livre).")
+    parser.add_argument("argumentos", nargs=argparse.REMAINDER, help="Argumentos repassados a src.main ou ao script.")
+    args = parser.parse_args()
+
+    if args.comando == 'iniciar':
+        serve(args.porta)
+        return
+    code = send(args.comando, args.argumentos)
+    if code is None:
+        print("Serviço não está em execução. Inicie com: python -m src.service iniciar")
+        code = 1
+    sys.exit(code)
+
+if __name__ == "__main__":
+    main()
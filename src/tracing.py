@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import inspect
+import datetime
+import functools
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from .data_loader import CACHE_DIR
+
+try:
+    import psutil
+    _PROCESS = psutil.Process()
+except ImportError:
+    psutil = None
+
+# -----------------------------------------------------------------------------
+# RASTRO DA EXECUÇÃO (SPANS ANINHADOS)
+# Cada etapa/sub-etapa é um span com tempo de parede, CPU da thread, RSS no
+# início e pico de RSS durante o span (amostrado em segundo plano), e linhas x
+# colunas das tabelas de entrada e saída. Ao final, o rastro é gravado em JSON
+# (.cache/rastros), em pilhas dobradas (flamegraph.pl / speedscope) e resumido
+# em árvore no terminal. Spans de etapas paralelas se sobrepõem: o RSS é do
+# processo inteiro.
+# -----------------------------------------------------------------------------
+
+TRACE_DIR = os.path.join(CACHE_DIR, "rastros")
+SAMPLE_INTERVAL = 0.05
+
+# Spans abertos por thread (pilha) e em todo o processo (amostragem de memória)
+_LOCAL = threading.local()
+_OPEN = {}
+_LOCK = threading.Lock()
+_SAMPLER = {'thread': None}
+
+def rss_bytes():
+    """RSS atual do processo (psutil; sem psutil, /proc no Linux). None se indisponível."""
+    if psutil is not None:
+        return _PROCESS.memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _sample_memory():
+    while True:
+        with _LOCK:
+            if not _OPEN:
+                _SAMPLER['thread'] = None
+                return
+            rss = rss_bytes()
+            for sp in _OPEN.values():
+                sp['_pico'] = max(sp['_pico'], rss)
+        time.sleep(SAMPLE_INTERVAL)
+
+def _stack():
+    if not hasattr(_LOCAL, 'stack'):
+        _LOCAL.stack = []
+    return _LOCAL.stack
+
+def current_span():
+    """Span aberto mais interno da thread atual (ou None)."""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+def frame_shapes(values):
+    """{nome: [linhas, colunas]} das tabelas (DataFrame/Series) em values (dict ou sequência), na ordem recebida."""
+    items = values.items() if isinstance(values, dict) else enumerate(values)
+    shapes = {}
+    for name, value in items:
+        if isinstance(value, pd.DataFrame):
+            shapes[str(name)] = [len(value), len(value.columns)]
+        elif isinstance(value, pd.Series):
+            shapes[str(name)] = [len(value), 1]
+    return shapes
+
+def record_frames(sp, kind, values):
+    """Registra no span as tabelas de entrada (kind='entradas') ou de saída (kind='saidas')."""
+    if sp is not None:
+        sp[kind].update(frame_shapes(values))
+
+@contextmanager
+def span(name, parent=None, **attrs):
+    """
+    Abre um span filho do span atual da thread (ou de `parent`, para spans em outra thread).
+    Uso: with span('limpeza') as sp: ...; record_frames(sp, 'saidas', {'disp': df})
+    """
+    parent = parent if parent is not None else current_span()
+    rss = rss_bytes()
+    sp = {'nome': name, 'inicio': time.time(), 'attrs': attrs, 'entradas': {}, 'saidas': {}, 'filhos': [],
+          '_t0': time.perf_counter(), '_cpu0': time.thread_time(), '_cpup0': time.process_time(), '_rss0': rss, '_pico': rss or 0}
+    if parent is not None:
+        with _LOCK:
+            parent['filhos'].append(sp)
+    if rss is not None:
+        with _LOCK:
+            _OPEN[id(sp)] = sp
+            if _SAMPLER['thread'] is None:
+                _SAMPLER['thread'] = threading.Thread(target=_sample_memory, name="rastro_memoria", daemon=True)
+                _SAMPLER['thread'].start()
+    _stack().append(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp['erro'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _stack().pop()
+        sp['parede_s'] = time.perf_counter() - sp.pop('_t0')
+        sp['cpu_s'] = time.thread_time() - sp.pop('_cpu0')
+        sp['cpu_processo_s'] = time.process_time() - sp.pop('_cpup0')
+        rss0 = sp.pop('_rss0')
+        with _LOCK:
+            _OPEN.pop(id(sp), None)
+            pico = max(sp.pop('_pico'), rss_bytes() or 0)
+        if rss0 is not None:
+            sp['rss_inicio_mb'] = rss0 / 1024 ** 2
+            sp['pico_delta_mb'] = (pico - rss0) / 1024 ** 2
+
+def traced(name=None):
+    """Decorador: cada chamada vira um span, com as tabelas recebidas e retornadas."""
+    def decorator(func):
+        span_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name) as sp:
+                record_frames(sp, 'entradas', signature.bind_partial(*args, **kwargs).arguments)
+                result = func(*args, **kwargs)
+                record_frames(sp, 'saidas', result if isinstance(result, tuple) else [result])
+                return result
+        return wrapper
+    return decorator
+
+def _folded(sp, prefix, lines):
+    path = f"{prefix};{sp['nome']}" if prefix else sp['nome']
+    # Tempo próprio (sem os filhos), em ms, no formato de pilhas dobradas
+    own = sp['parede_s'] - sum(c['parede_s'] for c in sp['filhos'])
+    if own > 0:
+        lines.append(f"{path} {int(round(own * 1000))}")
+    for child in sp['filhos']:
+        _folded(child, path, lines)
+
+def _fmt_shapes(shapes):
+    if not shapes:
+        return ""
+    rows, cols = next(iter(shapes.values()))
+    return f"{rows:,}x{cols}".replace(",", ".")
+
+def _summary(sp, total, depth, lines, width=36):
+    share = sp['parede_s'] / total if total > 0 else 0
+    bar = "█" * int(round(share * 20))
+    # Na raiz, CPU de todo o processo (etapas rodam em outras threads)
+    cpu = sp['cpu_processo_s'] if depth == 0 else sp['cpu_s']
+    mem = f"  pico +{sp['pico_delta_mb']:,.0f} MB" if 'pico_delta_mb' in sp else ""
+    shapes = ""
+    if sp['entradas'] or sp['saidas']:
+        shapes = f"  {_fmt_shapes(sp['entradas']) or '-'} -> {_fmt_shapes(sp['saidas']) or '-'}"
+    label = ("  " * depth + sp['nome'])[:width].ljust(width)
+    lines.append(f"{label} {sp['parede_s']:8.1f}s {share:5.0%} {bar:<20}  CPU {cpu:7.1f}s{mem}{shapes}"
+                 + ("  [ERRO]" if 'erro' in sp else ""))
+    for child in sp['filhos']:
+        _summary(child, total, depth + 1, lines, width)
+
+def _public(sp):
+    return {k: (v if k != 'filhos' else [_public(c) for c in v]) for k, v in sp.items() if not k.startswith('_')}
+
+def write_trace(root, label, trace_dir=TRACE_DIR):
+    """
+    Grava o rastro (JSON e pilhas dobradas .folded) e imprime o resumo em árvore.
+    Retorna o caminho do JSON.
+    """
+    lines = []
+    _summary(root, root['parede_s'], 0, lines)
+    print("\n--- Rastro da execução (tempo de parede; CPU; pico de RSS acima do início; linhas x colunas da 1ª tabela de entrada -> saída) ---")
+    print("\n".join(lines))
+
+    try:
+        os.makedirs(trace_dir, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(trace_dir, f"rastro_{label}_{stamp}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(_public(root), f, ensure_ascii=False, indent=1, default=str)
+        folded = []
+        _folded(root, "", folded)
+        with open(os.path.splitext(path)[0] + ".folded", 'w', encoding='utf-8') as f:
+            f.write("\n".join(folded) + "\n")
+        print(f"Rastro salvo em: {path} (.folded para flamegraph)")
+        return path
+    except Exception as e:
+        print(f"Aviso: Não foi possível salvar o rastro: {e}")
+        return None
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 def mes_nome(data):
@@ -11,3 +12,33 @@ def mes_nome(data):
     if pd.isnull(data):
         return ""
     return meses.get(data.month, '')
+
+def feed_hash(h, obj):
+    """Atualiza o hash com o conteúdo de obj (pandas, numpy, coleções e escalares)."""
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        h.update(f"{type(obj).__name__}|{obj.shape}|{getattr(obj, 'name', None)!r}".encode())
+        if isinstance(obj, pd.DataFrame):
+            h.update(repr((list(obj.columns), list(obj.dtypes.astype(str)))).encode())
+        else:
+            h.update(str(obj.dtype).encode())
+        if not isinstance(obj, pd.Index):
+            h.update(repr((list(obj.index.names), str(obj.index.dtype))).encode())
+        try:
+            h.update(pd.util.hash_pandas_object(obj, index=not isinstance(obj, pd.Index)).to_numpy().tobytes())
+        except TypeError:
+            h.update(repr(obj.to_dict() if not isinstance(obj, pd.Index) else list(obj)).encode())
+    elif isinstance(obj, np.ndarray) and obj.dtype != object:
+        h.update(f"ndarray|{obj.dtype}|{obj.shape}".encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple, np.ndarray)):
+        h.update(f"{type(obj).__name__}|{len(obj)}".encode())
+        for item in obj:
+            feed_hash(h, item)
+    elif isinstance(obj, dict):
+        h.update(f"dict|{len(obj)}".encode())
+        for k in sorted(obj, key=repr):
+            feed_hash(h, k)
+            feed_hash(h, obj[k])
+    else:
+        h.update(f"{type(obj).__name__}|{obj!r}".encode())
+    h.update(b";")
@@ -1,8 +1,48 @@
 import matplotlib.pyplot as plt
 import pandas as pd
 import os
+import io
 import numpy as np
 from .config import MONTHS_ORDER
+from .chart_cache import cached_chart
+from .artifacts import write_bytes
+
+# Versão do desenho dos gráficos (chave do cache): incrementar ao alterar cores, rótulos ou layout
+STYLE_VERSION = 1
+
+# Perfil de rascunho (draft=True): mesmos gráficos, rótulos e layout, em baixa resolução,
+# sem antialiasing e com PNG pouco comprimido. Para conferir números e slides rapidamente.
+DRAFT_DPI = 40
+DRAFT_RC = {'text.antialiased': False, 'patch.antialiased': False, 'lines.antialiased': False}
+
+def _reset_style(draft=False):
+    plt.rcParams.update(plt.rcParamsDefault)
+    if draft:
+        plt.rcParams.update(DRAFT_RC)
+
+def _save_figure(fig, save_path, draft=False):
+    """Gera o PNG em memória e publica em save_path (ver artifacts: gravação direta ou adiada)."""
+    buffer = io.BytesIO()
+    if draft:
+        fig.savefig(buffer, format='png', facecolor='white', transparent=False, bbox_inches='tight',
+                    dpi=DRAFT_DPI, pil_kwargs={'compress_level': 1})
+    else:
+        fig.savefig(buffer, format='png', facecolor='white', transparent=False, bbox_inches='tight')
+    write_bytes(save_path, buffer.getvalue())
+
+IST_NAME_MAPPING = {
+    'st_ferida_vagina_penis': 'Feridas na vagina/ no pênis',
+    'st_ferida_anus': 'Feridas no ânus',
+    'st_verruga_vagina_penis': 'Verrugas na vagina/no pênis',
+    'st_verruga_anus': 'Verrugas no ânus',
+    'st_bolhas_vagina_penis': 'Pequenas bolhas na vagina/no pênis',
+    'st_bolhas_anus': 'Pequenas bolhas no ânus',
+    'st_corrimento_vaginal': 'Corrimento vaginal ou no canal uretral',
+    'st_sifilis': 'Diagnóstico de Sífilis',
+    'st_gonorreia_clamidia': 'Diagnóstico de Gonorréia/Clamídia Retal',
+    'st_suspeita_mpox': 'Suspeita de Mpox',
+    'st_diagnost_mpox' : 'Diagnóstico de Mpox'
+}
 
 def plot_dispensations(df_disp_semdupl, data_fechamento, output_dir):
     """
@@ -11,15 +51,23 @@ def plot_dispensations(df_disp_semdupl, data_fechamento, output_dir):
     """
     print("Gerando gráfico: Dispensas por Mês/Ano...")
     
-    # Garantir datetime
-    hoje_dt = pd.to_datetime(data_fechamento)
-    
-    # 1. Preparar Dados (Crosstab + Melt)
+    # 1. Preparar Dados (Crosstab)
     crosstab_result = pd.crosstab(index=df_disp_semdupl['mes_disp'], 
                                   columns=df_disp_semdupl['ano_disp'])
     
-    # Reindexar meses
+    render_dispensations(crosstab_result, data_fechamento, output_dir)
+
+@cached_chart(STYLE_VERSION)
+def render_dispensations(crosstab_result, data_fechamento, output_dir, draft=False):
+    """
+    Desenha 'PrEP_disp.png' a partir da matriz Mês x Ano de dispensas já agregada.
+    """
+    # Garantir datetime
+    hoje_dt = pd.to_datetime(data_fechamento)
+    
+    # Reindexar meses (descarta linha 'Total', se houver)
     crosstab_result = crosstab_result.reindex(MONTHS_ORDER)
+    crosstab_result.index.name = 'mes_disp'
     
     # Converter para formato longo
     crosstab_long = crosstab_result.reset_index().melt(id_vars='mes_disp', value_name='Count')
@@ -36,7 +84,7 @@ def plot_dispensations(df_disp_semdupl, data_fechamento, output_dir):
     current_year_str = str(hoje_dt.year)
 
     # 2. Plotting
-    plt.rcParams.update(plt.rcParamsDefault)
+    _reset_style(draft)
     fig, ax = plt.subplots(figsize=(18, 8))
     
     colors = ['#DCE6F2', '#95B3D7', '#4F81BD', '#1F497D', '#95B3D7', '#4F81BD']
@@ -62,17 +110,12 @@ def plot_dispensations(df_disp_semdupl, data_fechamento, output_dir):
     ax.spines['bottom'].set_visible(True)
     ax.tick_params(axis='x', which='both', bottom=False)
 
-    # 4. Anotações
+    # 4. Anotações (Dezembro de cada ano e mês do fechamento)
     crosstab_long = crosstab_long.reset_index(drop=True)
-    for idx, row in crosstab_long.iterrows():
-        should_annotate = False
-        if row['Month'] == 'Dez': should_annotate = True
-        if row['Year'] == current_year_str and row['Month'] == current_month_abbr: should_annotate = True
-            
-        if should_annotate:
-            val = row['Count']
-            val_str = "{:,}".format(val).replace(",", ".")
-            ax.text(idx, val + 500, val_str, color='black', ha='center', va='bottom', fontsize=12)
+    annotate = (crosstab_long['Month'] == 'Dez') | ((crosstab_long['Year'] == current_year_str) & (crosstab_long['Month'] == current_month_abbr))
+    for idx, val in crosstab_long.loc[annotate, 'Count'].items():
+        val_str = "{:,}".format(val).replace(",", ".")
+        ax.text(idx, val + 500, val_str, color='black', ha='center', va='bottom', fontsize=12)
 
     # 5. Ajustar Labels X
     new_xticks_pos = []
@@ -87,11 +130,11 @@ def plot_dispensations(df_disp_semdupl, data_fechamento, output_dir):
 
     plt.xticks(new_xticks_pos, new_xticks_labels, rotation=0)
 
-    if not os.path.exists(output_dir): os.makedirs(output_dir)
     save_path = os.path.join(output_dir, "PrEP_disp.png")
     try:
-        fig.savefig(save_path, facecolor='white', transparent=False, bbox_inches='tight')
+        _save_figure(fig, save_path, draft)
         print(f"Gráfico salvo: {save_path}")
+        return save_path
     except Exception as e:
         print(f"Erro ao salvar gráfico: {e}")
     finally:
@@ -105,21 +148,25 @@ def plot_cascade(df_prep, output_dir):
     count_emprep = (df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente').sum()
     count_desc = (df_prep['EmPrEP_Atual'] == 'Estão descontinuados').sum()
 
-    plt.rcParams.update(plt.rcParamsDefault)
+    render_cascade([total_registros, soma_disp2, count_disp12m, count_emprep, count_desc], output_dir)
+
+@cached_chart(STYLE_VERSION)
+def render_cascade(counts, output_dir, draft=False):
+    """
+    Desenha 'PrEP_cascata.png' a partir das 5 contagens da cascata
+    (Procuraram, Iniciaram, 12m, Em PrEP, Descontinuados).
+    """
+    _reset_style(draft)
     fig, ax = plt.subplots(figsize=(10, 6))
     bar_width = 0.4
     
     x_pos = np.arange(5)
-    counts = [total_registros, soma_disp2, count_disp12m, count_emprep, count_desc]
     labels = ['Procuraram PrEP', 'Iniciaram PrEP', 'Dispensação\núltimos 12m', 'Em PrEP', 'Descontinuados']
     colors = ['#B7DEE8', '#31859C', '#376092', '#215968', '#C0504D']
     
     bars = ax.bar(x_pos, counts, width=bar_width, color=colors, edgecolor='none')
     
-    for bar in bars:
-        height = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width() / 2, height, '{:,.0f}'.format(height).replace(",", "."),
-                ha='center', va='bottom', fontsize=12)
+    ax.bar_label(bars, labels=['{:,.0f}'.format(v).replace(",", ".") for v in bars.datavalues], fontsize=12)
 
     ax.spines['top'].set_visible(False)
     ax.spines['right'].set_visible(False)
@@ -131,11 +178,11 @@ def plot_cascade(df_prep, output_dir):
     plt.tick_params(axis='x', which='both', bottom=False)
     plt.tight_layout()
     
-    if not os.path.exists(output_dir): os.makedirs(output_dir)
     save_path = os.path.join(output_dir, "PrEP_cascata.png")
     try:
-        fig.savefig(save_path, facecolor='white', transparent=False, bbox_inches='tight')
+        _save_figure(fig, save_path, draft)
         print(f"Gráfico salvo: {save_path}")
+        return save_path
     except Exception as e:
         print(f"Erro ao salvar gráfico: {e}")
     finally:
@@ -170,10 +217,14 @@ def plot_prep_annual_summary(df_prep, data_fechamento, output_dir):
         prep_counts.append(n_emprep)
         total_counts.append(n_total)
         
-    prep_counts = np.array(prep_counts)
-    total_counts = np.array(total_counts)
-    
-    plt.rcParams.update(plt.rcParamsDefault)
+    render_prep_annual_summary(years, np.array(prep_counts), np.array(total_counts), output_dir)
+
+@cached_chart(STYLE_VERSION)
+def render_prep_annual_summary(years, prep_counts, total_counts, output_dir, draft=False):
+    """
+    Desenha 'PrEP_emprep.png' a partir das séries anuais (Em PrEP e Em PrEP + Descontinuados).
+    """
+    _reset_style(draft)
     fig, ax = plt.subplots(figsize=(12, 6))
     bar_width = 0.35
     opacity = 0.8
@@ -206,11 +257,11 @@ def plot_prep_annual_summary(df_prep, data_fechamento, output_dir):
     ax.spines['bottom'].set_visible(True)
     plt.tick_params(axis='x', which='both', bottom=False)
     
-    if not os.path.exists(output_dir): os.makedirs(output_dir)
     save_path = os.path.join(output_dir, "PrEP_emprep.png")
     try:
-        fig.savefig(save_path, facecolor='white', transparent=False, bbox_inches='tight')
+        _save_figure(fig, save_path, draft)
         print(f"Gráfico salvo: {save_path}")
+        return save_path
     except Exception as e:
         print(f"Erro ao salvar gráfico: {e}")
     finally:
@@ -218,19 +269,29 @@ def plot_prep_annual_summary(df_prep, data_fechamento, output_dir):
 
 def plot_new_users(df_prep, data_fechamento, output_dir):
     print("Gerando gráfico: Novos Usuários por Mês/Ano...")
-    hoje_dt = pd.to_datetime(data_fechamento)
     
     if 'dt_disp_min' not in df_prep.columns: return
         
-    filtered = df_prep[df_prep['dt_disp_min'].notnull()].copy()
-    filtered['ano_pri_disp'] = filtered['dt_disp_min'].dt.year.astype(str)
+    filtered = df_prep[df_prep['dt_disp_min'].notnull()]
+    mes_pri_disp = filtered['dt_disp_min'].dt.month.map(lambda m: MONTHS_ORDER[m - 1])
+    crosstab_result = pd.crosstab(index=mes_pri_disp, columns=filtered['dt_disp_min'].dt.year)
     
-    month_map_num_en = {1: 'Jan', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dec'}
-    filtered['mes_pri_disp_en'] = filtered['dt_disp_min'].dt.month.map(month_map_num_en)
+    render_new_users(crosstab_result, data_fechamento, output_dir)
 
-    crosstab_result = pd.crosstab(index=filtered['mes_pri_disp_en'], columns=filtered['ano_pri_disp'])
+@cached_chart(STYLE_VERSION)
+def render_new_users(crosstab_result, data_fechamento, output_dir, draft=False):
+    """
+    Desenha 'PrEP_novosusuarios.png' a partir da matriz Mês (Jan..Dez) x Ano de novos usuários.
+    """
+    hoje_dt = pd.to_datetime(data_fechamento)
+    
+    month_map_num_en = {1: 'Jan', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dec'}
     months_order = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    crosstab_result = crosstab_result.reindex(months_order)
+    
+    # Meses PT -> EN (eventos abaixo usam rótulos em inglês) e anos como texto
+    crosstab_result = crosstab_result.reindex(MONTHS_ORDER)
+    crosstab_result.index = pd.Index(months_order, name='mes_pri_disp_en')
+    crosstab_result.columns = [str(int(c)) for c in crosstab_result.columns]
     
     crosstab_long = crosstab_result.reset_index().melt(id_vars='mes_pri_disp_en', value_name='Count')
     crosstab_long.columns = ['Month', 'Year', 'Count']
@@ -248,7 +309,7 @@ def plot_new_users(df_prep, data_fechamento, output_dir):
     current_month_en = month_map_num_en[hoje_dt.month]
     current_year_str = str(hoje_dt.year)
     
-    plt.rcParams.update(plt.rcParamsDefault)
+    _reset_style(draft)
     fig, ax = plt.subplots(figsize=(18, 8))
     colors = ['#DBEEF4', '#93CDDD', '#4BACC6', '#215968']
     unique_years = crosstab_long['Year'].unique()
@@ -266,13 +327,9 @@ def plot_new_users(df_prep, data_fechamento, output_dir):
     ax.spines['bottom'].set_visible(True)
     ax.tick_params(axis='x', which='both', bottom=False)
 
-    for idx, row in crosstab_long.iterrows():
-        should_annotate = False
-        if row['Month'] == 'Dec': should_annotate = True
-        if row['Year'] == current_year_str and row['Month'] == current_month_en: should_annotate = True
-        if should_annotate:
-            v = row['Count']
-            ax.text(idx, v + 200, f"{v:,.0f}".replace(",", "."), color='black', ha='center', va='bottom', fontsize=12)
+    annotate = (crosstab_long['Month'] == 'Dec') | ((crosstab_long['Year'] == current_year_str) & (crosstab_long['Month'] == current_month_en))
+    for idx, v in crosstab_long.loc[annotate, 'Count'].items():
+        ax.text(idx, v + 200, f"{v:,.0f}".replace(",", "."), color='black', ha='center', va='bottom', fontsize=12)
 
     events = {
         'Mar 2020': 'Março 2020:\n OMS declara \n pandemia de COVID-19',
@@ -308,16 +365,24 @@ def plot_new_users(df_prep, data_fechamento, output_dir):
 
     plt.xticks(new_xticks_pos, new_xticks_labels, rotation=0)
 
-    if not os.path.exists(output_dir): os.makedirs(output_dir)
     save_path = os.path.join(output_dir, "PrEP_novosusuarios.png")
     try:
-        fig.savefig(save_path, facecolor='white', transparent=False, bbox_inches='tight')
+        _save_figure(fig, save_path, draft)
         print(f"Gráfico salvo: {save_path}")
+        return save_path
     except Exception as e:
         print(f"Erro ao salvar gráfico: {e}")
     finally:
         plt.close(fig)
 
+def active_column_counts(df_prep, col_name):
+    """Contagens da coluna entre os Em PrEP atualmente (todos, se não houver EmPrEP_Atual)."""
+    if 'EmPrEP_Atual' in df_prep.columns:
+        df_active = df_prep[df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente']
+    else:
+        df_active = df_prep
+    return df_active[col_name].value_counts()
+
 def plot_horizontal_bars(df_prep, col_name, filename, output_dir, color='#215968', show_percentage=False, filter_others=False):
     """
     Gera gráficos de barras horizontais para demografia.
@@ -326,20 +391,21 @@ def plot_horizontal_bars(df_prep, col_name, filename, output_dir, color='#215968
         print(f"Skipping plot {filename}: column {col_name} missing.")
         return
 
-    # Filtra apenas ativos
-    if 'EmPrEP_Atual' in df_prep.columns:
-        df_active = df_prep[df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente']
-    else:
-        df_active = df_prep
-        
-    counts = df_active[col_name].value_counts().sort_values(ascending=False)
+    counts = active_column_counts(df_prep, col_name).sort_values(ascending=False)
     
+    return render_horizontal_bars(counts, filename, output_dir, color=color, show_percentage=show_percentage, filter_others=filter_others)
+
+@cached_chart(STYLE_VERSION)
+def render_horizontal_bars(counts, filename, output_dir, color='#215968', show_percentage=False, filter_others=False, draft=False):
+    """
+    Desenha barras horizontais a partir de uma Series de contagens (categoria -> n).
+    """
     if filter_others and 'Outros' in counts.index:
         counts = counts.drop('Outros')
     
     if counts.empty: return
 
-    plt.rcParams.update(plt.rcParamsDefault)
+    _reset_style(draft)
     fig, ax = plt.subplots(figsize=(10, 6))
     
     bars = ax.barh(counts.index.astype(str), counts.values, color=color)
@@ -361,11 +427,11 @@ def plot_horizontal_bars(df_prep, col_name, filename, output_dir, color='#215968
     ax.xaxis.set_visible(False) 
     plt.tight_layout()
     
-    if not os.path.exists(output_dir): os.makedirs(output_dir)
     save_path = os.path.join(output_dir, filename)
     try:
-        fig.savefig(save_path, facecolor='white', transparent=False, bbox_inches='tight')
+        _save_figure(fig, save_path, draft)
         print(f"Gráfico salvo: {save_path}")
+        return save_path
     except Exception as e:
         print(f"Erro ao salvar {filename}: {e}")
     finally:
@@ -374,27 +440,28 @@ def plot_horizontal_bars(df_prep, col_name, filename, output_dir, color='#215968
 def plot_vertical_bars(df_prep, col_name, filename, output_dir, color='#254061', show_percentage=False, filter_ignored=False, custom_order=None):
     if df_prep.empty or col_name not in df_prep.columns: return
 
-    if 'EmPrEP_Atual' in df_prep.columns:
-        df_active = df_prep[df_prep['EmPrEP_Atual'] == 'Em PrEP atualmente']
-    else:
-        df_active = df_prep
-        
-    counts = df_active[col_name].value_counts()
+    counts = active_column_counts(df_prep, col_name)
     
+    return render_vertical_bars(counts, filename, output_dir, color=color, show_percentage=show_percentage,
+                         filter_ignored=filter_ignored, custom_order=custom_order)
+
+@cached_chart(STYLE_VERSION)
+def render_vertical_bars(counts, filename, output_dir, color='#254061', show_percentage=False, filter_ignored=False, custom_order=None, draft=False):
+    """
+    Desenha barras verticais a partir de uma Series de contagens (categoria -> n).
+    Categóricas (ex: fetar) seguem a ordem das categorias.
+    """
     if custom_order:
         counts = counts.reindex(custom_order).fillna(0)
     else:
-        if df_active[col_name].dtype.name == 'category':
-            counts = counts.sort_index()
-        else:
-            counts = counts.sort_index()
+        counts = counts.sort_index()
         
     if filter_ignored:
         counts = counts[~counts.index.astype(str).str.contains("Ignorada|Não informada", case=False, na=False)]
     
     if counts.empty: return
 
-    plt.rcParams.update(plt.rcParamsDefault)
+    _reset_style(draft)
     fig, ax = plt.subplots(figsize=(10, 6))
     
     bars = ax.bar(counts.index.astype(str), counts.values, color=color)
@@ -414,11 +481,11 @@ def plot_vertical_bars(df_prep, col_name, filename, output_dir, color='#254061',
     ax.yaxis.set_visible(False) 
     plt.tight_layout()
     
-    if not os.path.exists(output_dir): os.makedirs(output_dir)
     save_path = os.path.join(output_dir, filename)
     try:
-        fig.savefig(save_path, facecolor='white', transparent=False, bbox_inches='tight')
+        _save_figure(fig, save_path, draft)
         print(f"Gráfico salvo: {save_path}")
+        return save_path
     except Exception as e:
         print(f"Erro ao salvar {filename}: {e}")
     finally:
@@ -426,12 +493,21 @@ def plot_vertical_bars(df_prep, col_name, filename, output_dir, color='#254061',
 
 def plot_modalities(df_disp_semdupl, output_dir):
     print("Gerando gráfico: Modalidades (recomendadoXrealizado)...")
+    tab = modalities_table(df_disp_semdupl)
+    if tab is None: return
+    return render_modalities(tab, output_dir)
+
+def modalities_table(df_disp_semdupl):
+    """
+    Tabela Counts / Percentage (%) de recomendadoXrealizado (sem 'primeira dispensa').
+    Retorna None se a coluna não existir ou não houver dados.
+    """
     if df_disp_semdupl.empty or 'recomendadoXrealizado' not in df_disp_semdupl.columns:
         print("Aviso: Coluna 'recomendadoXrealizado' não encontrada para o gráfico.")
-        return
+        return None
 
-    filtered_data = df_disp_semdupl[df_disp_semdupl['recomendadoXrealizado'] != 'primeira dispensa'].copy()
-    if filtered_data.empty: return
+    filtered_data = df_disp_semdupl[df_disp_semdupl['recomendadoXrealizado'] != 'primeira dispensa']
+    if filtered_data.empty: return None
 
     value_counts2 = filtered_data['recomendadoXrealizado'].value_counts(dropna=True)
     value_counts_percentage2 = filtered_data['recomendadoXrealizado'].value_counts(dropna=True, normalize=True) * 100
@@ -442,9 +518,16 @@ def plot_modalities(df_disp_semdupl, output_dir):
         'Percentage (%)': value_counts_percentage2
     }).sort_values(by='Percentage (%)', ascending=False) # Maior embaixo (index 0 no barh fica na base)
 
+    return tab
+
+@cached_chart(STYLE_VERSION)
+def render_modalities(tab, output_dir, draft=False):
+    """
+    Desenha 'PrEP_modalidades.png' a partir da tabela Counts / Percentage (%).
+    """
     # 3. Plotting
 
-    plt.rcParams.update(plt.rcParamsDefault)
+    _reset_style(draft)
     fig, ax = plt.subplots(figsize=(12, 7))
     
     bars = ax.barh(tab.index.astype(str), tab['Percentage (%)'], color='teal')
@@ -469,12 +552,11 @@ def plot_modalities(df_disp_semdupl, output_dir):
     ax.spines['bottom'].set_visible(False)
     plt.tight_layout()
     
-    if not os.path.exists(output_dir): os.makedirs(output_dir)
-
     save_path = os.path.join(output_dir, "PrEP_modalidades.png")
     try:
-        fig.savefig(save_path, facecolor='white', transparent=False, bbox_inches='tight')
+        _save_figure(fig, save_path, draft)
         print(f"Gráfico salvo: {save_path}")
+        return save_path
     except Exception as e:
         print(f"Erro ao salvar modalidades: {e}")
     finally:
@@ -482,21 +564,17 @@ def plot_modalities(df_disp_semdupl, output_dir):
 
 def plot_ist_metrics(df_disp_semdupl, output_dir):
     print("Gerando gráfico: Métricas de IST...")
-    name_mapping = {
-        'st_ferida_vagina_penis': 'Feridas na vagina/ no pênis',
-        'st_ferida_anus': 'Feridas no ânus',
-        'st_verruga_vagina_penis': 'Verrugas na vagina/no pênis',
-        'st_verruga_anus': 'Verrugas no ânus',
-        'st_bolhas_vagina_penis': 'Pequenas bolhas na vagina/no pênis',
-        'st_bolhas_anus': 'Pequenas bolhas no ânus',
-        'st_corrimento_vaginal': 'Corrimento vaginal ou no canal uretral',
-        'st_sifilis': 'Diagnóstico de Sífilis',
-        'st_gonorreia_clamidia': 'Diagnóstico de Gonorréia/Clamídia Retal',
-        'st_suspeita_mpox': 'Suspeita de Mpox',
-        'st_diagnost_mpox' : 'Diagnóstico de Mpox'
-    }
-    cols_to_sum = [c for c in name_mapping.keys() if c in df_disp_semdupl.columns]
-    if not cols_to_sum: return
+    sums = ist_metrics_sums(df_disp_semdupl)
+    if sums is None: return
+    return render_ist_metrics(*sums, output_dir)
+
+def ist_metrics_sums(df_disp_semdupl):
+    """
+    Somas por coluna de IST (crescente) e denominador (registros com IST_autorrelato).
+    Retorna None se nenhuma coluna de IST existir.
+    """
+    cols_to_sum = [c for c in IST_NAME_MAPPING.keys() if c in df_disp_semdupl.columns]
+    if not cols_to_sum: return None
         
     column_sums = df_disp_semdupl[cols_to_sum].sum().sort_values(ascending=True)
     
@@ -506,10 +584,17 @@ def plot_ist_metrics(df_disp_semdupl, output_dir):
         denominator = len(df_disp_semdupl)
     if denominator == 0: denominator = 1 
 
-    plt.rcParams.update(plt.rcParamsDefault)
+    return column_sums, denominator
+
+@cached_chart(STYLE_VERSION)
+def render_ist_metrics(column_sums, denominator, output_dir, draft=False):
+    """
+    Desenha 'PrEP_IST.png' a partir das somas por coluna de IST e do denominador.
+    """
+    _reset_style(draft)
     fig, ax = plt.subplots(figsize=(10, 7))
     
-    y_labels = [name_mapping.get(idx, idx) for idx in column_sums.index]
+    y_labels = [IST_NAME_MAPPING.get(idx, idx) for idx in column_sums.index]
     bars = ax.barh(y_labels, column_sums.values, color='#953735')
     
     for bar in bars:
@@ -528,12 +613,11 @@ def plot_ist_metrics(df_disp_semdupl, output_dir):
     plt.tick_params(axis='y', which='both', left=False)
     plt.tight_layout()
     
-    if not os.path.exists(output_dir): os.makedirs(output_dir)
-        
     save_path = os.path.join(output_dir, "PrEP_IST.png")
     try:
-        fig.savefig(save_path, facecolor='white', transparent=False, bbox_inches='tight')
+        _save_figure(fig, save_path, draft)
         print(f"Gráfico salvo: {save_path}")
+        return save_path
     except Exception as e:
         print(f"Erro ao salvar IST: {e}")
     finally: